@@ -1,21 +1,1135 @@
 import tkinter as tk
-from tkinter import filedialog, simpledialog, messagebox
-from PIL import Image, ImageDraw
+from tkinter import filedialog, simpledialog, messagebox, ttk
+from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageColor, ImageTk, features
+from array import array
+from collections import deque, namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain
+import argparse
+import atexit
+import bisect
+import json
+import mmap
+import os
+import queue
 import random
+import math
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+try:
+    import numpy as np
+except ImportError:  # soft brushes need NumPy; without it they draw as plain lines
+    np = None
+
+
+# Canvas line options per brush; each drag becomes one polyline per layer
+BRUSH_STYLES = {
+    "pen": {"smooth": True, "capstyle": tk.ROUND, "joinstyle": tk.ROUND},
+    "pencil": {"smooth": False, "capstyle": tk.ROUND, "joinstyle": tk.ROUND},
+    "ink": {"smooth": True, "splinesteps": 24, "capstyle": tk.ROUND, "joinstyle": tk.ROUND},
+    "oil": {"smooth": True, "capstyle": tk.ROUND, "joinstyle": tk.ROUND},
+    "paint": {"smooth": False, "capstyle": tk.PROJECTING, "joinstyle": tk.MITER},
+}
+
+# Soft brushes are stamped into a coverage buffer instead: (dab shape, softness, flow per dab)
+RASTER_BRUSHES = {
+    "airbrush": ("round", 0.9, 0.12),
+    "marker": ("square", 0.25, 0.5),
+}
+
+TILE_SIZE = 256  # side of a raster tile, in document pixels
+POINTS_TO_PIXELS = 96 / 72
+AUTOSAVE_MS = 30000
+FRAME_MS = 16  # motion events are applied at most once per 60 Hz frame
+EXPORT_POLL_MS = 50  # how often the progress window checks on a running export
+SLIDER_MERGE_S = 0.5  # style slider steps closer together than this undo as one
+
+# Native document: magic + version, then chunks of (tag, payload length, payload)
+DOC_MAGIC = b"PAINTDOC"
+DOC_VERSION = 2  # 2: depth length is 16 bits (was 8)
+CHUNK = struct.Struct("<4sI")
+RECORD_HEAD = struct.Struct("<I4f")  # uid, bounding box
+
+
+class Stroke:
+    # One brush drag: raw points packed as x0, y0, x1, y1, ... in a float array
+    def __init__(self, brush, color, size):
+        self.brush = brush
+        self.color = color
+        self.size = size
+        self.items = []
+        self.depth = None  # stacking position, kept when items are re-created
+        self.layer = 0  # id of the layer the stroke is on
+        self.uid = None  # id in the saved document
+        self._points = array("f")
+        self._source = None  # (file map, offset, count) while the points are not loaded
+        self._shift = (0, 0)
+        self._bbox = None
+        self.raster = None  # soft brushes: [left, top, coverage, points stamped, mask image, stale box, unshown box]
+        self.photo = None  # soft brushes: the PhotoImage showing the stroke on the canvas
+        # Oil is three slightly offset layers of paint, the rest a single line
+        if brush == "oil":
+            self.offsets = [(random.randint(-2, 2), random.randint(-2, 2)) for _ in range(3)]
+        else:
+            self.offsets = [(0, 0)]
+
+    @property
+    def width(self):
+        return 1 if self.brush == "pencil" else self.size * 2
+
+    @property
+    def points(self):
+        if self._points is None:
+            # Strokes of an opened document are read from the file map on first use
+            mm, offset, count = self._source
+            self._points = array("f")
+            self._points.frombytes(mm[offset:offset + 8 * count])
+            if sys.byteorder == "big":
+                self._points.byteswap()
+            shift_points(self._points, *self._shift)
+            self._source, self._shift = None, (0, 0)
+        return self._points
+
+    @points.setter
+    def points(self, value):
+        self._points = value
+
+    def load_lazily(self, mm, offset, count, bbox):
+        self._points, self._source, self._bbox = None, (mm, offset, count), bbox
+
+    def add_point(self, x, y):
+        if self.brush == "pencil":
+            jitter = random.randint(-1, 1)
+            x, y = x + jitter, y + jitter
+        if len(self.points) >= 2 and self.points[-2] == x and self.points[-1] == y:
+            return False
+        self.points.extend((x, y))
+        self._bbox = None
+        return True
+
+    def piece(self, points):
+        # A stroke with the same look made from part of this one's points
+        stroke = Stroke(self.brush, self.color, self.size)
+        stroke.offsets = self.offsets
+        stroke.layer = self.layer
+        stroke.points = array("f", points)
+        return stroke
+
+    def translate(self, dx, dy):
+        self.raster = None
+        if self._points is None:
+            self._shift = (self._shift[0] + dx, self._shift[1] + dy)
+        else:
+            shift_points(self._points, dx, dy)
+        if self._bbox:
+            x1, y1, x2, y2 = self._bbox
+            self._bbox = (x1 + dx, y1 + dy, x2 + dx, y2 + dy)
+
+    def bbox(self):
+        if self._bbox is None:
+            pts = self.points
+            pad = self.width / 2 + max(max(abs(ox), abs(oy)) for ox, oy in self.offsets) + 1
+            self._bbox = (min(pts[0::2]) - pad, min(pts[1::2]) - pad,
+                          max(pts[0::2]) + pad, max(pts[1::2]) + pad)
+        return self._bbox
+
+    def coords(self, ox=0, oy=0, start=0):
+        # Tk needs at least two points, so a single click becomes a dot
+        pts = self.points if len(self.points) > 2 else self.points * 2
+        if start:
+            pts = pts[start:]
+        if not (ox or oy):
+            return list(pts)
+        return offset_points(pts, ox, oy)
+
+
+class Shape:
+    # A shape, text or emoji: the canvas item type, coords and options to recreate it.
+    # Bucket fills are kind "image": top-left corner, fill colour and an "L" mask.
+    def __init__(self, kind, points, options, mask=None):
+        self.kind = kind
+        self.points = array("f", points)
+        self.options = options
+        self.mask = mask
+        self.photo = None  # fills: the PhotoImage showing it on the canvas
+        self.items = []
+        self.depth = None
+        self.layer = 0
+        self.uid = None
+
+    def translate(self, dx, dy):
+        shift_points(self.points, dx, dy)
+
+    def bbox(self):
+        pts = self.points
+        if self.kind == "text":
+            family, size = self.options["font"]
+            left, top, right, bottom = pil_font(family, size).getbbox(self.options["text"], anchor="mm")
+            return (pts[0] + left, pts[1] + top, pts[0] + right, pts[1] + bottom)
+        if self.kind == "image":
+            return (pts[0], pts[1], pts[0] + self.mask.width, pts[1] + self.mask.height)
+        pad = self.options.get("width", 1) / 2 + 1
+        return (min(pts[0::2]) - pad, min(pts[1::2]) - pad, max(pts[0::2]) + pad, max(pts[1::2]) + pad)
+
+
+def shift_points(pts, dx, dy):
+    for i in range(0, len(pts), 2):
+        pts[i] += dx
+        pts[i + 1] += dy
+
+
+def offset_points(pts, dx, dy, scale=1):
+    return [(v + (dy if i % 2 else dx)) * scale for i, v in enumerate(pts)]
+
+
+def record_size(record):
+    # Approximate bytes held by a stroke or shape record
+    size = sys.getsizeof(record) + sys.getsizeof(record.points)
+    if isinstance(record, Shape):
+        size += sys.getsizeof(record.options)
+        if record.mask is not None:
+            size += record.mask.width * record.mask.height
+    elif record.raster is not None:
+        size += record.raster[2].nbytes
+    return size
+
+
+class Op:
+    # One undoable change stored as a delta: records added/removed (create, erase),
+    # a translation of some records (move) or option changes (style)
+    def __init__(self, kind):
+        self.kind = kind
+        self.added = []
+        self.removed = []
+        self.records = []
+        self.delta = (0, 0)
+        self.changes = []  # (record, option, old value, new value)
+        self.slider = False  # style change made by dragging a slider
+        self.time = time.monotonic()
+        self.size = 0
+
+    def measure(self):
+        self.size = (sys.getsizeof(self) + sum(map(record_size, self.added + self.removed))
+                     + sys.getsizeof(self.records) + 64 * len(self.changes))
+        return self.size
+
+
+class History:
+    # Bounded undo/redo log. When it grows past the memory budget the oldest
+    # operations are folded into the checkpoint, the earliest state undo reaches.
+    def __init__(self, budget=16 * 1024 * 1024):
+        self.budget = budget
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.size = 0
+        self.checkpoint = 0  # operations folded away so far
+
+    def push(self, op):
+        for old in self.redo_stack:
+            self.size -= old.size
+        self.redo_stack.clear()
+        last = self.undo_stack[-1] if self.undo_stack else None
+        if (op.kind == "style" and last and last.kind == "style"
+                and [c[:2] for c in op.changes] == [c[:2] for c in last.changes]
+                and ([c[3] for c in op.changes] == [c[3] for c in last.changes]
+                     or op.slider and last.slider and op.time - last.time < SLIDER_MERGE_S)):
+            # The same value again, or a slider still being dragged: keep one delta from the
+            # first old to the latest new value. Separate clicks stay separate undo steps.
+            last.changes = [c[:3] + n[3:] for c, n in zip(last.changes, op.changes)]
+            last.time = op.time
+            return
+        self.undo_stack.append(op)
+        self.size += op.measure()
+        while self.size > self.budget and len(self.undo_stack) > 1:
+            self.size -= self.undo_stack.popleft().size
+            self.checkpoint += 1
+
+    def undo(self):
+        if not self.undo_stack:
+            return None
+        op = self.undo_stack.pop()
+        self.redo_stack.append(op)
+        return op
+
+    def redo(self):
+        if not self.redo_stack:
+            return None
+        op = self.redo_stack.pop()
+        self.undo_stack.append(op)
+        return op
+
+    def stats(self):
+        count = len(self.undo_stack) + len(self.redo_stack)
+        per_op = self.size / count if count else 0
+        return f"History: {len(self.undo_stack)} ops, {self.size / 1024:.1f} KB ({per_op:.0f} B/op)"
+
+
+class SpatialGrid:
+    # Uniform grid of record bounding boxes, so hit-tests only look at nearby records.
+    # Boxes that would cover more than `max_cells` cells go in a second, coarse grid,
+    # so a stroke across a huge document costs a few dozen buckets, not 100000.
+    def __init__(self, cell=64, coarse=4096, max_cells=1024):
+        self.cell = cell
+        self.coarse = coarse
+        self.max_cells = max_cells
+        self.cells = {}
+        self.large = {}  # coarse buckets of the large boxes
+        self.boxes = {}
+
+    @staticmethod
+    def _keys(bbox, c):
+        for cx in range(int(bbox[0] // c), int(bbox[2] // c) + 1):
+            for cy in range(int(bbox[1] // c), int(bbox[3] // c) + 1):
+                yield cx, cy
+
+    @staticmethod
+    def _count(bbox, c):
+        return (int(bbox[2] // c) - int(bbox[0] // c) + 1) * (int(bbox[3] // c) - int(bbox[1] // c) + 1)
+
+    def _grid(self, bbox):
+        # (cell size, buckets) a box is filed under
+        if self._count(bbox, self.cell) > self.max_cells:
+            return self.coarse, self.large
+        return self.cell, self.cells
+
+    def insert(self, item, bbox):
+        if item in self.boxes:
+            self.remove(item)
+        self.boxes[item] = bbox
+        c, cells = self._grid(bbox)
+        for key in self._keys(bbox, c):
+            cells.setdefault(key, set()).add(item)
+
+    def remove(self, item):
+        bbox = self.boxes.pop(item, None)
+        if bbox is None:
+            return
+        c, cells = self._grid(bbox)
+        for key in self._keys(bbox, c):
+            bucket = cells[key]
+            bucket.discard(item)
+            if not bucket:
+                del cells[key]
+
+    def move(self, item, dx, dy):
+        x1, y1, x2, y2 = self.boxes[item]
+        self.insert(item, (x1 + dx, y1 + dy, x2 + dx, y2 + dy))
+
+    def query(self, x1, y1, x2, y2):
+        if self._count((x1, y1, x2, y2), self.cell) > len(self.boxes):
+            # Wider than there are records: checking every box is cheaper than walking the cells
+            return {item for item, b in self.boxes.items()
+                    if b[0] <= x2 and b[2] >= x1 and b[1] <= y2 and b[3] >= y1}
+        found = set()
+        for c, cells in ((self.cell, self.cells), (self.coarse, self.large)):
+            for key in self._keys((x1, y1, x2, y2), c):
+                for item in cells.get(key, ()):
+                    b = self.boxes[item]
+                    if b[0] <= x2 and b[2] >= x1 and b[1] <= y2 and b[3] >= y1:
+                        found.add(item)
+        return found
+
+    def extent(self):
+        if not self.boxes:
+            return None
+        boxes = self.boxes.values()
+        return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+class TileStore:
+    # The document's raster, split into TILE_SIZE squares that are created on first
+    # draw. Only the most recently used tiles stay in memory; the others are spilled
+    # to a temporary folder and read back when they are needed again.
+    def __init__(self, cache=64, render=None, mode="RGB"):
+        self.cache = cache
+        self.mode = mode
+        self.background = "white" if mode == "RGB" else (0, 0, 0, 0)
+        self.tiles = OrderedDict()  # (tx, ty) -> Image, least recently used first
+        self.spilled = set()
+        self.folder = None
+        self.render = render  # builds a tile from the document, for stale tiles
+        self.stale = set()  # tiles never rendered since the document was opened
+
+    @staticmethod
+    def keys(bbox):
+        x1, y1, x2, y2 = bbox
+        for tx in range(math.floor(x1 / TILE_SIZE), math.floor(x2 / TILE_SIZE) + 1):
+            for ty in range(math.floor(y1 / TILE_SIZE), math.floor(y2 / TILE_SIZE) + 1):
+                yield tx, ty
+
+    def get(self, key, create=False):
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            return tile
+        if key in self.spilled:
+            with open(self.path(key), "rb") as f:
+                tile = Image.frombytes(self.mode, (TILE_SIZE, TILE_SIZE), f.read())
+            self.spilled.discard(key)
+        elif key in self.stale:
+            self.stale.discard(key)
+            tile = self.render(key)
+            if tile is None:
+                return self.get(key, create)
+        elif create:
+            tile = Image.new(self.mode, (TILE_SIZE, TILE_SIZE), self.background)
+        else:
+            return None
+        self.tiles[key] = tile
+        while len(self.tiles) > self.cache:
+            self.spill(*self.tiles.popitem(last=False))
+        return tile
+
+    def spill(self, key, tile):
+        if self.folder is None:
+            self.folder = tempfile.mkdtemp(prefix="paint-tiles-")
+            atexit.register(shutil.rmtree, self.folder, True)
+        with open(self.path(key), "wb") as f:
+            f.write(tile.tobytes())
+        self.spilled.add(key)
+
+    def path(self, key):
+        return os.path.join(self.folder, "%d_%d.raw" % key)
+
+    def crop(self, bbox):
+        x1, y1, x2, y2 = bbox
+        image = Image.new("RGB", (x2 - x1, y2 - y1), "white")
+        for tx, ty in self.keys((x1, y1, x2 - 1, y2 - 1)):
+            tile = self.get((tx, ty))
+            if tile is not None:
+                image.paste(tile, (tx * TILE_SIZE - x1, ty * TILE_SIZE - y1))
+        return image
+
+    def known(self):
+        return set(self.tiles) | self.spilled | self.stale
+
+    def invalidate(self, keys):
+        # Forget these tiles; `render` rebuilds them when they are next needed
+        for key in keys:
+            self.tiles.pop(key, None)
+            self.spilled.discard(key)
+            self.stale.add(key)
+
+    def close(self):
+        # Drop the spill folder now; pool workers exit without running atexit
+        if self.folder:
+            shutil.rmtree(self.folder, True)
+            self.folder = None
+        self.tiles.clear()
+        self.spilled.clear()
+
+
+class Layer:
+    # One level of the layer stack; its records carry its id and its raster has its own tiles
+    def __init__(self, layer_id, name, visible=True, opacity=1.0):
+        self.id = layer_id
+        self.name = name
+        self.visible = visible
+        self.opacity = opacity
+        self.tiles = None
+
+    def info(self):
+        return {"id": self.id, "name": self.name, "visible": self.visible, "opacity": self.opacity}
+
+
+def faded(image, opacity):
+    # An RGBA tile with its alpha scaled by the layer's opacity
+    if opacity >= 1:
+        return image
+    image = image.copy()
+    image.putalpha(image.getchannel("A").point(lambda a: round(a * opacity)))
+    return image
+
+
+def segment_distance(px, py, x1, y1, x2, y2):
+    dx, dy = x2 - x1, y2 - y1
+    length = dx * dx + dy * dy
+    t = 0 if length == 0 else max(0, min(1, ((px - x1) * dx + (py - y1) * dy) / length))
+    return ((px - x1 - t * dx) ** 2 + (py - y1 - t * dy) ** 2) ** 0.5
+
+
+def polyline_distance(px, py, pts):
+    if len(pts) < 4:
+        return segment_distance(px, py, pts[0], pts[1], pts[0], pts[1])
+    return min(segment_distance(px, py, pts[i], pts[i + 1], pts[i + 2], pts[i + 3])
+               for i in range(0, len(pts) - 2, 2))
+
+
+def outline_points(shape):
+    # Closed outline of a shape record as a flat polyline
+    pts = list(shape.points)
+    if shape.kind == "rectangle":
+        x1, y1, x2, y2 = pts
+        return [x1, y1, x2, y1, x2, y2, x1, y2, x1, y1]
+    if shape.kind == "oval":
+        cx, cy = (pts[0] + pts[2]) / 2, (pts[1] + pts[3]) / 2
+        rx, ry = abs(pts[2] - pts[0]) / 2, abs(pts[3] - pts[1]) / 2
+        return [v for k in range(33) for v in (cx + rx * math.cos(k * math.pi / 16),
+                                                cy + ry * math.sin(k * math.pi / 16))]
+    if shape.kind == "polygon":
+        return pts + pts[:2]
+    return pts
+
+
+def clip_polyline(pts, cx, cy, r):
+    # Split a flat polyline into the runs lying outside the circle (cx, cy, r).
+    # Returns None when the circle does not touch the polyline at all.
+    if len(pts) == 2:
+        return None if (pts[0] - cx) ** 2 + (pts[1] - cy) ** 2 > r * r else []
+    runs, run, clipped = [], None, False
+    for i in range(0, len(pts) - 2, 2):
+        x1, y1, x2, y2 = pts[i], pts[i + 1], pts[i + 2], pts[i + 3]
+        dx, dy = x2 - x1, y2 - y1
+        a = dx * dx + dy * dy
+        b = 2 * (dx * (x1 - cx) + dy * (y1 - cy))
+        c = (x1 - cx) ** 2 + (y1 - cy) ** 2 - r * r
+        disc = b * b - 4 * a * c
+        if a == 0 or disc <= 0:
+            pieces = [] if c <= 0 else [(0, 1)]
+        else:
+            t1, t2 = (-b - disc ** 0.5) / (2 * a), (-b + disc ** 0.5) / (2 * a)
+            pieces = [(t0, t1) for t0, t1 in ((0, min(t1, 1)), (max(t2, 0), 1)) if t1 - t0 > 1e-6]
+        if pieces != [(0, 1)]:
+            clipped = True
+        for t0, t1 in pieces:
+            if t0 > 0 or run is None:
+                run = [x1 + t0 * dx, y1 + t0 * dy]
+                runs.append(run)
+            run += [x1 + t1 * dx, y1 + t1 * dy]
+        if not pieces or pieces[-1][1] < 1:
+            run = None
+    return runs if clipped else None
+
+
+@lru_cache(maxsize=None)
+def to_rgb(color):
+    return ImageColor.getrgb(color)[:3] if color else None
+
+
+@lru_cache(maxsize=None)
+def pil_font(family, size):
+    px = max(1, round(size * POINTS_TO_PIXELS))
+    try:
+        return ImageFont.truetype(family, px)
+    except OSError:
+        return ImageFont.load_default(px)
+
+
+def raster_line(draw, pts, color, width, capstyle=tk.ROUND):
+    # Mirror a canvas line (flat x, y list) into a PIL ImageDraw
+    xy = list(zip(pts[0::2], pts[1::2]))
+    width = round(width)
+    if len(xy) > 1:
+        draw.line(xy, fill=color, width=width)
+    if width > 2 and capstyle != tk.BUTT:
+        r = (width - 1) / 2
+        cap = draw.ellipse if capstyle == tk.ROUND else draw.rectangle
+        for x, y in xy:
+            cap((x - r, y - r, x + r, y + r), fill=color)
+
+
+def is_soft(record):
+    return np is not None and isinstance(record, Stroke) and record.brush in RASTER_BRUSHES
+
+
+def is_image(record):
+    # Records shown as a canvas image item rather than a line or shape
+    return is_soft(record) or isinstance(record, Shape) and record.kind == "image"
+
+
+@lru_cache(maxsize=64)
+def stamp_mask(diameter, shape, softness, flow):
+    # log(1 - alpha) of one dab: overlapping dabs then simply add up
+    r = diameter / 2
+    axis = np.arange(diameter) - (diameter - 1) / 2
+    if shape == "square":
+        dist = np.maximum(abs(axis)[:, None], abs(axis)[None, :]) / r
+    else:
+        dist = np.hypot(axis[:, None], axis[None, :]) / r
+    alpha = np.clip((1 - dist) / softness, 0, 1)
+    alpha = alpha * alpha * (3 - 2 * alpha)  # smooth falloff towards the edge
+    return np.log1p(-flow * alpha).astype(np.float32)
+
+
+def stamp_centres(pts, spacing, first):
+    # Dab centres every `spacing` pixels along a polyline, the first point itself only if `first`
+    p = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+    seg = np.diff(p, axis=0)
+    counts = np.maximum(1, np.ceil(np.hypot(seg[:, 0], seg[:, 1]) / spacing)).astype(np.intp)
+    which = np.repeat(np.arange(len(seg)), counts)
+    step = np.arange(len(which)) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    centres = p[which] + seg[which] * (step / counts[which])[:, None]
+    return np.vstack([p[:1], centres]) if first else centres
+
+
+def stamp_stroke(stroke):
+    # Bring a soft stroke's coverage up to date, stamping only the points added since last time
+    shape, softness, flow = RASTER_BRUSHES[stroke.brush]
+    diameter = max(1, round(stroke.width))
+    pts = stroke.points
+    count = len(pts) // 2
+    if stroke.raster is None:
+        stroke.raster = [0, 0, np.zeros((0, 0), np.float32), 0, None, None, None]
+        first, new = True, pts
+    elif stroke.raster[3] == count:
+        return stroke.raster
+    else:
+        first, new = False, pts[2 * stroke.raster[3] - 2:]
+    corners = np.rint(stamp_centres(new, max(1.0, diameter * 0.15), first) - diameter / 2).astype(np.intp)
+    left, top, cover, _, mask, stale, unshown = stroke.raster
+    h, w = cover.shape
+    x1, y1 = corners.min(axis=0)
+    x2, y2 = corners.max(axis=0) + diameter
+    # Stale: not yet in the mask image. Unshown: not yet on the canvas.
+    stale, unshown = (box and (min(box[0], x1), min(box[1], y1), max(box[2], x2), max(box[3], y2))
+                      or (x1, y1, x2, y2) for box in (stale, unshown))
+    if not cover.size or x1 < left or y1 < top or x2 > left + w or y2 > top + h:
+        # Grow the sides that overflow, with slack so a stroke heading one way doesn't
+        # reallocate every frame
+        sx, sy = (0, 0) if first and count > 1 else (max(64, w // 4), max(64, h // 4))
+        if cover.size:
+            x1 = left if x1 >= left else x1 - sx
+            y1 = top if y1 >= top else y1 - sy
+            x2 = left + w if x2 <= left + w else x2 + sx
+            y2 = top + h if y2 <= top + h else y2 + sy
+        else:
+            x1, y1, x2, y2 = x1 - sx, y1 - sy, x2 + sx, y2 + sy
+        grown = np.zeros((y2 - y1, x2 - x1), np.float32)
+        new_left, new_top = x1, y1
+        grown[top - new_top:top - new_top + h, left - new_left:left - new_left + w] = cover
+        left, top, cover, mask = new_left, new_top, grown, None
+    # Every dab of the batch in one scatter-add
+    rows = (corners[:, 1] - top)[:, None, None] + np.arange(diameter)[None, :, None]
+    cols = (corners[:, 0] - left)[:, None, None] + np.arange(diameter)[None, None, :]
+    np.add.at(cover, (rows, cols), stamp_mask(diameter, shape, softness, flow))
+    stroke.raster = [left, top, cover, count, mask, stale, unshown]
+    return stroke.raster
+
+
+def raster_mask(stroke):
+    # (left, top, "L" image) of a soft stroke's coverage, for pasting its colour through;
+    # only the part stamped since the last call is converted again
+    left, top, cover, _, mask, stale, _ = stamp_stroke(stroke)
+    if mask is None:
+        mask = Image.fromarray(np.rint(-np.expm1(cover) * 255).astype(np.uint8))
+    elif stale:
+        x1, y1, x2, y2 = (int(v) for v in (stale[0] - left, stale[1] - top, stale[2] - left, stale[3] - top))
+        mask.paste(Image.fromarray(np.rint(-np.expm1(cover[y1:y2, x1:x2]) * 255).astype(np.uint8)), (x1, y1))
+    stroke.raster[4:6] = [mask, None]
+    return left, top, mask
+
+
+def photo_patch(mask, color, opacity, size, box):
+    # A coverage mask in `color`, scaled to `size`: only the photo pixels that `box` (mask
+    # pixels) touches, as (x, y, image), or None when it touches none
+    fx, fy = mask.width / size[0], mask.height / size[1]
+    x1, y1 = max(0, math.floor(box[0] / fx)), max(0, math.floor(box[1] / fy))
+    x2, y2 = min(size[0], math.ceil(box[2] / fx)), min(size[1], math.ceil(box[3] / fy))
+    if x1 >= x2 or y1 >= y2:
+        return None
+    # Crop the mask with room for the resampling filter to reach, then scale just that
+    pad = math.ceil(2 * max(fx, fy, 1)) + 1
+    sx1, sy1 = max(0, math.floor(x1 * fx) - pad), max(0, math.floor(y1 * fy) - pad)
+    sx2, sy2 = min(mask.width, math.ceil(x2 * fx) + pad), min(mask.height, math.ceil(y2 * fy) + pad)
+    part = mask.crop((sx1, sy1, sx2, sy2))
+    image = Image.new("RGBA", part.size, to_rgb(color))
+    image.putalpha(part if opacity >= 1 else part.point(lambda a: round(a * opacity)))
+    if (fx, fy) == (1, 1):
+        return x1, y1, image.crop((x1 - sx1, y1 - sy1, x2 - sx1, y2 - sy1))
+    return x1, y1, image.resize((x2 - x1, y2 - y1), box=(x1 * fx - sx1, y1 * fy - sy1, x2 * fx - sx1, y2 * fy - sy1))
+
+
+def fill_mask(image, x, y, tolerance):
+    # Pixels connected to (x, y) whose colour is within `tolerance` of it in every channel.
+    # Each row is cut into runs of matching pixels and the flood walks runs, not pixels.
+    seed = image.getpixel((x, y))
+    bands = [band.point([255 if abs(v - c) <= tolerance else 0 for v in range(256)])
+             for band, c in zip(image.split(), seed)]
+    similar = np.asarray(ImageChops.darker(ImageChops.darker(bands[0], bands[1]), bands[2])) > 0
+    h, w = similar.shape
+    stride = w + 1
+    # Run starts and ends as flat indices into rows of w + 1 (the extra column keeps rows apart)
+    edges = np.flatnonzero(np.diff(np.pad(similar, ((0, 0), (1, 1))).view(np.int8), axis=1))
+    starts, ends = edges[0::2], edges[1::2]
+    # For every run, the range of runs touching it in the row below and the row above
+    below_lo = np.searchsorted(ends, starts + stride, "right").tolist()
+    below_hi = np.searchsorted(starts, ends + stride, "left").tolist()
+    above_lo = np.searchsorted(ends, starts - stride, "right").tolist()
+    above_hi = np.searchsorted(starts, ends - stride, "left").tolist()
+    first = int(np.searchsorted(ends, y * stride + x, "right"))
+    filled = bytearray(len(starts))
+    filled[first] = 1
+    todo = [first]
+    while todo:
+        run = todo.pop()
+        for other in chain(range(below_lo[run], below_hi[run]), range(above_lo[run], above_hi[run])):
+            if not filled[other]:
+                filled[other] = 1
+                todo.append(other)
+    # Paint the filled runs back as +1/-1 steps and integrate along the rows
+    chosen = np.frombuffer(filled, np.uint8).astype(bool)
+    steps = np.zeros(h * stride + 1, np.int8)
+    steps[starts[chosen]] = 1
+    steps[ends[chosen]] = -1
+    return (np.cumsum(steps[:-1], dtype=np.int8).reshape(h, stride)[:, :w] > 0)
+
+
+def composite_at(image, patch, x, y):
+    # alpha_composite that also takes patches hanging off the top or left edge
+    if -x < patch.width and -y < patch.height:
+        image.alpha_composite(patch, (max(0, x), max(0, y)), (max(0, -x), max(0, -y)))
+
+
+def raster_record(image, record, dx=0, dy=0):
+    # Draw a stroke or shape record into a PIL image whose origin is at document (-dx, -dy)
+    if is_soft(record):
+        left, top, mask = raster_mask(record)
+        patch = Image.new("RGBA", mask.size, to_rgb(record.color))
+        patch.putalpha(mask)
+        composite_at(image, patch, int(left + dx), int(top + dy))
+        return
+    if isinstance(record, Shape) and record.kind == "image":
+        patch = Image.new("RGBA", record.mask.size, to_rgb(record.options["fill"]))
+        patch.putalpha(record.mask)
+        composite_at(image, patch, round(record.points[0] + dx), round(record.points[1] + dy))
+        return
+    draw = ImageDraw.Draw(image)
+    if isinstance(record, Stroke):
+        capstyle = BRUSH_STYLES.get(record.brush, BRUSH_STYLES["pen"])["capstyle"]
+        for ox, oy in record.offsets:
+            raster_line(draw, record.coords(ox + dx, oy + dy), to_rgb(record.color), record.width, capstyle)
+        return
+    pts = offset_points(record.points, dx, dy)
+    options = record.options
+    width = options.get("width", 1)
+    fill, outline = to_rgb(options.get("fill", "")), to_rgb(options.get("outline", ""))
+    if record.kind in ("rectangle", "oval"):  # Tk takes the corners in any order, PIL doesn't
+        x1, y1, x2, y2 = pts
+        pts = [min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)]
+    if record.kind == "line":
+        raster_line(draw, pts, fill, width, options.get("capstyle", tk.BUTT))
+    elif record.kind == "rectangle":
+        draw.rectangle(pts, fill=fill, outline=outline, width=width)
+    elif record.kind == "oval":
+        draw.ellipse(pts, fill=fill, outline=outline, width=width)
+    elif record.kind == "polygon":
+        draw.polygon(pts, fill=fill, outline=outline, width=width)
+    elif record.kind == "text" and image.mode == "RGBA":
+        # Drawn on its own patch first: antialiasing would blend towards an empty layer's black
+        font = pil_font(*options["font"])
+        x1, y1, x2, y2 = (math.floor(v) for v in draw.textbbox(pts, options["text"], font=font, anchor="mm"))
+        patch = Image.new("RGBA", (x2 - x1 + 2, y2 - y1 + 2), fill + (0,))
+        ImageDraw.Draw(patch).text((pts[0] - x1, pts[1] - y1), options["text"], fill=fill, font=font,
+                                   anchor="mm", embedded_color=True)
+        composite_at(image, patch, x1, y1)
+    elif record.kind == "text":
+        draw.text(pts, options["text"], fill=fill, font=pil_font(*options["font"]),
+                  anchor="mm", embedded_color=True)
+
+
+def pack_str(text):
+    data = text.encode("utf-8")
+    return struct.pack("<H", len(data)) + data
+
+
+def unpack_str(buf, pos):
+    (length,) = struct.unpack_from("<H", buf, pos)
+    return bytes(buf[pos + 2:pos + 2 + length]).decode("utf-8"), pos + 2 + length
+
+
+def packed_mask(mask):
+    data = mask.convert("1").tobytes()
+    return struct.pack("<III", mask.width, mask.height, len(data)) + data
+
+
+def packed_points(points):
+    if sys.byteorder == "big":
+        points = array("f", points)
+        points.byteswap()
+    return struct.pack("<I", len(points) // 2) + points.tobytes()
+
+
+def depth_count(version):
+    return struct.Struct("<B" if version < 2 else "<H")
+
+
+def record_chunk(record, version=DOC_VERSION):
+    # Fixed head (uid, bbox, depth) so a document can be indexed without reading points
+    head = RECORD_HEAD.pack(record.uid, *record.bbox())
+    head += depth_count(version).pack(len(record.depth)) + struct.pack("<%dI" % len(record.depth), *record.depth)
+    if isinstance(record, Stroke):
+        tag = b"STRK"
+        body = (pack_str(record.brush) + pack_str(record.color)
+                + struct.pack("<HB", record.size, len(record.offsets))
+                + b"".join(struct.pack("<bb", ox, oy) for ox, oy in record.offsets)
+                + packed_points(record.points))
+    else:
+        tag = b"SHAP"
+        body = pack_str(record.kind) + pack_str(json.dumps(record.options)) + packed_points(record.points)
+        if record.mask is not None:
+            body += packed_mask(record.mask)
+    body += struct.pack("<H", record.layer)  # after the points, so older files just end without it
+    return CHUNK.pack(tag, len(head) + len(body)) + head + body
+
+
+def layers_chunk(layers):
+    data = json.dumps([layer.info() for layer in layers]).encode("utf-8")
+    return CHUNK.pack(b"LAYR", len(data)) + data
+
+
+def read_record(mm, tag, pos, end, version=DOC_VERSION):
+    uid, x1, y1, x2, y2 = RECORD_HEAD.unpack_from(mm, pos)
+    pos += RECORD_HEAD.size
+    count = depth_count(version)
+    (n,) = count.unpack_from(mm, pos)
+    depth = struct.unpack_from("<%dI" % n, mm, pos + count.size)
+    pos += count.size + 4 * n
+    if tag == b"STRK":
+        brush, pos = unpack_str(mm, pos)
+        color, pos = unpack_str(mm, pos)
+        size, n = struct.unpack_from("<HB", mm, pos)
+        offsets = [struct.unpack_from("<bb", mm, pos + 3 + 2 * i) for i in range(n)]
+        (count,) = struct.unpack_from("<I", mm, pos + 3 + 2 * n)
+        record = Stroke(brush, color, size)
+        record.offsets = offsets
+        record.load_lazily(mm, pos + 7 + 2 * n, count, (x1, y1, x2, y2))
+        pos += 7 + 2 * n + 8 * count
+    else:
+        kind, pos = unpack_str(mm, pos)
+        options, pos = unpack_str(mm, pos)
+        options = json.loads(options)
+        if "font" in options:
+            options["font"] = tuple(options["font"])
+        (count,) = struct.unpack_from("<I", mm, pos)
+        points = array("f")
+        points.frombytes(mm[pos + 4:pos + 4 + 8 * count])
+        if sys.byteorder == "big":
+            points.byteswap()
+        pos += 4 + 8 * count
+        mask = None
+        if kind == "image":
+            w, h, n = struct.unpack_from("<III", mm, pos)
+            mask = Image.frombytes("1", (w, h), bytes(mm[pos + 12:pos + 12 + n])).convert("L")
+            pos += 12 + n
+        record = Shape(kind, points, options, mask)
+    if pos + 2 <= end:
+        (record.layer,) = struct.unpack_from("<H", mm, pos)
+    record.uid, record.depth = uid, depth
+    return record
+
+
+def save_document(path, records, layers):
+    with open(path + ".tmp", "wb") as f:
+        f.write(DOC_MAGIC + struct.pack("<H", DOC_VERSION))
+        f.write(layers_chunk(layers))
+        for record in records:
+            f.write(record_chunk(record))
+    os.replace(path + ".tmp", path)
+
+
+def append_document(path, records, deleted, moved, layers=None):
+    # Autosave: append what changed since the last write; later chunks win on load.
+    # Records are written in the format of the version the file started with.
+    with open(path, "rb") as f:
+        (version,) = struct.unpack("<H", f.read(len(DOC_MAGIC) + 2)[len(DOC_MAGIC):])
+    chunks = [record_chunk(record, version) for record in records]
+    if layers:
+        chunks.append(layers_chunk(layers))
+    if deleted:
+        chunks.append(CHUNK.pack(b"DELE", 4 + 4 * len(deleted))
+                      + struct.pack("<I%dI" % len(deleted), len(deleted), *deleted))
+    if moved:
+        chunks.append(CHUNK.pack(b"MOVE", 4 + 12 * len(moved)) + struct.pack("<I", len(moved))
+                      + b"".join(struct.pack("<Iff", *move) for move in moved))
+    with open(path, "ab") as f:
+        f.write(b"".join(chunks))
+
+
+def load_document(path):
+    # Map the file and replay its chunks; stroke points stay in the map until used
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mm[:len(DOC_MAGIC)] != DOC_MAGIC:
+        mm.close()
+        raise ValueError("not a paint document")
+    records = {}
+    layers = None  # documents from before layers have none
+    (version,) = struct.unpack_from("<H", mm, len(DOC_MAGIC))
+    pos = len(DOC_MAGIC) + 2
+    while pos + CHUNK.size <= len(mm):
+        tag, length = CHUNK.unpack_from(mm, pos)
+        pos += CHUNK.size
+        if pos + length > len(mm):
+            break  # an autosave that was cut off
+        if tag in (b"STRK", b"SHAP"):
+            record = read_record(mm, tag, pos, pos + length, version)
+            records[record.uid] = record
+        elif tag == b"LAYR":
+            layers = json.loads(bytes(mm[pos:pos + length]).decode("utf-8"))
+        elif tag == b"DELE":
+            (n,) = struct.unpack_from("<I", mm, pos)
+            for uid in struct.unpack_from("<%dI" % n, mm, pos + 4):
+                records.pop(uid, None)
+        elif tag == b"MOVE":
+            (n,) = struct.unpack_from("<I", mm, pos)
+            for i in range(n):
+                uid, dx, dy = struct.unpack_from("<Iff", mm, pos + 4 + 12 * i)
+                if uid in records:
+                    records[uid].translate(dx, dy)
+        pos += length
+    return list(records.values()), mm, layers
+
+
+# ---------------------- EXPORT ----------------------
+
+# Extension -> (PIL format, encoder option the quality setting maps to, its lowest, highest and default value)
+EXPORT_FORMATS = {
+    "png": ("PNG", "compress_level", 0, 9, 6),
+    "jpg": ("JPEG", "quality", 1, 95, 90),
+    "webp": ("WEBP", "quality", 1, 100, 90),
+}
+if not features.check("webp"):
+    del EXPORT_FORMATS["webp"]
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class ExportWriter:
+    # File object for the encoder: counts bytes and stops the encode between chunks once cancelled.
+    # It has no fileno(), so PIL writes chunk by chunk through write() instead of straight to the fd.
+    def __init__(self, f, cancelled, progress):
+        self.f = f
+        self.cancelled = cancelled
+        self.progress = progress
+        self.written = 0
+
+    def write(self, data):
+        if self.cancelled():
+            raise ExportCancelled
+        self.written += len(data)
+        self.progress(self.written)
+        return self.f.write(data)
+
+    def tell(self):
+        return self.f.tell()
+
+    def seek(self, *args):
+        return self.f.seek(*args)
+
+    def flush(self):
+        self.f.flush()
+
+
+def thumbnail_path(target, size):
+    base, ext = os.path.splitext(target)
+    return f"{base}_{size}{ext}"
+
+
+def write_export(image, target, fmt, quality=None, thumbnails=(), cancelled=lambda: False, progress=None):
+    # Encode `image` and its thumbnails (largest first, each shrunk from the one before) to `target`.
+    # progress(fraction, path, bytes) is weighted by pixels; files only appear once fully written.
+    pil_format, option, low, high, default = EXPORT_FORMATS[fmt]
+    options = {option: min(high, max(low, default if quality is None else quality))}
+    if pil_format == "PNG":
+        options["optimize"] = False  # optimize ignores compress_level and retries every filter
+    if image.mode != "RGB" and pil_format == "JPEG":
+        image = image.convert("RGB")
+    outputs, current = [(target, image)], image
+    for size in sorted(set(thumbnails), reverse=True):
+        if size < max(current.size):
+            current = current.copy()
+            current.thumbnail((size, size), Image.LANCZOS)
+        outputs.append((thumbnail_path(target, size), current))
+    total = sum(im.width * im.height for _, im in outputs)
+    done = 0
+    for path, im in outputs:
+        if cancelled():
+            raise ExportCancelled
+        share = im.width * im.height
+        report = (lambda n, path=path: progress(done / total, path, n)) if progress else (lambda n: None)
+        report(0)
+        try:
+            with open(path + ".part", "wb") as f:
+                im.save(ExportWriter(f, cancelled, report), pil_format, **options)
+            os.replace(path + ".part", path)
+        except BaseException:
+            if os.path.exists(path + ".part"):
+                os.remove(path + ".part")
+            raise
+        done += share
+        if progress:
+            progress(done / total, path, None)
+    return [path for path, _ in outputs]
+
+
+# ---------------------- HEADLESS ----------------------
+
+# Recorded sessions are JSON lists of events, coordinates in document pixels:
+#   ["click", x, y] (["click", x, y, text] for the text tool), ["drag", x, y], ["release", x, y],
+#   ["tool", name], ["brush", name], ["color", name], ["size", n], ["emoji", e],
+#   ["style", kind, value], ["undo"], ["redo"], ["add_layer"], ["layer", id], ["layer_visible", id, shown],
+#   ["layer_opacity", id, opacity], ["layer_move", id, step], ["tolerance", n]
+REPLAY_MOUSE = {"click": "on_click", "drag": "paint", "release": "on_release"}
+REPLAY_ACTIONS = {"tool": "set_tool", "brush": "set_brush", "color": "set_color", "size": "set_brush_size",
+                  "emoji": "set_emoji", "style": "apply_style", "undo": "undo", "redo": "redo",
+                  "add_layer": "add_layer", "layer": "select_layer", "layer_visible": "set_layer_visible",
+                  "layer_opacity": "set_layer_opacity", "layer_move": "move_layer", "tolerance": "set_fill_tolerance"}
+ReplayEvent = namedtuple("ReplayEvent", "x y")
+
+
+class HeadlessRoot:
+    # Stands in for tk.Tk: nothing is scheduled, idle work runs at once
+    def title(self, text):
+        pass
+
+    def bind(self, sequence, callback):
+        pass
+
+    def after(self, ms, callback):
+        pass
+
+    def after_idle(self, callback):
+        callback()
+
+    def quit(self):
+        pass
+
+
+class HeadlessCanvas:
+    # Stands in for tk.Canvas: items only get ids, the picture comes from the tiles
+    def __init__(self, width=800, height=600):
+        self.size = {"width": width, "height": height}
+        self.last_item = 0
+        self.items = set()
+
+    def __getitem__(self, option):
+        return self.size[option]
+
+    def winfo_width(self):
+        return self.size["width"]
+
+    def winfo_height(self):
+        return self.size["height"]
+
+    def create(self, *args, **options):
+        self.last_item += 1
+        self.items.add(self.last_item)
+        return self.last_item
+
+    create_line = create_rectangle = create_oval = create_polygon = create_text = create_image = create
+
+    def delete(self, *items):
+        self.items.difference_update(items)
+
+    def find_all(self):
+        return tuple(sorted(self.items))
+
+    def ignore(self, *args, **options):
+        pass
+
+    coords = move = itemconfig = tag_lower = tag_raise = bind = pack = ignore
+
+
+def replay_session(events, seed=0):
+    # Drive the drawing logic with a recorded session; oil offsets are random, so seed them
+    random.seed(seed)
+    app = PaintApp(HeadlessRoot(), HeadlessCanvas())
+    for name, *args in events:
+        if name in REPLAY_MOUSE:
+            app.replay_text = args[2] if len(args) > 2 else None
+            getattr(app, REPLAY_MOUSE[name])(ReplayEvent(args[0], args[1]))
+        elif name in REPLAY_ACTIONS:
+            getattr(app, REPLAY_ACTIONS[name])(*args)
+        else:
+            raise ValueError(f"unknown event {name!r}")
+    app.flush_dirty()
+    return app
+
+
+def render_session(events, seed=0):
+    # The session's whole document as a PIL image (numpy.asarray() it for an array)
+    app = replay_session(events, seed)
+    try:
+        return app.tiles.crop(app.document_bounds())
+    finally:
+        app.close_tiles()
+
+
+def export_session(job):
+    # Pool worker: one session file to one image file; returns (source, error or None)
+    source, target, thumbnail, quality, thumbnails = job
+    try:
+        with open(source, encoding="utf-8") as f:
+            image = render_session(json.load(f))
+        if thumbnail:
+            image.thumbnail((thumbnail, thumbnail))
+        write_export(image, target, os.path.splitext(target)[1][1:], quality, thumbnails)
+    except (OSError, ValueError, TypeError, IndexError, KeyError, AttributeError) as e:
+        return source, f"{type(e).__name__}: {e}"
+    return source, None
+
+
+def export_batch(sources, out_dir, fmt="png", thumbnail=None, workers=None, quality=None, thumbnails=()):
+    # Render many sessions in parallel, yielding (source, error or None) in input order
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(source, os.path.join(out_dir, os.path.splitext(os.path.basename(source))[0] + "." + fmt),
+             thumbnail, quality, thumbnails) for source in sources]
+    workers = workers or os.cpu_count() or 1
+    # Batch the jobs so thousands of small sessions don't cost a round trip each
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(workers) as pool:
+        yield from pool.map(export_session, jobs, chunksize=chunksize)
 
 
 class PaintApp:
-    def __init__(self, root):
+    def __init__(self, root, canvas=None):
         self.root = root
         self.root.title("Ultimate Paint App")
+        self.headless = canvas is not None
+        self.recording = None  # list of events while recording a session for replay
+        self.replay_text = None  # headless answer to the text tool's prompt
 
-        # Canvas
-        self.canvas = tk.Canvas(root, bg="white", width=800, height=600)
+        # Canvas: a pan/zoom viewport onto an unbounded document
+        self.canvas = canvas or tk.Canvas(root, bg="white", width=800, height=600)
         self.canvas.pack(fill=tk.BOTH, expand=True)
+        self.zoom = 1.0
+        self.origin = (0.0, 0.0)  # document point at the canvas' top-left corner
+        self.visible = set()  # records that currently have canvas items
+        self.stacked = []  # (stack key, id, record) of the visible records, bottom to top
+        self.view_pending = False
+        self.motion = []  # drag points (document coords) waiting for the next frame
+        self.motion_pending = False
+
+        # Layers, bottom first; records carry the id of the layer they are on
+        self.layers, self.layer_ids, self.layer_rank = [], {}, {}
+        self.next_layer_id = 0
+        self.layer = self.new_layer("Layer 1")  # the active layer
+        self.layers_dirty = False  # layer list changed since the last save
+        self.showing_layers = False
+
+        # Tiled raster of every layer, and the composites built from them (for saving)
+        self.tiles = self.below = self.above = None
+        self.reset_tiles()
+        self.dirty = {}  # layer id -> document region its tiles are out of date for
 
-        # PIL image (for saving)
-        self.image = Image.new("RGB", (800, 600), "white")
-        self.draw = ImageDraw.Draw(self.image)
+        # Native document: where it lives and what autosave still has to append
+        self.project_path = None
+        self.autosave_error = None  # last autosave failure reported to the user
+        self.document_map = None
+        self.next_uid = 0
+        self.unsaved = {}  # record -> "put" or "delete"
+        self.unsaved_moves = {}  # record -> (dx, dy) for records otherwise unchanged
+        self.export = None  # (cancel event, message queue, window, progress bar, label) while exporting
 
         # Defaults
         self.current_color = "black"
@@ -23,15 +1137,34 @@ class PaintApp:
         self.current_brush = "pen"
         self.brush_size = 5
         self.start_x, self.start_y = None, None
-        self.selected_item = None
-        self.item_fonts = {}
+        self.selection = []
+        self.band = None
+        self.move_total = (0, 0)
+        self.stroke = None
+        self.index = SpatialGrid()
+        self.next_depth = 0
+        self.history = History()
+        self.erase_op = None
         self.default_font = "Arial"
         self.default_font_size = 20
+        self.fill_tolerance = 32  # bucket: largest per-channel difference still filled
 
         # Mouse binding
         self.canvas.bind("<Button-1>", self.on_click)
         self.canvas.bind("<B1-Motion>", self.paint)
         self.canvas.bind("<ButtonRelease-1>", self.on_release)
+        self.canvas.bind("<Button-2>", self.start_pan)
+        self.canvas.bind("<B2-Motion>", self.pan)
+        self.canvas.bind("<MouseWheel>", self.on_wheel)
+        self.canvas.bind("<Button-4>", self.on_wheel)
+        self.canvas.bind("<Button-5>", self.on_wheel)
+        self.canvas.bind("<Configure>", lambda e: self.schedule_view())
+        self.root.bind("<Control-z>", lambda e: self.undo())
+        self.root.bind("<Control-y>", lambda e: self.redo())
+
+        if self.headless:
+            self.history_label = None
+            return
 
         # Toolbar
         toolbar = tk.Frame(root)
@@ -44,36 +1177,52 @@ class PaintApp:
         tk.Button(toolbar, text="Text", command=lambda: self.set_tool("text")).pack(side=tk.LEFT)
         tk.Button(toolbar, text="Emojis", command=self.show_emojis).pack(side=tk.LEFT)
         tk.Button(toolbar, text="Styles", command=self.show_styles).pack(side=tk.LEFT)
+        tk.Button(toolbar, text="Layers", command=self.show_layers).pack(side=tk.LEFT)
         tk.Button(toolbar, text="Move Tool", command=lambda: self.set_tool("move")).pack(side=tk.LEFT)
         tk.Button(toolbar, text="Eraser", command=lambda: self.set_tool("eraser")).pack(side=tk.LEFT)
+        tk.Button(toolbar, text="Undo", command=self.undo).pack(side=tk.LEFT)
+        tk.Button(toolbar, text="Redo", command=self.redo).pack(side=tk.LEFT)
+        tk.Button(toolbar, text="Zoom +", command=lambda: self.zoom_center(1.25)).pack(side=tk.LEFT)
+        tk.Button(toolbar, text="Zoom -", command=lambda: self.zoom_center(0.8)).pack(side=tk.LEFT)
 
         tk.Button(toolbar, text="Save", command=self.save_image).pack(side=tk.RIGHT)
         tk.Button(toolbar, text="Don't Save", command=self.exit_without_save).pack(side=tk.RIGHT)
+        tk.Button(toolbar, text="Save Project", command=self.save_project).pack(side=tk.RIGHT)
+        tk.Button(toolbar, text="Open", command=self.open_project).pack(side=tk.RIGHT)
+        self.history_label = tk.Label(toolbar, text=self.history.stats())
+        self.history_label.pack(side=tk.RIGHT, padx=5)
 
         # Sub-toolbar (palettes)
         self.subtoolbar = tk.Frame(root)
         self.subtoolbar.pack(side=tk.TOP, fill=tk.X)
 
+        self.root.after(AUTOSAVE_MS, self.autosave)
+
     # ---------------------- TOOLS ----------------------
 
     def clear_subtoolbar(self):
+        self.showing_layers = False
         for widget in self.subtoolbar.winfo_children():
             widget.destroy()
 
     def set_tool(self, tool):
+        self.log_event("tool", tool)
         self.current_tool = tool
-        self.selected_item = None
+        self.selection = []
 
     def set_color(self, color):
+        self.log_event("color", color)
         self.current_color = color
 
     def set_brush(self, brush):
+        self.log_event("brush", brush)
         self.current_tool = "brush"
         self.current_brush = brush
-        sizes = {"pen": 2, "pencil": 1, "ink": 4, "oil": 8, "paint": 12}
+        sizes = {"pen": 2, "pencil": 1, "ink": 4, "oil": 8, "paint": 12, "airbrush": 12, "marker": 6}
         self.brush_size = sizes.get(brush, 5)
 
     def set_emoji(self, emoji):
+        self.log_event("emoji", emoji)
         self.current_tool = "emoji"
         self.selected_emoji = emoji
 
@@ -89,7 +1238,7 @@ class PaintApp:
 
     def show_brushes(self):
         self.clear_subtoolbar()
-        brushes = ["pen", "pencil", "ink", "oil", "paint"]
+        brushes = ["pen", "pencil", "ink", "oil", "paint"] + (list(RASTER_BRUSHES) if np is not None else [])
         for b in brushes:
             tk.Button(self.subtoolbar, text=b.capitalize(),
                       command=lambda br=b: self.set_brush(br)).pack(side=tk.LEFT, padx=2)
@@ -104,6 +1253,13 @@ class PaintApp:
         for shape in ["Rectangle", "Oval", "Line", "Triangle"]:
             tk.Button(self.subtoolbar, text=shape,
                       command=lambda sh=shape.lower(): self.set_tool(sh)).pack(side=tk.LEFT, padx=2)
+        if np is not None:
+            tk.Button(self.subtoolbar, text="Bucket", command=lambda: self.set_tool("bucket")).pack(side=tk.LEFT, padx=2)
+            tk.Label(self.subtoolbar, text="Tolerance:").pack(side=tk.LEFT, padx=5)
+            tolerance_slider = tk.Scale(self.subtoolbar, from_=0, to=255, orient=tk.HORIZONTAL,
+                                        command=lambda val: self.set_fill_tolerance(int(val)), length=100)
+            tolerance_slider.set(self.fill_tolerance)
+            tolerance_slider.pack(side=tk.LEFT)
 
     def show_emojis(self):
         self.clear_subtoolbar()
@@ -139,22 +1295,49 @@ class PaintApp:
         size_slider.set(20)
         size_slider.pack(side=tk.LEFT)
 
+    def show_layers(self):
+        self.clear_subtoolbar()
+        self.showing_layers = True
+        tk.Button(self.subtoolbar, text="+ Layer", command=self.add_layer).pack(side=tk.LEFT, padx=2)
+        for layer in reversed(self.layers):  # topmost first
+            frame = tk.Frame(self.subtoolbar, bd=2, relief=tk.SUNKEN if layer is self.layer else tk.FLAT)
+            frame.pack(side=tk.LEFT, padx=2)
+            tk.Button(frame, text=layer.name, command=lambda l=layer.id: self.select_layer(l)).pack(side=tk.LEFT)
+            shown = tk.BooleanVar(value=layer.visible)
+            tk.Checkbutton(frame, variable=shown,
+                           command=lambda l=layer.id, v=shown: self.set_layer_visible(l, v.get())).pack(side=tk.LEFT)
+            tk.Button(frame, text="▲", command=lambda l=layer.id: self.move_layer(l, 1)).pack(side=tk.LEFT)
+            tk.Button(frame, text="▼", command=lambda l=layer.id: self.move_layer(l, -1)).pack(side=tk.LEFT)
+            opacity = tk.Scale(frame, from_=0, to=100, orient=tk.HORIZONTAL, length=60, showvalue=False,
+                               command=lambda val, l=layer.id: self.set_layer_opacity(l, int(val) / 100))
+            opacity.set(round(layer.opacity * 100))
+            opacity.pack(side=tk.LEFT)
+
     def apply_style(self, style_type, value):
-        if self.selected_item:
-            tags = self.canvas.gettags(self.selected_item)
-            if style_type == "color":
-                if "shape" in tags or "text" in tags:
-                    self.canvas.itemconfig(self.selected_item, fill=value)
-            elif style_type == "outline" and "shape" in tags:
-                self.canvas.itemconfig(self.selected_item, outline=value)
-            elif style_type == "font" and "text" in tags:
-                family, size = self.item_fonts.get(self.selected_item, (self.default_font, self.default_font_size))
-                self.item_fonts[self.selected_item] = (value, size)
-                self.canvas.itemconfig(self.selected_item, font=(value, size))
-            elif style_type == "size" and "text" in tags:
-                family, _ = self.item_fonts.get(self.selected_item, (self.default_font, self.default_font_size))
-                self.item_fonts[self.selected_item] = (family, value)
-                self.canvas.itemconfig(self.selected_item, font=(family, value))
+        self.log_event("style", style_type, value)
+        if self.selection:
+            op = Op("style")
+            op.slider = style_type == "size"
+            for record in self.selection:
+                tags = record.options.get("tags") if isinstance(record, Shape) else "stroke"
+                change = None
+                if style_type == "color":
+                    if tags in ("shape", "text", "fill"):
+                        change = ("fill", value)
+                elif style_type == "outline" and tags == "shape":
+                    change = ("outline", value)
+                elif style_type == "font" and tags == "text":
+                    change = ("font", (value, record.options["font"][1]))
+                elif style_type == "size" and tags == "text":
+                    change = ("font", (record.options["font"][0], value))
+                if change:
+                    option, new = change
+                    op.changes.append((record, option, record.options.get(option), new))
+                    self.set_option(record, option, new)
+            self.flush_dirty()
+            if op.changes:
+                self.history.push(op)
+                self.update_history_label()
         else:
             # No selection → set defaults
             if style_type == "color":
@@ -165,98 +1348,1192 @@ class PaintApp:
                 self.default_font_size = value
 
     def set_brush_size(self, size):
+        self.log_event("size", size)
         self.brush_size = size
 
+    def set_fill_tolerance(self, tolerance):
+        self.log_event("tolerance", tolerance)
+        self.fill_tolerance = tolerance
+
+    def log_event(self, *event):
+        if self.recording is not None:
+            self.recording.append(list(event))
+
+    def ask_text(self):
+        if self.headless:
+            return self.replay_text
+        text = simpledialog.askstring("Text", "Enter text:")
+        if self.recording is not None:
+            self.recording[-1].append(text)  # replayed as this click's answer
+        return text
+
     # ---------------------- DRAWING ----------------------
 
     def on_click(self, event):
-        self.start_x, self.start_y = event.x, event.y
+        x, y = self.to_doc(event)
+        self.log_event("click", x, y)
+        self.start_x, self.start_y = x, y
 
-        if self.current_tool == "text":
-            text = simpledialog.askstring("Text", "Enter text:")
+        if self.current_tool == "brush":
+            self.stroke = Stroke(self.current_brush, self.current_color, self.brush_size)
+            self.stroke.add_point(x, y)
+            self.stroke.depth = self.new_depth()
+            self.stroke.layer = self.layer.id
+            self.materialize(self.stroke)
+            self.raster_tail(self.stroke)
+
+        elif self.current_tool == "text":
+            text = self.ask_text()
             if text:
-                item = self.canvas.create_text(event.x, event.y, text=text,
-                                               fill=self.current_color,
-                                               font=(self.default_font, self.default_font_size),
-                                               tags="text")
-                self.item_fonts[item] = (self.default_font, self.default_font_size)
+                self.add_record(Shape("text", (x, y),
+                                      {"text": text, "fill": self.current_color,
+                                       "font": (self.default_font, self.default_font_size), "tags": "text"}))
 
         elif self.current_tool == "emoji":
-            item = self.canvas.create_text(event.x, event.y, text=self.selected_emoji,
-                                           font=(self.default_font, self.default_font_size),
-                                           fill=self.current_color, tags="text")
-            self.item_fonts[item] = (self.default_font, self.default_font_size)
+            self.add_record(Shape("text", (x, y),
+                                  {"text": self.selected_emoji, "fill": self.current_color,
+                                   "font": (self.default_font, self.default_font_size), "tags": "text"}))
 
         elif self.current_tool == "move":
-            self.selected_item = self.canvas.find_closest(event.x, event.y)[0]
+            record = self.hit_test(x, y)
+            if record is None:
+                # Empty spot: start a rubber-band selection
+                self.selection = []
+                self.band = self.canvas.create_rectangle(event.x, event.y, event.x, event.y,
+                                                         outline="gray", dash=(4, 2))
+            elif record not in self.selection:
+                self.selection = [record]
+            self.move_total = (0, 0)
 
         elif self.current_tool == "eraser":
-            x1, y1 = event.x - self.brush_size, event.y - self.brush_size
-            x2, y2 = event.x + self.brush_size, event.y + self.brush_size
-            self.canvas.create_rectangle(x1, y1, x2, y2, fill="white", outline="white")
+            self.erase_op = Op("erase")
+            self.erase_at(x, y)
+            self.flush_dirty()
+
+        elif self.current_tool == "bucket":
+            self.bucket_fill(x, y)
+
+    def bucket_fill(self, x, y):
+        # Flood the picture as shown; the filled area becomes one record on the active layer.
+        # The flood starts in the viewport and the window only grows past edges the fill reaches,
+        # so filling an enclosed area never crops the whole document
+        self.flush_dirty()
+        bx1, by1, bx2, by2 = self.document_bounds()
+        px, py = math.floor(x), math.floor(y)
+        if not (bx1 <= px < bx2 and by1 <= py < by2):
+            return
+        vx1, vy1, vx2, vy2 = self.viewport()
+        x1, y1 = max(bx1, min(px, math.floor(vx1))), max(by1, min(py, math.floor(vy1)))
+        x2, y2 = min(bx2, max(px + 1, math.ceil(vx2))), min(by2, max(py + 1, math.ceil(vy2)))
+        while True:
+            mask = fill_mask(self.tiles.crop((x1, y1, x2, y2)), px - x1, py - y1, self.fill_tolerance)
+            # Double the window past every edge the fill touched, up to the document's own edges
+            w, h = x2 - x1, y2 - y1
+            grown = (max(bx1, x1 - w) if mask[:, 0].any() else x1, max(by1, y1 - h) if mask[0].any() else y1,
+                     min(bx2, x2 + w) if mask[:, -1].any() else x2, min(by2, y2 + h) if mask[-1].any() else y2)
+            if grown == (x1, y1, x2, y2):
+                break
+            x1, y1, x2, y2 = grown
+        rows, cols = np.nonzero(mask.any(axis=1))[0], np.nonzero(mask.any(axis=0))[0]
+        top, left = rows[0], cols[0]
+        mask = Image.fromarray(mask[top:rows[-1] + 1, left:cols[-1] + 1].astype(np.uint8) * 255)
+        self.add_record(Shape("image", (x1 + left, y1 + top), {"fill": self.current_color, "tags": "fill"}, mask))
 
     def paint(self, event):
+        # Motion events only queue their point; flush_motion applies a frame's worth at once
+        x, y = self.to_doc(event)
+        self.log_event("drag", x, y)
+        self.motion.append((x, y))
+        if not self.motion_pending:
+            self.motion_pending = True
+            self.root.after(FRAME_MS, self.flush_motion)
+
+    def flush_motion(self):
+        self.motion_pending = False
+        points, self.motion = self.motion, []
+        if not points:
+            return
         if self.current_tool == "brush":
-            x1, y1 = event.x - self.brush_size, event.y - self.brush_size
-            x2, y2 = event.x + self.brush_size, event.y + self.brush_size
-            if self.current_brush == "pen":
-                self.canvas.create_oval(x1, y1, x2, y2, fill=self.current_color, outline="")
-            elif self.current_brush == "pencil":
-                jitter = random.randint(-1, 1)
-                self.canvas.create_line(event.x, event.y, event.x + jitter, event.y + jitter,
-                                        fill=self.current_color, width=1)
-            elif self.current_brush == "ink":
-                self.canvas.create_oval(x1, y1, x2, y2, fill=self.current_color, outline="")
-            elif self.current_brush == "oil":
-                for _ in range(3):
-                    ox, oy = random.randint(-2, 2), random.randint(-2, 2)
-                    self.canvas.create_oval(x1+ox, y1+oy, x2+ox, y2+oy, fill=self.current_color, outline="")
-            elif self.current_brush == "paint":
-                self.canvas.create_rectangle(x1, y1, x2, y2, fill=self.current_color, outline="")
-        elif self.current_tool == "eraser":
-            x1, y1 = event.x - self.brush_size, event.y - self.brush_size
-            x2, y2 = event.x + self.brush_size, event.y + self.brush_size
-            self.canvas.create_rectangle(x1, y1, x2, y2, fill="white", outline="white")
-        elif self.current_tool == "move" and self.selected_item:
-            dx, dy = event.x - self.start_x, event.y - self.start_y
-            self.canvas.move(self.selected_item, dx, dy)
-            self.start_x, self.start_y = event.x, event.y
+            # Every point joins the polyline, then one coords() and raster pass for the batch
+            added = sum(self.stroke.add_point(x, y) for x, y in points) if self.stroke else 0
+            if added and is_soft(self.stroke):
+                self.show_raster(self.stroke, partial=True)
+            elif added:
+                for item, (ox, oy) in zip(self.stroke.items, self.stroke.offsets):
+                    self.canvas.coords(item, self.view_coords(self.stroke.coords(ox, oy)))
+                self.raster_tail(self.stroke, added)
+        elif self.current_tool == "eraser" and self.start_x is not None:
+            # Step along the whole path so fast movements leave no unerased gaps
+            for x, y in points:
+                dx, dy = x - self.start_x, y - self.start_y
+                steps = max(1, int((dx * dx + dy * dy) ** 0.5 / max(1, self.brush_size / 2)))
+                for i in range(1, steps + 1):
+                    self.erase_at(self.start_x + dx * i / steps, self.start_y + dy * i / steps)
+                self.start_x, self.start_y = x, y
+            self.flush_dirty()
+        elif self.current_tool == "move" and self.band:
+            self.canvas.coords(self.band, self.view_coords([self.start_x, self.start_y, *points[-1]]))
+        elif self.current_tool == "move" and self.selection:
+            x, y = points[-1]
+            dx, dy = x - self.start_x, y - self.start_y
+            for record in self.selection:
+                self.mark_dirty(self.index.boxes[record], record.layer)
+                for item in record.items:
+                    self.canvas.move(item, dx * self.zoom, dy * self.zoom)
+                self.index.move(record, dx, dy)
+                self.mark_dirty(self.index.boxes[record], record.layer)
+            self.move_total = (self.move_total[0] + dx, self.move_total[1] + dy)
+            self.start_x, self.start_y = x, y
 
     def on_release(self, event):
+        self.flush_motion()
+        x, y = self.to_doc(event)
+        self.log_event("release", x, y)
         if self.current_tool in ["rectangle", "oval", "line", "triangle"]:
-            if not self.start_x or not self.start_y:
+            if self.start_x is None or self.start_y is None:
                 return
+            outlined = {"outline": self.current_color, "fill": "", "width": 2, "tags": "shape"}
             if self.current_tool == "rectangle":
-                self.canvas.create_rectangle(self.start_x, self.start_y, event.x, event.y,
-                                             outline=self.current_color, fill="", width=2, tags="shape")
+                shape = Shape("rectangle", (self.start_x, self.start_y, x, y), outlined)
             elif self.current_tool == "oval":
-                self.canvas.create_oval(self.start_x, self.start_y, event.x, event.y,
-                                        outline=self.current_color, fill="", width=2, tags="shape")
+                shape = Shape("oval", (self.start_x, self.start_y, x, y), outlined)
             elif self.current_tool == "line":
-                self.canvas.create_line(self.start_x, self.start_y, event.x, event.y,
-                                        fill=self.current_color, width=2, tags="shape")
+                shape = Shape("line", (self.start_x, self.start_y, x, y),
+                              {"fill": self.current_color, "width": 2, "tags": "shape"})
             elif self.current_tool == "triangle":
-                self.canvas.create_polygon(self.start_x, self.start_y, event.x, event.y,
-                                           self.start_x, event.y, outline=self.current_color,
-                                           fill="", width=2, tags="shape")
+                shape = Shape("polygon", (self.start_x, self.start_y, x, y, self.start_x, y), outlined)
+            self.add_record(shape)
+        elif self.current_tool == "brush" and self.stroke:
+            self.index.insert(self.stroke, self.stroke.bbox())
+            self.note_change(self.stroke, "put")
+            if is_soft(self.stroke):  # blended into the tiles once, now that it is complete
+                self.mark_dirty(self.stroke.bbox(), self.stroke.layer)
+                self.flush_dirty()
+            op = Op("create")
+            op.added.append(self.stroke)
+            self.history.push(op)
+            self.update_history_label()
+        elif self.current_tool == "eraser" and self.erase_op:
+            if self.erase_op.added or self.erase_op.removed:
+                self.history.push(self.erase_op)
+                self.update_history_label()
+            self.erase_op = None
+        elif self.current_tool == "move" and self.band:
+            self.select_band(self.start_x, self.start_y, x, y)
+        elif self.current_tool == "move":
+            self.finish_move()
 
+        self.stroke = None
         self.start_x, self.start_y = None, None
 
+    # ---------------------- VIEW ----------------------
+
+    def to_doc(self, event):
+        return self.origin[0] + event.x / self.zoom, self.origin[1] + event.y / self.zoom
+
+    def view_coords(self, pts):
+        return offset_points(pts, -self.origin[0], -self.origin[1], self.zoom)
+
+    def viewport(self):
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if width <= 1:  # not mapped yet
+            width, height = int(self.canvas["width"]), int(self.canvas["height"])
+        x, y = self.origin
+        return (x, y, x + width / self.zoom, y + height / self.zoom)
+
+    def in_view(self, bbox):
+        x1, y1, x2, y2 = self.viewport()
+        mx, my = (x2 - x1) / 4, (y2 - y1) / 4
+        return bbox[0] <= x2 + mx and bbox[2] >= x1 - mx and bbox[1] <= y2 + my and bbox[3] >= y1 - my
+
+    def schedule_view(self):
+        if not self.view_pending:
+            self.view_pending = True
+            self.root.after_idle(self.update_view)
+
+    def update_view(self):
+        # Only records near the viewport have canvas items; the rest live in the index
+        self.view_pending = False
+        x1, y1, x2, y2 = self.viewport()
+        mx, my = (x2 - x1) / 4, (y2 - y1) / 4
+        wanted = self.index.query(x1 - mx, y1 - my, x2 + mx, y2 + my)
+        for record in self.visible - wanted:
+            if record is not self.stroke:
+                self.dematerialize(record)
+        for record in sorted(wanted - self.visible, key=self.stack_key):
+            self.materialize(record)
+
+    def stack_key(self, record):
+        return self.layer_rank[record.layer], record.depth
+
+    def view_options(self, record):
+        options = dict(record.options)
+        if "width" in options:
+            options["width"] = options["width"] * self.zoom
+        if "font" in options:
+            options["font"] = (options["font"][0], max(1, round(options["font"][1] * self.zoom)))
+        options.update(self.layer_look(record))
+        return options
+
+    def layer_look(self, record):
+        # Canvas items have no alpha: hidden layers hide their items, faint ones are stippled
+        layer = self.layer_ids[record.layer]
+        look = {"state": tk.NORMAL if layer.visible else tk.HIDDEN}
+        if not is_image(record):
+            look["stipple"] = "gray25" if layer.opacity < 0.4 else "gray50" if layer.opacity < 0.8 else ""
+        return look
+
+    def materialize(self, record):
+        if is_image(record):
+            left, top = self.show_raster(record)
+            record.items = [self.canvas.create_image(*self.view_coords([left, top]), anchor=tk.NW,
+                                                     image=record.photo, **self.layer_look(record))]
+        elif isinstance(record, Stroke):
+            style = BRUSH_STYLES.get(record.brush, BRUSH_STYLES["pen"])
+            record.items = [self.canvas.create_line(*self.view_coords(record.coords(ox, oy)), fill=record.color,
+                                                    width=record.width * self.zoom, tags="stroke", **style,
+                                                    **self.layer_look(record))
+                            for ox, oy in record.offsets]
+        else:
+            create = getattr(self.canvas, "create_" + record.kind)
+            record.items = [create(*self.view_coords(record.points), **self.view_options(record))]
+        self.visible.add(record)
+        # Slide the new items under the nearest visible record stacked above this one
+        entry = (self.stack_key(record), id(record), record)
+        at = bisect.bisect(self.stacked, entry)
+        self.stacked.insert(at, entry)
+        if at + 1 < len(self.stacked):
+            above = self.stacked[at + 1][2]
+            for item in record.items:
+                self.canvas.tag_lower(item, above.items[0])
+
+    def dematerialize(self, record):
+        self.canvas.delete(*record.items)
+        record.items = []
+        if record in self.visible:
+            self.visible.discard(record)
+            del self.stacked[bisect.bisect_left(self.stacked, (self.stack_key(record), id(record)))]
+        record.photo = None
+
+    def show_raster(self, record, partial=False):
+        # Soft strokes and fills are one PhotoImage each. While a stroke grows (`partial`) only
+        # the rectangle stamped since the last frame is repainted, straight into its photo.
+        if isinstance(record, Shape):
+            (left, top), mask, color = record.points, record.mask, record.options["fill"]
+            if self.headless:
+                return left, top
+            changed = None
+        else:
+            if self.headless:
+                return stamp_stroke(record)[:2]
+            left, top, mask = raster_mask(record)
+            color = record.color
+            changed, record.raster[6] = record.raster[6], None
+        size = (max(1, round(mask.width * self.zoom)), max(1, round(mask.height * self.zoom)))
+        opacity = self.layer_ids[record.layer].opacity
+        if partial and record.photo is not None and (record.photo.width(), record.photo.height()) == size:
+            patch = changed and photo_patch(mask, color, opacity, size,
+                                            (changed[0] - left, changed[1] - top, changed[2] - left, changed[3] - top))
+            if patch:
+                x, y, image = patch
+                # PhotoImage.paste has no box; Tk's photo copy writes the patch in place
+                small = ImageTk.PhotoImage(image)
+                self.canvas.tk.call(str(record.photo), "copy", str(small), "-to", x, y, "-compositingrule", "set")
+        else:
+            _, _, image = photo_patch(mask, color, opacity, size, (0, 0) + mask.size)
+            if record.photo is not None and (record.photo.width(), record.photo.height()) == image.size:
+                record.photo.paste(image)
+            else:
+                record.photo = ImageTk.PhotoImage(image)
+                for item in record.items:
+                    self.canvas.itemconfig(item, image=record.photo)
+        for item in record.items:
+            self.canvas.coords(item, *self.view_coords([left, top]))
+        return left, top
+
+    def start_pan(self, event):
+        self.pan_x, self.pan_y = event.x, event.y
+
+    def pan(self, event):
+        self.scroll_by((self.pan_x - event.x) / self.zoom, (self.pan_y - event.y) / self.zoom)
+        self.pan_x, self.pan_y = event.x, event.y
+
+    def scroll_by(self, dx, dy):
+        self.origin = (self.origin[0] + dx, self.origin[1] + dy)
+        self.canvas.move("all", -dx * self.zoom, -dy * self.zoom)
+        self.schedule_view()
+
+    def on_wheel(self, event):
+        up = event.num == 4 or event.delta > 0
+        if event.state & 0x4:  # Control: zoom around the cursor
+            self.set_zoom(self.zoom * (1.25 if up else 0.8), event.x, event.y)
+        elif event.state & 0x1:  # Shift: scroll sideways
+            self.scroll_by((-60 if up else 60) / self.zoom, 0)
+        else:
+            self.scroll_by(0, (-60 if up else 60) / self.zoom)
+
+    def zoom_center(self, factor):
+        x1, y1, x2, y2 = self.viewport()
+        self.set_zoom(self.zoom * factor, (x2 - x1) * self.zoom / 2, (y2 - y1) * self.zoom / 2)
+
+    def set_zoom(self, zoom, x, y):
+        if self.stroke:
+            return
+        zoom = max(0.05, min(20, zoom))
+        doc_x, doc_y = self.origin[0] + x / self.zoom, self.origin[1] + y / self.zoom
+        self.zoom = zoom
+        self.origin = (doc_x - x / zoom, doc_y - y / zoom)
+        # Widths and fonts scale too, so re-create whatever is on screen
+        for record in list(self.visible):
+            self.dematerialize(record)
+        if self.band:
+            self.canvas.delete(self.band)
+            self.band = None
+        self.update_view()
+
+    # ---------------------- SELECTION ----------------------
+
+    def new_depth(self):
+        self.next_depth += 1
+        return (self.next_depth,)
+
+    def add_record(self, record):
+        record.depth = self.new_depth()
+        record.layer = self.layer.id
+        self.index.insert(record, record.bbox())
+        self.note_change(record, "put")
+        self.materialize(record)
+        self.draw_on_tiles(record.bbox(), lambda tile, dx, dy: raster_record(tile, record, dx, dy), self.layer)
+        op = Op("create")
+        op.added.append(record)
+        self.history.push(op)
+        self.update_history_label()
+
+    def remove_record(self, record):
+        self.mark_dirty(self.index.boxes.get(record), record.layer)
+        if record in self.visible:
+            self.dematerialize(record)
+        self.index.remove(record)
+        self.note_change(record, "delete")
+        if record in self.selection:
+            self.selection.remove(record)
+
+    def restore_record(self, record):
+        bbox = record.bbox()
+        self.index.insert(record, bbox)
+        self.note_change(record, "put")
+        if self.in_view(bbox):
+            self.materialize(record)
+        self.mark_dirty(bbox, record.layer)
+
+    def hit_test(self, x, y):
+        # Topmost record under the cursor, preferring shapes and text over strokes
+        radius = 3 / self.zoom
+        best = None
+        for record in self.index.query(x - radius, y - radius, x + radius, y + radius):
+            if record.layer != self.layer.id:
+                continue
+            if isinstance(record, Stroke):
+                reach = record.width / 2 + radius
+                if all(polyline_distance(x - ox, y - oy, record.points) > reach for ox, oy in record.offsets):
+                    continue
+            elif record.kind == "image":
+                mx, my = int(x - record.points[0]), int(y - record.points[1])
+                if not (0 <= mx < record.mask.width and 0 <= my < record.mask.height and record.mask.getpixel((mx, my))):
+                    continue
+            rank = (isinstance(record, Shape), record.depth)
+            if best is None or rank > best[0]:
+                best = (rank, record)
+        return best[1] if best else None
+
+    def select_band(self, x1, y1, x2, y2):
+        self.canvas.delete(self.band)
+        self.band = None
+        x1, x2 = sorted((x1, x2))
+        y1, y2 = sorted((y1, y2))
+        self.selection = []
+        for record in self.index.query(x1, y1, x2, y2):
+            b = self.index.boxes[record]
+            if record.layer == self.layer.id and x1 <= b[0] and y1 <= b[1] and b[2] <= x2 and b[3] <= y2:
+                self.selection.append(record)
+
+    def finish_move(self):
+        dx, dy = self.move_total
+        if dx or dy:
+            # Keep the records' points in step with their canvas items
+            op = Op("move")
+            op.records = list(self.selection)
+            op.delta = (dx, dy)
+            for record in op.records:
+                record.translate(dx, dy)
+                self.note_move(record, dx, dy)
+            self.history.push(op)
+            self.update_history_label()
+        self.move_total = (0, 0)
+        self.flush_dirty()
+
+    # ---------------------- HISTORY ----------------------
+
+    def undo(self):
+        self.log_event("undo")
+        op = self.history.undo()
+        if op:
+            self.apply_op(op, reverse=True)
+
+    def redo(self):
+        self.log_event("redo")
+        op = self.history.redo()
+        if op:
+            self.apply_op(op)
+
+    def apply_op(self, op, reverse=False):
+        # Canvas calls scale with the number of records touched, not their points
+        self.selection = []
+        if op.kind == "move":
+            dx, dy = (-op.delta[0], -op.delta[1]) if reverse else op.delta
+            for record in op.records:
+                self.mark_dirty(self.index.boxes[record], record.layer)
+                for item in record.items:
+                    self.canvas.move(item, dx * self.zoom, dy * self.zoom)
+                self.index.move(record, dx, dy)
+                record.translate(dx, dy)
+                self.note_move(record, dx, dy)
+                self.mark_dirty(self.index.boxes[record], record.layer)
+        elif op.kind == "style":
+            for record, option, old, new in op.changes:
+                self.set_option(record, option, old if reverse else new)
+        else:
+            added, removed = (op.removed, op.added) if reverse else (op.added, op.removed)
+            for record in removed:
+                self.remove_record(record)
+            for record in sorted(added, key=lambda r: r.depth):
+                self.restore_record(record)
+        self.flush_dirty()
+        self.update_history_label()
+
+    def set_option(self, record, option, value):
+        self.mark_dirty(self.index.boxes.get(record), record.layer)
+        record.options[option] = value
+        if is_image(record):
+            if record.items:
+                self.show_raster(record)
+        else:
+            for item in record.items:
+                self.canvas.itemconfig(item, **{option: self.view_options(record)[option]})
+        bbox = record.bbox()
+        self.index.insert(record, bbox)
+        self.note_change(record, "put")
+        self.mark_dirty(bbox, record.layer)
+
+    def update_history_label(self):
+        if self.history_label:
+            self.history_label.config(text=self.history.stats())
+
+    # ---------------------- ERASER ----------------------
+
+    def erase_at(self, x, y):
+        # Delete the records under the eraser and cut strokes around it
+        r = self.brush_size
+        for record in sorted(self.index.query(x - r, y - r, x + r, y + r), key=lambda rec: rec.depth):
+            if record.layer != self.layer.id:
+                continue
+            if isinstance(record, Stroke):
+                runs = clip_polyline(record.points, x, y, r + record.width / 2 + 2)
+                if runs is None:
+                    continue
+                # Pieces take the original's place in the stacking order. They share its depth:
+                # same colour, width and offsets, so their order among themselves doesn't show.
+                for run in runs:
+                    piece = record.piece(run)
+                    piece.depth = record.depth
+                    self.index.insert(piece, piece.bbox())
+                    self.note_change(piece, "put")
+                    self.materialize(piece)
+                    self.erase_op.added.append(piece)
+                self.log_erased(record)
+                self.remove_record(record)
+                continue
+            if record.kind == "image":
+                # Fills go as a whole, but only when the eraser is over a filled pixel
+                left, top = record.points
+                box = (int(x - r - left), int(y - r - top), int(x + r - left) + 1, int(y + r - top) + 1)
+                if record.mask.crop(box).getbbox() is None:
+                    continue
+            elif record.options["tags"] == "shape" and (record.kind == "line" or not record.options.get("fill")):
+                if polyline_distance(x, y, outline_points(record)) > r + record.options["width"] / 2:
+                    continue
+            self.log_erased(record)
+            self.remove_record(record)
+
+    def log_erased(self, record):
+        # A piece cut earlier in the same drag never existed before it
+        if record in self.erase_op.added:
+            self.erase_op.added.remove(record)
+        else:
+            self.erase_op.removed.append(record)
+
+    # ---------------------- RASTER ----------------------
+
+    def draw_on_tiles(self, bbox, render, layer):
+        # Call render(tile, dx, dy) for every tile of `layer` under bbox, (dx, dy) moving document to tile pixels
+        keys = list(layer.tiles.keys(bbox))
+        for tx, ty in keys:
+            tile = layer.tiles.get((tx, ty), create=True)
+            render(tile, -tx * TILE_SIZE, -ty * TILE_SIZE)
+        self.layer_changed(layer, keys)
+
+    def raster_tail(self, stroke, count=1):
+        # Mirror only the stroke's newest `count` segments into the tiles
+        if is_soft(stroke):
+            return  # soft strokes blend with what's under them, so they go in on release
+        capstyle = BRUSH_STYLES.get(stroke.brush, BRUSH_STYLES["pen"])["capstyle"]
+        color, pad = to_rgb(stroke.color), stroke.width / 2 + 1
+        for ox, oy in stroke.offsets:
+            pts = stroke.coords(ox, oy, start=-2 * (count + 1))
+            bbox = (min(pts[0::2]) - pad, min(pts[1::2]) - pad, max(pts[0::2]) + pad, max(pts[1::2]) + pad)
+            self.draw_on_tiles(bbox, lambda tile, dx, dy: raster_line(ImageDraw.Draw(tile), offset_points(pts, dx, dy),
+                                                                      color, stroke.width, capstyle), self.layer)
+
+    def mark_dirty(self, bbox, layer):
+        if not bbox:
+            return
+        dirty = self.dirty.get(layer)
+        if dirty:
+            bbox = (min(dirty[0], bbox[0]), min(dirty[1], bbox[1]), max(dirty[2], bbox[2]), max(dirty[3], bbox[3]))
+        self.dirty[layer] = bbox
+
+    def flush_dirty(self):
+        # Re-render only the dirty rectangles, tile by tile, from the layer's records overlapping them
+        dirty, self.dirty = self.dirty, {}
+        for layer_id, (x1, y1, x2, y2) in dirty.items():
+            layer = self.layer_ids[layer_id]
+            x1, y1 = math.floor(x1) - 2, math.floor(y1) - 2
+            x2, y2 = math.ceil(x2) + 3, math.ceil(y2) + 3
+            touched = []
+            for tx, ty in layer.tiles.keys((x1, y1, x2 - 1, y2 - 1)):
+                left, top = tx * TILE_SIZE, ty * TILE_SIZE
+                rx1, ry1 = max(x1, left), max(y1, top)
+                rx2, ry2 = min(x2, left + TILE_SIZE), min(y2, top + TILE_SIZE)
+                region = self.render_region(layer, rx1, ry1, rx2, ry2, origin=(left, top))
+                tile = layer.tiles.get((tx, ty), create=region is not None)
+                if tile is not None:
+                    tile.paste(region or (0, 0, 0, 0), (rx1 - left, ry1 - top, rx2 - left, ry2 - top))
+                    touched.append((tx, ty))
+            self.layer_changed(layer, touched)
+
+    def render_region(self, layer, x1, y1, x2, y2, origin=None):
+        # Records are drawn relative to origin (the region's corner by default) and the region is cropped out.
+        # Flushes pass the tile's corner: PIL rasterises shapes reaching negative coordinates differently,
+        # so drawing anywhere but the tile's own origin leaves seams against a fresh render of the tile
+        records = sorted((r for r in self.index.query(x1, y1, x2, y2) if r.layer == layer.id), key=lambda r: r.depth)
+        if not records:
+            return None
+        ox, oy = origin or (x1, y1)
+        region = Image.new("RGBA", (x2 - ox, y2 - oy), (0, 0, 0, 0))
+        for record in records:
+            raster_record(region, record, -ox, -oy)
+        return region.crop((x1 - ox, y1 - oy, x2 - ox, y2 - oy)) if origin else region
+
+    def render_tile(self, layer, key):
+        left, top = key[0] * TILE_SIZE, key[1] * TILE_SIZE
+        return self.render_region(layer, left, top, left + TILE_SIZE, top + TILE_SIZE)
+
+    def reset_tiles(self, stale=()):
+        # Fresh tiles for every layer and for the composites; `stale` tiles render on first use
+        stale = set(stale)
+        self.close_tiles()
+        for layer in self.layers:
+            layer.tiles = TileStore(render=lambda key, layer=layer: self.render_tile(layer, key), mode="RGBA")
+        self.tiles = TileStore(render=self.composite_tile)
+        self.below = TileStore(render=lambda key: self.stack_tile(key, below=True), mode="RGBA")
+        self.above = TileStore(render=lambda key: self.stack_tile(key, below=False), mode="RGBA")
+        for store in [self.tiles, self.below, self.above] + [layer.tiles for layer in self.layers]:
+            store.stale = set(stale)
+
+    def close_tiles(self):
+        for store in [self.tiles, self.below, self.above] + [layer.tiles for layer in self.layers]:
+            if store is not None:
+                store.close()
+
+    def layer_changed(self, layer, keys):
+        # Drawing on the active layer leaves the cached layers below and above it alone
+        keys = list(keys)
+        if layer is not self.layer:
+            below = self.layer_rank[layer.id] < self.layer_rank[self.layer.id]
+            (self.below if below else self.above).invalidate(keys)
+        self.tiles.invalidate(keys)
+
+    def recomposite(self, layer=None):
+        # A layer's visibility or opacity changed (None: the stacking order). Only composites are
+        # dropped; they are rebuilt from the layers' tiles, no record is rendered again.
+        if layer is None:
+            keys = set().union(*(l.tiles.known() for l in self.layers))
+            self.below.invalidate(keys)
+            self.above.invalidate(keys)
+            self.tiles.invalidate(keys)
+        else:
+            self.layer_changed(layer, layer.tiles.known())
+
+    def stack_tile(self, key, below):
+        # The visible layers under (or over) the active one, merged into one RGBA tile
+        rank = self.layer_rank[self.layer.id]
+        tile = None
+        for layer in self.layers[:rank] if below else self.layers[rank + 1:]:
+            part = layer.tiles.get(key) if layer.visible else None
+            if part is not None:
+                if tile is None:
+                    tile = Image.new("RGBA", (TILE_SIZE, TILE_SIZE), (0, 0, 0, 0))
+                tile.alpha_composite(faded(part, layer.opacity))
+        return tile
+
+    def composite_tile(self, key):
+        active = self.layer.tiles.get(key) if self.layer.visible else None
+        parts = [(self.below.get(key), 1), (active, self.layer.opacity), (self.above.get(key), 1)]
+        if all(part is None for part, _ in parts):
+            return None
+        tile = Image.new("RGBA", (TILE_SIZE, TILE_SIZE), "white")
+        for part, opacity in parts:
+            if part is not None:
+                tile.alpha_composite(faded(part, opacity))
+        return tile.convert("RGB")
+
+    def document_bounds(self):
+        # The original 800x600 page, grown to fit everything drawn outside it
+        x1, y1, x2, y2 = self.index.extent() or (0, 0, 800, 600)
+        return (min(0, math.floor(x1)), min(0, math.floor(y1)), max(800, math.ceil(x2)), max(600, math.ceil(y2)))
+
+    # ---------------------- LAYERS ----------------------
+
+    def new_layer(self, name, layer_id=None, visible=True, opacity=1.0, position=None):
+        if layer_id is None:
+            layer_id = self.next_layer_id
+        self.next_layer_id = max(self.next_layer_id, layer_id + 1)
+        layer = Layer(layer_id, name, visible, opacity)
+        layer.tiles = TileStore(render=lambda key: self.render_tile(layer, key), mode="RGBA")
+        self.layers.insert(len(self.layers) if position is None else position, layer)
+        self.layer_ids[layer_id] = layer
+        self.rank_layers()
+        return layer
+
+    def rank_layers(self):
+        self.layer_rank = {layer.id: rank for rank, layer in enumerate(self.layers)}
+        self.stacked = sorted((self.stack_key(r), id(r), r) for r in self.visible)
+
+    def add_layer(self):
+        self.log_event("add_layer")
+        layer = self.new_layer(f"Layer {self.next_layer_id + 1}", position=self.layer_rank[self.layer.id] + 1)
+        self.layers_dirty = True
+        self.select_layer(layer.id)
+
+    def select_layer(self, layer_id):
+        self.log_event("layer", layer_id)
+        self.layer = self.layer_ids[layer_id]
+        self.selection = []
+        self.recomposite()  # the split into below / active / above moved
+        self.refresh_layers()
+
+    def set_layer_visible(self, layer_id, visible):
+        self.log_event("layer_visible", layer_id, visible)
+        layer = self.layer_ids[layer_id]
+        if layer.visible != visible:
+            layer.visible = visible
+            self.restyle_layer(layer)
+
+    def set_layer_opacity(self, layer_id, opacity):
+        layer = self.layer_ids[layer_id]
+        opacity = max(0.0, min(1.0, opacity))
+        if layer.opacity != opacity:
+            self.log_event("layer_opacity", layer_id, opacity)
+            layer.opacity = opacity
+            self.restyle_layer(layer)
+
+    def restyle_layer(self, layer):
+        for record in list(self.visible):
+            if record.layer == layer.id:
+                if is_image(record):
+                    self.show_raster(record)
+                look = self.layer_look(record)
+                for item in record.items:
+                    self.canvas.itemconfig(item, **look)
+        self.recomposite(layer)
+        self.layers_dirty = True
+
+    def move_layer(self, layer_id, step):
+        self.log_event("layer_move", layer_id, step)
+        layer = self.layer_ids[layer_id]
+        rank = self.layer_rank[layer_id]
+        other = rank + step
+        if not 0 <= other < len(self.layers):
+            return
+        self.layers[rank], self.layers[other] = self.layers[other], layer
+        self.rank_layers()
+        # Restack what is on screen, bottom to top
+        for _, _, record in self.stacked:
+            for item in record.items:
+                self.canvas.tag_raise(item)
+        self.recomposite()
+        self.layers_dirty = True
+        self.refresh_layers()
+
+    def refresh_layers(self):
+        if self.showing_layers:
+            self.show_layers()
+
+    # ---------------------- PROJECT ----------------------
+
+    def note_change(self, record, state):
+        # What autosave must append: "put" writes the record, "delete" drops it
+        if self.project_path:
+            self.unsaved[record] = state
+            self.unsaved_moves.pop(record, None)
+
+    def note_move(self, record, dx, dy):
+        if self.project_path and record not in self.unsaved:
+            mx, my = self.unsaved_moves.get(record, (0, 0))
+            self.unsaved_moves[record] = (mx + dx, my + dy)
+
+    def assign_uid(self, record):
+        if record.uid is None:
+            self.next_uid += 1
+            record.uid = self.next_uid
+
+    def autosave(self):
+        try:
+            if self.project_path and (self.unsaved or self.unsaved_moves or self.layers_dirty):
+                written = [record for record, state in self.unsaved.items() if state == "put"]
+                for record in written:
+                    self.assign_uid(record)
+                deleted = [record.uid for record, state in self.unsaved.items()
+                           if state == "delete" and record.uid is not None]
+                moved = [(record.uid, dx, dy) for record, (dx, dy) in self.unsaved_moves.items()]
+                try:
+                    append_document(self.project_path, written, deleted, moved,
+                                    self.layers if self.layers_dirty else None)
+                except OSError:
+                    return  # keep the changes and try again next time
+                self.unsaved.clear()
+                self.unsaved_moves.clear()
+                self.layers_dirty = False
+                self.autosave_error = None
+        except Exception as e:
+            # A retry won't fix this one: say so (once), the changes stay unsaved
+            if str(e) != self.autosave_error:
+                self.autosave_error = str(e)
+                messagebox.showerror("Autosave", f"Autosave failed: {e}")
+        finally:
+            self.root.after(AUTOSAVE_MS, self.autosave)
+
+    def release_document_map(self):
+        # Pull every lazily loaded stroke (including ones only undo still knows) out of the map
+        if self.document_map is None:
+            return
+        ops = list(self.history.undo_stack) + self.history.redo_stack
+        for record in list(self.index.boxes) + [r for op in ops for r in op.added + op.removed + op.records]:
+            if isinstance(record, Stroke):
+                record.points
+        self.document_map.close()
+        self.document_map = None
+
+    def save_project(self):
+        filename = filedialog.asksaveasfilename(defaultextension=".paint",
+                                                filetypes=[("Paint documents", "*.paint")])
+        if not filename:
+            return
+        self.release_document_map()
+        records = sorted(self.index.boxes, key=lambda r: r.depth)
+        for record in records:
+            self.assign_uid(record)
+        try:
+            save_document(filename, records, self.layers)
+        except (OSError, ValueError, struct.error) as e:
+            messagebox.showerror("Save", f"Could not save {filename}: {e}")
+            return
+        self.project_path = filename
+        self.unsaved.clear()
+        self.unsaved_moves.clear()
+        self.layers_dirty = False
+        messagebox.showinfo("Saved", "Project saved successfully!")
+
+    def open_project(self):
+        if self.index.boxes and not messagebox.askyesno("Open", "Discard the current drawing?"):
+            return
+        filename = filedialog.askopenfilename(filetypes=[("Paint documents", "*.paint")])
+        if not filename:
+            return
+        try:
+            records, document_map, layers = load_document(filename)
+        except (OSError, ValueError, struct.error) as e:
+            messagebox.showerror("Open", f"Could not open {filename}: {e}")
+            return
+        self.load_records(records, layers)
+        self.document_map = document_map
+        self.project_path = filename
+
+    def load_records(self, records, layers=None):
+        for record in list(self.visible):
+            self.dematerialize(record)
+        self.selection = []
+        self.close_tiles()
+        self.layers, self.layer_ids, self.next_layer_id = [], {}, 0
+        for info in layers or [{"id": 0, "name": "Layer 1"}]:
+            self.new_layer(info["name"], info["id"], info.get("visible", True), info.get("opacity", 1.0))
+        for layer_id in sorted({r.layer for r in records} - set(self.layer_ids)):
+            self.new_layer(f"Layer {layer_id + 1}", layer_id)
+        self.layer = self.layers[-1]
+        self.layers_dirty = False
+        self.index = SpatialGrid()
+        self.history = History()
+        self.unsaved.clear()
+        self.unsaved_moves.clear()
+        for record in records:
+            self.index.insert(record, record.bbox())
+        self.next_depth = max((r.depth[0] for r in records), default=0)
+        self.next_uid = max((r.uid or 0 for r in records), default=0)
+        # Tiles are rendered from the records the first time each one is needed
+        extent = self.index.extent()
+        self.reset_tiles(TileStore.keys(extent) if extent else ())
+        self.dirty = {}
+        self.update_view()
+        self.update_history_label()
+        self.refresh_layers()
+
     # ---------------------- FILE ----------------------
 
     def save_image(self):
+        if self.export:
+            messagebox.showinfo("Save", "An export is still running.")
+            return
         filename = filedialog.asksaveasfilename(defaultextension=".png",
-                                                filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg")])
-        if filename:
-            self.image.save(filename)
-            messagebox.showinfo("Saved", "Image saved successfully!")
+                                                filetypes=[(f"{name} files", "*." + ext)
+                                                           for ext, (name, *_) in EXPORT_FORMATS.items()])
+        if not filename:
+            return
+        fmt = os.path.splitext(filename)[1][1:].lower().replace("jpeg", "jpg")
+        if fmt not in EXPORT_FORMATS:
+            messagebox.showerror("Save", f"Can't save .{fmt} files; use " + ", ".join(EXPORT_FORMATS))
+            return
+        _, option, low, high, default = EXPORT_FORMATS[fmt]
+        label = "Compression level" if option == "compress_level" else "Quality"
+        quality = simpledialog.askinteger("Save", f"{label} ({low}-{high}):", initialvalue=default,
+                                          minvalue=low, maxvalue=high)
+        if quality is None:
+            return
+        sizes = simpledialog.askstring("Save", "Thumbnail sizes in pixels (e.g. 512 256 64), blank for none:")
+        if sizes is None:
+            return
+        try:
+            thumbnails = [int(size) for size in sizes.replace(",", " ").split()]
+        except ValueError:
+            messagebox.showerror("Save", f"Not a list of sizes: {sizes}")
+            return
+        self.export_image(filename, fmt, quality, thumbnails)
+
+    def export_image(self, filename, fmt, quality, thumbnails):
+        # Snapshot on the Tk thread (the tile caches aren't thread-safe), encode on a worker thread;
+        # Pillow's encoders release the GIL, so drawing stays responsive meanwhile
+        self.flush_dirty()
+        image = self.tiles.crop(self.document_bounds())
+        cancel, messages = threading.Event(), queue.Queue()
+
+        def work():
+            try:
+                write_export(image, filename, fmt, quality, thumbnails, cancel.is_set,
+                             lambda fraction, path, written: messages.put(("progress", fraction, path, written)))
+                messages.put(("done", None))
+            except ExportCancelled:
+                messages.put(("done", "cancelled"))
+            except (OSError, ValueError) as e:
+                messages.put(("done", str(e)))
+            except Exception as e:
+                # Anything else must still reach poll_export, or the progress window never closes
+                messages.put(("done", f"{type(e).__name__}: {e}"))
+
+        window = tk.Toplevel(self.root)
+        window.title("Exporting")
+        window.transient(self.root)
+        status = tk.Label(window, text=os.path.basename(filename), width=40, anchor=tk.W)
+        status.pack(padx=10, pady=(10, 0))
+        bar = ttk.Progressbar(window, length=300, maximum=1.0)
+        bar.pack(padx=10, pady=5)
+        tk.Button(window, text="Cancel", command=cancel.set).pack(pady=(0, 10))
+        window.protocol("WM_DELETE_WINDOW", cancel.set)
+        self.export = (cancel, messages, window, bar, status)
+        threading.Thread(target=work, daemon=True).start()
+        self.root.after(EXPORT_POLL_MS, self.poll_export)
+
+    def poll_export(self):
+        # Tk may only be touched from its own thread, so the worker reports through a queue
+        cancel, messages, window, bar, status = self.export
+        while True:
+            try:
+                message = messages.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == "progress":
+                _, fraction, path, written = message
+                bar["value"] = fraction
+                text = os.path.basename(path)
+                if written:
+                    text += f" — {written / 1e6:.1f} MB"
+                status["text"] = text
+            else:
+                window.destroy()
+                self.export = None
+                error = message[1]
+                if error is None:
+                    messagebox.showinfo("Saved", "Image saved successfully!")
+                elif error != "cancelled":
+                    messagebox.showerror("Save", f"Export failed: {error}")
+                return
+        self.root.after(EXPORT_POLL_MS, self.poll_export)
 
     def exit_without_save(self):
         if messagebox.askyesno("Exit", "Exit without saving?"):
             self.root.quit()
 
 
+# ---------------------- BENCHMARK ----------------------
+
+BENCH_TOOLS = ["pen", "pencil", "ink", "oil", "paint", "airbrush", "marker", "rectangle", "oval", "line",
+               "triangle", "emoji", "text", "bucket", "move", "eraser"]
+CLICK_TOOLS = ("emoji", "text", "bucket")  # benchmarked as a stream of clicks, not one drag
+
+def bench_path(count, step=3.0):
+    # A figure eight across the page, `step` pixels apart: a fast mouse sampled at a high rate
+    points, t = [], 0.0
+    for _ in range(count):
+        points.append((400 + 300 * math.sin(t), 300 + 200 * math.sin(2 * t)))
+        t += step / (math.hypot(300 * math.cos(t), 400 * math.cos(2 * t)) or 1)
+    return points
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+    return {"mean": round(sum(ordered) / len(ordered), 3), "p50": pick(0.5), "p90": pick(0.9),
+            "p99": pick(0.99), "max": round(ordered[-1], 3)}
+
+
+def bench_app(use_tk):
+    # A real Tk canvas when a display (or Xvfb) is there, the headless stand-in otherwise
+    if use_tk:
+        try:
+            root = tk.Tk()
+            app = PaintApp(root)
+            return app, root.update, root.destroy
+        except tk.TclError:
+            pass
+    app = PaintApp(HeadlessRoot(), HeadlessCanvas())
+    return app, lambda: None, lambda: None
+
+
+def bench_tool(tool, events, rate, use_tk, background=200, measure_memory=False):
+    app, redraw, close = bench_app(use_tk)
+    random.seed(1)
+    rng = random.Random(1)
+    # Existing content, so the eraser, move tool and culling have something to work against
+    app.set_brush("pen")
+    for _ in range(background):
+        x, y = rng.uniform(0, 800), rng.uniform(0, 600)
+        app.on_click(ReplayEvent(x, y))
+        for _ in range(20):
+            x, y = x + rng.uniform(-8, 8), y + rng.uniform(-8, 8)
+            app.paint(ReplayEvent(x, y))
+        app.on_release(ReplayEvent(x, y))
+    path = [ReplayEvent(x, y) for x, y in bench_path(events)]
+    if tool == "move":  # a stroke under the first point to pick up and drag
+        app.on_click(path[0])
+        app.paint(ReplayEvent(path[0].x + 40, path[0].y))
+        app.on_release(ReplayEvent(path[0].x + 40, path[0].y))
+    if tool in BRUSH_STYLES or tool in RASTER_BRUSHES:
+        app.set_brush(tool)
+    elif tool == "emoji":
+        app.set_emoji("⭐")
+    else:
+        app.set_tool(tool)
+        app.replay_text = "Benchmark"  # the text tool's answer, without a dialog
+    app.flush_motion()
+    redraw()
+    items = len(app.canvas.find_all())
+    if measure_memory:
+        tracemalloc.start()
+
+    # The handler only queues the event; the work happens once per frame in flush_motion
+    per_frame = max(1, round(rate / 60))
+    if tool == "bucket":  # each fill is a page-sized record: one click per frame, not per pointer event
+        path, per_frame = path[::per_frame], 1
+    latencies, flushes, frames, frame = [], [], [], 0
+    if tool not in CLICK_TOOLS:
+        app.on_click(path[0])
+    for i, event in enumerate(path[1:], 1):
+        start = time.perf_counter_ns()
+        if tool in CLICK_TOOLS:  # a stream of clicks, each adding an item
+            app.on_click(event)
+            app.on_release(event)
+        else:
+            app.paint(event)
+        elapsed = time.perf_counter_ns() - start
+        latencies.append(elapsed / 1000)
+        frame += elapsed
+        if i % per_frame == 0:
+            start = time.perf_counter_ns()
+            app.flush_motion()
+            flushed = time.perf_counter_ns()
+            redraw()
+            flushes.append((flushed - start) / 1000)
+            frames.append((frame + time.perf_counter_ns() - start) / 1e6)
+            frame = 0
+    start = time.perf_counter_ns()
+    app.on_release(path[-1])
+    redraw()
+    release = (time.perf_counter_ns() - start) / 1e6
+
+    result = {"latency_us": percentiles(latencies), "flush_us": percentiles(flushes or [0]),
+              "frame_ms": percentiles(frames or [frame / 1e6]),
+              "slow_frames": sum(f > FRAME_MS for f in frames), "release_ms": round(release, 3),
+              "items_added": len(app.canvas.find_all()) - items}
+    if measure_memory:
+        result["memory_kb"] = round(tracemalloc.get_traced_memory()[0] / 1024, 1)
+        tracemalloc.stop()
+    app.close_tiles()
+    close()
+    return result
+
+
+def naive_fill_mask(image, x, y, tolerance):
+    # Pixel-by-pixel breadth-first flood: the baseline fill_mask is measured against
+    w, h = image.size
+    pixels = image.load()
+    seed = pixels[x, y]
+    mask = np.zeros((h, w), bool)
+    mask[y, x] = True
+    queue = deque([(x, y)])
+    while queue:
+        cx, cy = queue.popleft()
+        for nx, ny in ((cx + 1, cy), (cx - 1, cy), (cx, cy + 1), (cx, cy - 1)):
+            if 0 <= nx < w and 0 <= ny < h and not mask[ny, nx] \
+                    and all(abs(a - b) <= tolerance for a, b in zip(pixels[nx, ny], seed)):
+                mask[ny, nx] = True
+                queue.append((nx, ny))
+    return mask
+
+
+def bench_fill(width=1920, height=1080, tolerance=32, repeat=5):
+    # Bucket fill of the background of a scribbled full-HD page, scanline runs vs. per-pixel BFS
+    rng = random.Random(1)
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for _ in range(200):
+        x, y = rng.uniform(0, width), rng.uniform(0, height)
+        pts = [(x + rng.uniform(-60, 60), y + rng.uniform(-60, 60)) for _ in range(3)]
+        draw.line(pts, fill=rng.choice(["black", "red", "blue", "green"]), width=rng.randint(1, 8))
+    for _ in range(40):
+        x, y, r = rng.uniform(0, width), rng.uniform(0, height), rng.uniform(10, 80)
+        draw.ellipse((x - r, y - r, x + r, y + r), outline="black", width=3)
+    x, y = 0, 0
+    while image.getpixel((x, y)) != (255, 255, 255):  # start on the page itself, not a scribble
+        x += 1
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fast = fill_mask(image, x, y, tolerance)
+        times.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    naive = naive_fill_mask(image, x, y, tolerance)
+    naive_time = time.perf_counter() - start
+    print(f"Flood fill of {width}x{height}, {int(fast.sum())} pixels filled")
+    print(f"  scanline runs: {min(times) * 1000:8.1f} ms (best of {repeat})")
+    print(f"  per-pixel BFS: {naive_time * 1000:8.1f} ms")
+    print(f"  speed-up {naive_time / min(times):.0f}x, masks {'match' if (fast == naive).all() else 'DIFFER'}")
+    return bool((fast == naive).all())
+
+
+def run_benchmark(out, events=1000, rate=1000, use_tk=True, baseline=None):
+    # Per-event handler latency, per-frame flush and frame time, canvas item and memory growth for every tool
+    display = "tk" if use_tk else "headless"
+    if use_tk:
+        try:
+            tk.Tk().destroy()
+        except tk.TclError:
+            display = "headless"
+    results = {"meta": {"events": events, "rate_hz": rate, "display": display, "python": sys.version.split()[0],
+                        "platform": sys.platform, "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+               "tools": {}}
+    for tool in BENCH_TOOLS:
+        result = bench_tool(tool, events, rate, display == "tk")
+        # Memory is traced in a second pass so tracing doesn't skew the timings
+        result["memory_kb"] = bench_tool(tool, events, rate, display == "tk", measure_memory=True)["memory_kb"]
+        results["tools"][tool] = result
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    previous = {}
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            previous = json.load(f).get("tools", {})
+    regressions = 0
+    # Regressions are judged on the per-frame work, not on queueing the event: the typical flush
+    # and the worst frames, each with a floor so scheduler jitter doesn't count
+    gates = [("flush_us", "p50", 50), ("frame_ms", "p99", FRAME_MS / 8)]
+    print(f"{'tool':10} {'event us':>9} {'flush p50':>10} {'flush p99':>10} {'frame p99':>10} "
+          f"{'slow':>5} {'items':>6} {'mem kB':>8}")
+    for tool, r in results["tools"].items():
+        line = (f"{tool:10} {r['latency_us']['p99']:9.1f} {r['flush_us']['p50']:10.1f} {r['flush_us']['p99']:10.1f} "
+                f"{r['frame_ms']['p99']:10.2f} {r['slow_frames']:5} {r['items_added']:6} {r['memory_kb']:8.1f}")
+        for key, stat, floor in gates:
+            if key not in previous.get(tool, {}):
+                continue  # baselines from before flush_us was measured
+            before, after = previous[tool][key][stat], r[key][stat]
+            change = after / max(before, 1e-9) - 1
+            line += f"  {key.split('_')[0]} {stat} {change:+.0%}"
+            if change > 0.25 and after - before > floor:
+                line += " REGRESSION"
+                regressions += 1
+        print(line)
+    print(f"Results written to {out}")
+    return regressions
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ultimate Paint App")
+    parser.add_argument("--record", metavar="FILE", help="save this session's events for replay")
+    parser.add_argument("--replay", nargs="+", metavar="SESSION", help="render recorded sessions without a window")
+    parser.add_argument("--out", default=".", help="folder for the rendered images")
+    parser.add_argument("--format", default="png", choices=list(EXPORT_FORMATS))
+    parser.add_argument("--quality", type=int, help="PNG compression level 0-9, or JPEG/WebP quality")
+    parser.add_argument("--thumbnail", type=int, metavar="PIXELS", help="shrink images to fit this size")
+    parser.add_argument("--thumbnails", type=int, nargs="+", default=(), metavar="PIXELS",
+                        help="also write name_PIXELS thumbnails at these sizes")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("--benchmark", metavar="FILE", help="measure input latency per tool, save JSON here")
+    parser.add_argument("--baseline", metavar="FILE", help="earlier --benchmark results to compare against")
+    parser.add_argument("--events", type=int, default=1000, help="motion events per tool")
+    parser.add_argument("--rate", type=int, default=1000, help="simulated pointer rate in Hz")
+    parser.add_argument("--headless", action="store_true", help="benchmark without a Tk canvas")
+    parser.add_argument("--fill-benchmark", action="store_true", help="time the bucket fill on a full-HD page")
+    args = parser.parse_args()
+
+    if args.fill_benchmark:
+        sys.exit(0 if bench_fill() else 1)
+
+    if args.benchmark:
+        sys.exit(1 if run_benchmark(args.benchmark, args.events, args.rate, not args.headless, args.baseline) else 0)
+
+    if args.replay:
+        failed = 0
+        for source, error in export_batch(args.replay, args.out, args.format, args.thumbnail, args.workers,
+                                             args.quality, args.thumbnails):
+            if error:
+                failed += 1
+                print(f"{source}: {error}", file=sys.stderr)
+        print(f"Rendered {len(args.replay) - failed} of {len(args.replay)} sessions to {args.out}")
+        sys.exit(1 if failed else 0)
+
     root = tk.Tk()
     app = PaintApp(root)
-    root.mainloop()
\ No newline at end of file
+    if args.record:
+        app.recording = []
+    root.mainloop()
+    if args.record:
+        with open(args.record, "w", encoding="utf-8") as f:
+            json.dump(app.recording, f)
\ No newline at end of file
@@ -1,27 +1,551 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+import argparse
+import ast
+import bisect
 import math
+import multiprocessing
+import operator
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
 
-# Scientific Calculator with Tabs + Dark Mode
-root = tk.Tk()
-root.title("Advanced Scientific Calculator")
-root.geometry("420x580")
-root.resizable(False, False)
+# -----------------------------
+# Expression Engine
+# -----------------------------
+# An expression is parsed once, checked against the calculator's grammar and compiled;
+# compiled forms are cached, so evaluating the same text again only runs the code.
+
+MAX_EXPRESSION = 10000  # characters
+MAX_INT_BITS = 14000  # largest integer *, **, fact or lcm may produce; str() still shows ~4200 digits
+LN2 = math.log(2)
+
+def check_size(bits):
+    if bits > MAX_INT_BITS:
+        raise OverflowError("result too large")
+
+def checked_pow(base, exponent):
+    if isinstance(base, int) and isinstance(exponent, int) and exponent > 0 and abs(base) > 1:
+        check_size(exponent * (abs(base).bit_length() - 1))
+    result = base ** exponent
+    if isinstance(result, complex):  # (-8) ** (1/3)
+        raise ValueError("math domain error")
+    return result
+
+def checked_mul(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        check_size(a.bit_length() + b.bit_length())
+    return a * b
+
+def checked_lcm(*integers):
+    # The lcm is at most the product of its arguments
+    if all(isinstance(n, int) for n in integers):
+        check_size(sum(n.bit_length() for n in integers))
+    return math.lcm(*integers)
+
+def checked_factorial(n):
+    if isinstance(n, int) and n > 1:
+        check_size(math.lgamma(n + 1) / LN2)
+    return math.factorial(n)
+
+def checked_comb(n, k):
+    if isinstance(n, int) and isinstance(k, int) and 0 < k < n:
+        check_size((math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)) / LN2)
+    return math.comb(n, k)
+
+def checked_perm(n, k=None):
+    if isinstance(n, int) and n > 1 and (k is None or isinstance(k, int) and 0 < k <= n):
+        check_size((math.lgamma(n + 1) - math.lgamma(n - (n if k is None else k) + 1)) / LN2)
+    return math.perm(n, k)
+
+# Everything in math, reachable as math.sin( or plain sin(; the guarded versions replace the originals
+MATH_NAMES = {name: value for name, value in vars(math).items() if not name.startswith("_")}
+MATH_NAMES.update(factorial=checked_factorial, comb=checked_comb, perm=checked_perm, lcm=checked_lcm)
+NAMESPACE = dict(MATH_NAMES, __builtins__={}, _pow=checked_pow, _mul=checked_mul)
+
+ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name, ast.Attribute, ast.Constant,
+                 ast.Load, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+                 ast.UAdd, ast.USub)
+
+def normalize(expression):
+    return expression.strip().replace("^", "**")
+
+@lru_cache(maxsize=512)
+def compile_expression(expression, variables=()):
+    # expression is already normalized; raises SyntaxError or ValueError if it isn't calculator grammar.
+    # variables are extra names it may use (x for plotting), supplied as locals when it runs
+    if len(expression) > MAX_EXPRESSION:
+        raise ValueError("expression too long")
+    tree = ast.parse(expression, mode="eval")
+    # ast.walk is iterative, so long chains like 1+1+...+1 don't hit the recursion limit
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise ValueError(f"{type(node).__name__} not allowed")
+        if isinstance(node, ast.Constant) and type(node.value) not in (int, float):
+            raise ValueError(f"{node.value!r} not allowed")
+        if isinstance(node, ast.Name) and node.id not in MATH_NAMES and node.id != "math" \
+                and node.id not in variables:
+            raise ValueError(f"unknown name {node.id}")
+        if isinstance(node, ast.Attribute) and not (isinstance(node.value, ast.Name) and node.value.id == "math"
+                                                    and node.attr in MATH_NAMES):
+            raise ValueError(f"unknown name {ast.unparse(node)}")
+        if isinstance(node, ast.Call) and node.keywords:
+            raise ValueError("keyword arguments not allowed")
+    # math.sin becomes a plain name lookup and * and ** go through the size check; children are
+    # rewritten before their parents so no replaced node is left holding an unchecked operator
+    for node in reversed(list(ast.walk(tree))):
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, list):
+                value[:] = [rewrite(child) for child in value]
+            elif isinstance(value, ast.AST):
+                setattr(node, field, rewrite(value))
+    return compile(ast.fix_missing_locations(tree), "<calculator>", "eval")
+
+def rewrite(node):
+    if isinstance(node, ast.Attribute):
+        return ast.copy_location(ast.Name(node.attr, ast.Load()), node)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Pow, ast.Mult)):
+        helper = "_pow" if isinstance(node.op, ast.Pow) else "_mul"
+        return ast.copy_location(ast.Call(ast.Name(helper, ast.Load()), [node.left, node.right], []), node)
+    return node
+
+def evaluate(expression):
+    return eval(compile_expression(normalize(expression)), NAMESPACE)
+
+# -----------------------------
+# Worker Evaluation
+# -----------------------------
+# "=" hands the expression to a worker process, so nothing typed can freeze the window;
+# a calculation past the time limit, or cancelled, is stopped by killing the worker.
+
+WORKER_INT_BITS = 4000000  # ~1.2 million digits; the time limit catches anything slower to reach
+TIME_LIMIT = 5.0  # seconds
+POLL_MS = 50
+PREVIEW_DIGITS = 100  # longer integers are shown in scientific notation
+PREVIEW_LIMIT = 10 ** PREVIEW_DIGITS
+
+def format_result(result):
+    # str() of a huge int is quadratic (and refused past 4300 digits), so only the magnitude is worked out
+    if isinstance(result, int) and abs(result) >= PREVIEW_LIMIT:
+        exponent = math.log10(abs(result))
+        digits = int(exponent)
+        mantissa = f"{10 ** (exponent - digits):.9f}".rstrip("0").rstrip(".")
+        if mantissa.startswith("10"):
+            mantissa, digits = "1", digits + 1
+        return f"{'-' if result < 0 else ''}{mantissa}e+{digits}"
+    return str(result)
+
+def evaluation_worker(conn):
+    # Worker process main loop: answer each expression with ("ok", text), ("overflow", message) or ("error", message)
+    global MAX_INT_BITS
+    MAX_INT_BITS = WORKER_INT_BITS
+    while True:
+        try:
+            expression = conn.recv()
+        except EOFError:
+            return
+        try:
+            reply = ("ok", format_result(evaluate(expression)))
+        except OverflowError as e:
+            reply = ("overflow", str(e))
+        except Exception as e:
+            reply = ("error", f"{type(e).__name__}: {e}")
+        conn.send(reply)
+
+class Evaluator:
+    # One long-lived worker process, replaced whenever a calculation has to be stopped
+    def __init__(self):
+        self.process = None
+        self.conn = None
+
+    def start(self):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=evaluation_worker, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    def submit(self, expression):
+        if self.process is None or not self.process.is_alive():
+            self.start()
+        self.conn.send(expression)
+
+    def result(self):
+        # The reply, or None while the worker is still busy
+        try:
+            return self.conn.recv() if self.conn.poll() else None
+        except EOFError:  # the worker died, e.g. out of memory
+            self.process = None
+            return ("error", "calculation failed")
+
+    def cancel(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+        self.start()
+
+# -----------------------------
+# Live Preview
+# -----------------------------
+# A shunting-yard evaluator over the same grammar that keeps its state after every token.
+# States are persistent stacks ((head, tail) pairs), so keeping one per token is cheap, and an edit
+# resumes from the last token it can't have changed: only the tail is re-parsed and only operators
+# whose operands changed are evaluated again.
+
+PREVIEW_MS = 150  # debounce: the preview waits for a pause in typing
+LEX_LOOKAHEAD = 3  # a token can depend on up to 3 characters after it ("1" before "e+5")
+TOKEN = re.compile(r"\s*(?:(\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)"
+                   r"|((?:math\.)?[A-Za-z_]\w*)|(\*\*|//|[-+*/%^(),]))")
+PRECEDENCE = {"+": 1, "-": 1, "*": 2, "/": 2, "//": 2, "%": 2, "neg": 3, "pos": 3, "**": 4}
+BINARY = {"+": operator.add, "-": operator.sub, "*": checked_mul, "/": operator.truediv,
+          "//": operator.floordiv, "%": operator.mod, "**": checked_pow}
+START = (None, None, True)  # (value stack, operator stack, expecting an operand)
+
+def reduce_top(values, ops):
+    op, ops = ops
+    if op == "neg" or op == "pos":
+        value, values = values
+        return (-value if op == "neg" else +value, values), ops
+    right, (left, values) = values
+    return (BINARY[op](left, right), values), ops
+
+def reduce_while(values, ops, precedence):
+    # Apply stacked operators that bind at least as tightly as the incoming one (** is right-associative)
+    while ops and ops[0] in PRECEDENCE and (PRECEDENCE[ops[0]] > precedence
+                                            or PRECEDENCE[ops[0]] == precedence != PRECEDENCE["**"]):
+        values, ops = reduce_top(values, ops)
+    return values, ops
+
+def parse_token(state, number, name, symbol):
+    # The state after one more token, or None if the text can no longer be a valid expression
+    values, ops, expecting = state
+    if ops and ops[0][0] == "fn" and symbol != "(":
+        return None  # a function name must be followed by its argument list
+    if number is not None:
+        if not expecting or len(number) > 1 and number[0] == "0" and number.strip("0").isdigit():
+            return None  # Python rejects leading zeros such as 012
+        value = int(number) if number.isdigit() else float(number)
+        return (value, values), ops, False
+    if name is not None:
+        value = MATH_NAMES.get(name[5:] if name.startswith("math.") else name)
+        if not expecting or value is None:
+            return None
+        if callable(value):
+            return values, (("fn", value), ops), True
+        return (value, values), ops, False
+    if symbol == "^":
+        symbol = "**"
+    if symbol == "(":
+        if not expecting:
+            return None
+        if ops and ops[0][0] == "fn":
+            return values, (("call", ops[0][1], 1), ops[1]), True
+        return values, (("(",), ops), True
+    if symbol in (")", ","):
+        if expecting:
+            # Only a call's ")" may follow a comma: sqrt(2,) is sqrt(2), as in Python
+            if symbol == "," or not ops or ops[0][0] != "call" or ops[0][2] == 1:
+                return None
+            (_, function, count), ops = ops
+            count -= 1
+        else:
+            values, ops = reduce_while(values, ops, 0)
+            if not ops:
+                return None
+            top, ops = ops
+            if symbol == ",":
+                return (values, (("call", top[1], top[2] + 1), ops), True) if top[0] == "call" else None
+            if top[0] != "call":
+                return values, ops, False
+            _, function, count = top
+        args = []
+        for _ in range(count):
+            value, values = values
+            args.append(value)
+        return (function(*reversed(args)), values), ops, False
+    if expecting:
+        if symbol in ("-", "+"):
+            return values, ("neg" if symbol == "-" else "pos", ops), True
+        return None
+    values, ops = reduce_while(values, ops, PRECEDENCE[symbol])
+    return values, (symbol, ops), True
+
+def finish_state(state):
+    values, ops, expecting = state
+    if expecting:
+        return None
+    values, ops = reduce_while(values, ops, 0)
+    return None if ops else values[0]  # anything left is an unclosed "("
+
+def common_prefix(a, b):
+    if b.startswith(a):
+        return len(a)
+    if a.startswith(b):
+        return len(b)
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:  # bisect with slice compares rather than a character loop
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+class LivePreview:
+    def __init__(self):
+        self.text = ""
+        self.ends = []  # where each parsed token ends in self.text
+        self.states = [START]  # states[i] is the parser state after the first i tokens; None once invalid
+
+    def update(self, text):
+        # The preview for text ("" when it isn't a complete, valid expression, or too long to evaluate)
+        if len(normalize(text)) > MAX_EXPRESSION:
+            return ""
+        keep = bisect.bisect_right(self.ends, common_prefix(self.text, text) - LEX_LOOKAHEAD)
+        del self.ends[keep:]
+        del self.states[keep + 1:]
+        self.text = text
+        pos, state = (self.ends[-1] if self.ends else 0), self.states[-1]
+        while state is not None and pos < len(text):
+            match = TOKEN.match(text, pos)
+            if not match:
+                state = None if text[pos:].strip() else state
+                break
+            try:
+                state = parse_token(state, *match.groups())
+            except (ArithmeticError, ValueError, TypeError):
+                state = None
+            pos = match.end()
+            self.ends.append(pos)
+            self.states.append(state)
+        try:
+            result = finish_state(state) if state is not None else None
+            return "" if result is None else "= " + format_result(result)
+        except (ArithmeticError, ValueError, TypeError):
+            return ""
+
+def benchmark_preview(tokens=1000, seed=0):
+    # Type a long expression one character at a time and compare the live preview's cost per keystroke
+    # with compiling the whole text again (the compile cache can't help: every prefix is new)
+    rng = random.Random(seed)
+    parts = []
+    while len(parts) < tokens:
+        if rng.random() < 0.1:
+            parts += ["math.sqrt", "(", str(rng.randint(1, 99)), "+", str(rng.randint(1, 99)), ")"]
+        else:
+            parts.append(str(rng.randint(1, 999)))
+        parts.append(rng.choice("+-*/"))
+    text = "".join(parts[:-1])
+    token_at, count = [], 0
+    for part in parts[:-1]:
+        count += 1
+        token_at += [count] * len(part)
+    # Two separate passes, so the full parse's garbage doesn't land in the preview's timings
+    preview, shown, incremental = LivePreview(), [], []
+    for i in range(1, len(text) + 1):
+        t = time.perf_counter()
+        shown.append(preview.update(text[:i]))
+        incremental.append(time.perf_counter() - t)
+    timings = []
+    for i in range(1, len(text) + 1):
+        compile_expression.cache_clear()
+        t = time.perf_counter()
+        try:
+            full = "= " + format_result(evaluate(text[:i]))
+        except (SyntaxError, NameError, ArithmeticError, ValueError, TypeError):
+            full = ""
+        timings.append((token_at[i - 1], incremental[i - 1], time.perf_counter() - t))
+        if shown[i - 1] != full:
+            print(f"Mismatch at {text[:i][-30:]!r}: {shown[i - 1]!r} vs {full!r}")
+            return False
+    print(f"Keystroke latency typing a {tokens}-token expression ({len(text)} characters), median per window:")
+    print(f"{'tokens':>12} {'incremental':>12} {'full parse':>12}")
+    step = max(1, tokens // 5)
+    for low in range(0, tokens, step):
+        window = [t for t in timings if low < t[0] <= low + step]
+        print(f"{low + 1:>5}-{low + step:<6} {statistics.median(t[1] for t in window) * 1e6:>9.1f} us"
+              f" {statistics.median(t[2] for t in window) * 1e6:>9.1f} us")
+    return True
+
+# -----------------------------
+# Plotting
+# -----------------------------
+# The expression is compiled once and run on a whole NumPy array of x values per call. Samples stay
+# cached: a pan only computes the newly exposed ends, a zoom only refines the segments that became
+# too coarse, and refinement inserts midpoints where the curve bends more than CURVE_PX on screen.
+
+MAX_SEGMENT_PX = 4  # samples are at most this far apart on screen...
+CURVE_PX = 0.5  # ...and a segment is split while its midpoint is further than this off the chord
+MIN_SEGMENT_PX = 0.25  # but never finer than this
+REFINE_ROUNDS = 10
+MAX_SAMPLES = 200000  # past this the cache starts over from the current view
+
+np = None  # imported on first use: only plotting needs NumPy, and importing it slows startup
+VECTOR_NAMESPACE = None
+
+def load_numpy():
+    # True once NumPy is importable and the vectorized namespace is ready
+    global np, VECTOR_NAMESPACE
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+        VECTOR_NAMESPACE = vector_namespace()
+    return True
+
+def vector_log(x, base=None):
+    return np.log(x) if base is None else np.log(x) / np.log(base)
+
+def elementwise(func):
+    # Like a ufunc, give nan where the function isn't defined instead of failing the whole array
+    def apply(*args):
+        try:
+            return func(*args)
+        except (ValueError, ArithmeticError):
+            return math.nan
+    return np.vectorize(apply, otypes=[float])
+
+def vector_namespace():
+    # math names backed by NumPy ufuncs where there is one, else applied element by element
+    names = {}
+    for name, value in MATH_NAMES.items():
+        if not callable(value):
+            names[name] = value
+        elif name == "log":
+            names[name] = vector_log
+        elif isinstance(getattr(np, name, None), np.ufunc):
+            names[name] = getattr(np, name)
+        else:
+            names[name] = elementwise(value)
+    return dict(names, __builtins__={}, _pow=checked_pow, _mul=checked_mul)
+
+class PlotSamples:
+    # Sorted samples of one expression in x; xs[0]..xs[-1] is the range covered so far
+    def __init__(self, expression):
+        if not load_numpy():
+            raise RuntimeError("plotting needs NumPy")
+        self.code = compile_expression(normalize(expression), ("x",))
+        self.xs = self.ys = None
+        self.evaluated = 0  # points computed so far
+
+    def evaluate(self, xs):
+        with np.errstate(all="ignore"):
+            ys = eval(self.code, VECTOR_NAMESPACE, {"x": xs})
+        self.evaluated += len(xs)
+        return np.broadcast_to(np.asarray(ys, dtype=float), xs.shape)  # "2" is a constant, not an array
+
+    def sample(self, x0, x1, x_scale, y_scale):
+        # The samples covering x0..x1, fine enough at x_scale, y_scale pixels per unit
+        step = MAX_SEGMENT_PX / x_scale
+        if self.xs is None or len(self.xs) > MAX_SAMPLES:
+            self.xs = np.linspace(x0, x1, int((x1 - x0) / step) + 2)
+            self.ys = self.evaluate(self.xs)
+        elif x0 < self.xs[0] or x1 > self.xs[-1]:
+            left = np.arange(self.xs[0] - step, x0 - step, -step)[::-1]
+            right = np.arange(self.xs[-1] + step, x1 + step, step)
+            ys = self.evaluate(np.concatenate([left, right]))  # both ends in one call
+            self.xs = np.concatenate([left, self.xs, right])
+            self.ys = np.concatenate([ys[:len(left)], self.ys, ys[len(left):]])
+        for _ in range(REFINE_ROUNDS):
+            start, xs, ys = self.visible(x0, x1)
+            sx, sy = xs * x_scale, ys * y_scale
+            width = np.diff(sx)
+            split = width > MAX_SEGMENT_PX
+            # Distance of each inner point from the chord between its neighbours
+            with np.errstate(all="ignore"):
+                chord = sy[:-2] + (sy[2:] - sy[:-2]) * (sx[1:-1] - sx[:-2]) / (sx[2:] - sx[:-2])
+                bent = np.abs(sy[1:-1] - chord) > CURVE_PX
+            split[:-1] |= bent
+            split[1:] |= bent
+            finite = np.isfinite(sy)
+            split |= finite[:-1] != finite[1:]  # close in on where the function stops being defined
+            split &= width > MIN_SEGMENT_PX
+            index = np.flatnonzero(split)
+            if not len(index):
+                break
+            middle = (xs[index] + xs[index + 1]) / 2
+            self.xs = np.insert(self.xs, start + index + 1, middle)
+            self.ys = np.insert(self.ys, start + index + 1, self.evaluate(middle))
+        return self.visible(x0, x1)[1:]
+
+    def visible(self, x0, x1):
+        # (offset, xs, ys) for the samples in x0..x1 plus one either side, so the line reaches the edges
+        start = max(int(np.searchsorted(self.xs, x0)) - 1, 0)
+        end = int(np.searchsorted(self.xs, x1, "right")) + 1
+        return start, self.xs[start:end], self.ys[start:end]
+
+# -----------------------------
+# Batch Mode
+# -----------------------------
+# --batch FILE evaluates one expression per line with the same engine as "=" and writes one result
+# per line, in input order. Lines are read and dispatched to a process pool in chunks, with only a
+# few chunks in flight, so memory stays flat however long the input is. Every operator and function
+# that can grow an integer (*, **, factorial, comb, perm, lcm) is checked against MAX_INT_BITS, so a
+# line is at most MAX_EXPRESSION characters of arithmetic on bounded numbers: the slowest lines found
+# take about 0.2 s, and none can stall its worker.
+
+BATCH_CHUNK = 2000  # lines per task: enough to amortise the pickling, few enough to keep every worker busy
+
+def evaluate_line(line):
+    if not line.strip():
+        return ""
+    try:
+        return format_result(evaluate(line))
+    except Exception as e:
+        return f"error: {type(e).__name__}: {e}"
 
-# Entry Field
-display_var = tk.StringVar()
-display = tk.Entry(root, textvariable=display_var, font=("Arial", 20), bd=8, relief="sunken", justify="right")
-display.pack(fill="x", pady=10, padx=10)
+def evaluate_chunk(lines):
+    return [evaluate_line(line) for line in lines]
 
-# Notebook (Tabs)
-notebook = ttk.Notebook(root)
-notebook.pack(expand=True, fill="both")
+def evaluate_batch(lines, workers=None, chunk=BATCH_CHUNK):
+    # Results for an iterable of expressions, yielded in input order
+    workers = workers or os.cpu_count() or 1
+    lines = (line.rstrip("\r\n") for line in lines)
+    pending = deque()
+    with ProcessPoolExecutor(workers) as pool:
+        while True:
+            while len(pending) < workers * 2:
+                block = list(islice(lines, chunk))
+                if not block:
+                    break
+                pending.append(pool.submit(evaluate_chunk, block))
+            if not pending:
+                return
+            yield from pending.popleft().result()
 
-basic_tab = tk.Frame(notebook)
-scientific_tab = tk.Frame(notebook)
+def run_batch(source, target, workers=None, chunk=BATCH_CHUNK):
+    # "-" means stdin / stdout; the throughput report goes to stderr so it never mixes with results
+    src = sys.stdin if source == "-" else open(source, encoding="utf-8")
+    out = sys.stdout if target == "-" else open(target, "w", encoding="utf-8")
+    count, errors, t = 0, 0, time.perf_counter()
+    try:
+        for result in evaluate_batch(src, workers, chunk):
+            out.write(result + "\n")
+            count += 1
+            errors += result.startswith("error:")
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - t
+    print(f"Evaluated {count} expressions ({errors} errors) in {elapsed:.2f} s: "
+          f"{count / elapsed:,.0f} per second with {workers or os.cpu_count()} workers", file=sys.stderr)
+    return errors
 
-notebook.add(basic_tab, text="Basic")
-notebook.add(scientific_tab, text="Scientific")
+evaluator = Evaluator()
+started = None  # perf_counter() when the running calculation was submitted
+preview = LivePreview()
+preview_job = None  # pending root.after id for the debounced preview
 
 # Helper Functions
 
@@ -36,25 +560,67 @@ def backspace():
     display_var.set(current[:-1])
 
 def calculate():
-    try:
-        expression = display_var.get().replace("^", "**")
-        result = eval(expression, {"__builtins__": None}, math.__dict__)
-        display_var.set(str(result))
-    except Exception:
-        messagebox.showerror("Error", "Invalid Expression")
+    global started
+    if started is not None:
+        return  # one calculation at a time
+    evaluator.submit(display_var.get())
+    started = time.perf_counter()
+    status_var.set("Calculating…")
+    cancel_btn.config(state="normal")
+    root.after(POLL_MS, poll_result)
+
+def poll_result():
+    if started is None:
+        return  # cancelled
+    reply = evaluator.result()
+    if reply is None:
+        if time.perf_counter() - started > TIME_LIMIT:
+            cancel()
+            messagebox.showerror("Error", "Calculation took too long")
+        else:
+            root.after(POLL_MS, poll_result)
+        return
+    finish()
+    kind, text = reply
+    if kind == "ok":
+        display_var.set(text)
+    else:
+        messagebox.showerror("Error", "Result too large" if kind == "overflow" else "Invalid Expression")
         display_var.set("")
 
+def cancel():
+    if started is not None:
+        evaluator.cancel()
+        finish()
+
+def finish():
+    global started
+    started = None
+    status_var.set("")
+    cancel_btn.config(state="disabled")
+
+def schedule_preview(*args):
+    # Every change to the display lands here (insert, backspace, typing); the preview runs once typing pauses
+    global preview_job
+    if preview_job:
+        root.after_cancel(preview_job)
+    preview_job = root.after(PREVIEW_MS, show_preview)
+
+def show_preview():
+    global preview_job
+    preview_job = None
+    preview_var.set(preview.update(display_var.get()))
+
 # -----------------------------
 # Button Builder
 # -----------------------------
-buttons = []  # keep track of all buttons for theme switching
+# Buttons take their look from the Calc.TButton style, so they need no per-widget colours
 
 def make_button(frame, text, row, col, cmd=None, colspan=1):
     if not cmd:
         cmd = lambda: insert(text)
-    b = tk.Button(frame, text=text, width=6, height=2, font=("Arial", 14), command=cmd, bg="#f0f0f0", fg="black")
-    b.grid(row=row, column=col, columnspan=colspan, padx=3, pady=3, sticky="nsew")
-    buttons.append(b)
+    b = ttk.Button(frame, text=text, width=6, style="Calc.TButton", command=cmd)
+    b.grid(row=row, column=col, columnspan=colspan, padx=3, pady=3, ipady=12, sticky="nsew")
     return b
 
 # -----------------------------
@@ -68,17 +634,18 @@ basic_layout = [
     ["0", ".", "=", "+"]
 ]
 
-for r, row in enumerate(basic_layout):
-    for c, char in enumerate(row):
-        if char == "=":
-            make_button(basic_tab, char, r, c, calculate)
-        else:
-            make_button(basic_tab, char, r, c)
+def build_basic_tab(frame):
+    for r, row in enumerate(basic_layout):
+        for c, char in enumerate(row):
+            if char == "=":
+                make_button(frame, char, r, c, calculate)
+            else:
+                make_button(frame, char, r, c)
 
-make_button(basic_tab, "C", 4, 0, clear)
-make_button(basic_tab, "⌫", 4, 1, backspace)
-make_button(basic_tab, "(", 4, 2)
-make_button(basic_tab, ")", 4, 3)
+    make_button(frame, "C", 4, 0, clear)
+    make_button(frame, "⌫", 4, 1, backspace)
+    make_button(frame, "(", 4, 2)
+    make_button(frame, ")", 4, 3)
 
 # -----------------------------
 # Scientific Buttons
@@ -103,47 +670,287 @@ scientific_buttons = [
     ("=", 3, 3, calculate),
 ]
 
-for text, r, c, cmd in scientific_buttons:
-    make_button(scientific_tab, text, r, c, cmd)
+def build_scientific_tab(frame):
+    for text, r, c, cmd in scientific_buttons:
+        make_button(frame, text, r, c, cmd)
+
+# -----------------------------
+# Plot Tab
+# -----------------------------
+
+plot = None  # PlotSamples of the plotted expression
+view = [-10.0, 10.0, -10.0, 10.0]  # x0, x1, y0, y1
+drag = None  # (pointer x, pointer y, view) when a pan started
+
+def build_plot_tab(frame):
+    global plot_var, x_from, x_to, plot_canvas, curve, x_axis, y_axis
+    if not load_numpy():
+        ttk.Label(frame, text="Plotting needs NumPy (pip install numpy)").pack(pady=20)
+        return
+    controls = ttk.Frame(frame)
+    controls.pack(fill="x", padx=5, pady=5)
+    ttk.Label(controls, text="f(x) =").pack(side="left")
+    plot_var = tk.StringVar(value="math.sin(x)*x")
+    plot_entry = ttk.Entry(controls, textvariable=plot_var, width=16)
+    plot_entry.pack(side="left", fill="x", expand=True)
+    plot_entry.bind("<Return>", lambda event: plot_expression())
+    x_from, x_to = tk.StringVar(value="-10"), tk.StringVar(value="10")
+    ttk.Entry(controls, textvariable=x_from, width=5).pack(side="left", padx=(5, 0))
+    ttk.Label(controls, text="to").pack(side="left")
+    ttk.Entry(controls, textvariable=x_to, width=5).pack(side="left")
+    ttk.Button(controls, text="Plot", command=plot_expression).pack(side="left", padx=5)
+    plot_canvas = tk.Canvas(frame, bg="white", highlightthickness=0)
+    plot_canvas.pack(fill="both", expand=True, padx=5, pady=(0, 5))
+    x_axis = plot_canvas.create_line(0, 0, 0, 0, fill="#bbb")
+    y_axis = plot_canvas.create_line(0, 0, 0, 0, fill="#bbb")
+    curve = plot_canvas.create_line(0, 0, 0, 0, fill="blue", width=2, state="hidden")
+    plot_canvas.bind("<ButtonPress-1>", start_pan)
+    plot_canvas.bind("<B1-Motion>", pan)
+    plot_canvas.bind("<MouseWheel>", lambda event: zoom(event, 0.8 if event.delta > 0 else 1.25))
+    plot_canvas.bind("<Button-4>", lambda event: zoom(event, 0.8))
+    plot_canvas.bind("<Button-5>", lambda event: zoom(event, 1.25))
+    plot_canvas.bind("<Configure>", lambda event: redraw())
+
+def plot_expression():
+    global plot
+    try:
+        plot = PlotSamples(plot_var.get())
+        x0, x1 = float(x_from.get()), float(x_to.get())
+        if not x0 < x1:
+            raise ValueError("empty range")
+        # A first pass with no y scale yet (so no refinement) to fit y to the middle 96% of the values;
+        # a pole shouldn't flatten everything else
+        xs, ys = plot.sample(x0, x1, plot_canvas.winfo_width() / (x1 - x0), 0)
+    except Exception:
+        messagebox.showerror("Error", "Invalid Expression")
+        return
+    finite = ys[np.isfinite(ys)]
+    y0, y1 = np.percentile(finite, [2, 98]) if len(finite) else (-1.0, 1.0)
+    margin = (y1 - y0) * 0.1 or 1.0
+    view[:] = x0, x1, float(y0 - margin), float(y1 + margin)
+    redraw()
+
+def redraw():
+    if plot is None:
+        return
+    x0, x1, y0, y1 = view
+    width, height = plot_canvas.winfo_width(), plot_canvas.winfo_height()
+    x_scale, y_scale = width / (x1 - x0), height / (y1 - y0)
+    plot_canvas.coords(x_axis, 0, y1 * y_scale, width, y1 * y_scale)
+    plot_canvas.coords(y_axis, -x0 * x_scale, 0, -x0 * x_scale, height)
+    try:
+        xs, ys = plot.sample(x0, x1, x_scale, y_scale)
+    except Exception:
+        plot_canvas.itemconfig(curve, state="hidden")
+        return
+    keep = np.isfinite(ys)
+    points = np.column_stack(((xs[keep] - x0) * x_scale, np.clip((y1 - ys[keep]) * y_scale, -height, 2 * height)))
+    if len(points) > 4 * width:  # zoomed out over samples cached at a closer zoom
+        points = points[::len(points) // (2 * width)]
+    if len(points) < 2:
+        plot_canvas.itemconfig(curve, state="hidden")
+        return
+    plot_canvas.coords(curve, points.ravel().tolist())  # one polyline for the whole curve
+    plot_canvas.itemconfig(curve, state="normal")
+
+def start_pan(event):
+    global drag
+    drag = (event.x, event.y, list(view))
+
+def pan(event):
+    x, y, (x0, x1, y0, y1) = drag
+    dx = (event.x - x) * (x1 - x0) / plot_canvas.winfo_width()
+    dy = (event.y - y) * (y1 - y0) / plot_canvas.winfo_height()
+    view[:] = x0 - dx, x1 - dx, y0 + dy, y1 + dy
+    redraw()
+
+def zoom(event, factor):
+    # Zoom about the point under the pointer
+    x0, x1, y0, y1 = view
+    x = x0 + event.x / plot_canvas.winfo_width() * (x1 - x0)
+    y = y1 - event.y / plot_canvas.winfo_height() * (y1 - y0)
+    view[:] = x + (x0 - x) * factor, x + (x1 - x) * factor, y + (y0 - y) * factor, y + (y1 - y) * factor
+    redraw()
 
 # -----------------------------
 # Keyboard Bindings
 # -----------------------------
 
 def key_handler(event):
+    if isinstance(event.widget, tk.Entry) and event.widget is not display:
+        return  # typing into the plot tab's fields
     if event.keysym == "Return":
         calculate()
+    elif event.keysym == "Escape":
+        cancel()
     elif event.keysym == "BackSpace":
         backspace()
     elif event.char in "0123456789+-*/().^":
         insert(event.char)
 
-root.bind("<Key>", key_handler)
-
 # -----------------------------
 # Dark Mode Toggle
 # -----------------------------
+# Colours live in a few named ttk styles shared by every widget, so a theme switch reconfigures
+# those styles once instead of visiting each button, however many tabs there are.
+
+THEMES = {
+    False: {"window": "#f0f0f0", "button": "#f0f0f0", "pressed": "#dcdcdc", "text": "black", "entry": "white",
+            "toggle": "🌙 Dark Mode"},
+    True: {"window": "#2e2e2e", "button": "#4a4a4a", "pressed": "#5c5c5c", "text": "white", "entry": "#3c3c3c",
+           "toggle": "☀ Light Mode"},
+}
 
 dark_mode = False
 
+def setup_styles():
+    global style
+    style = ttk.Style(root)
+    style.theme_use("clam")  # the native Windows and macOS themes ignore background colours
+    style.configure("Calc.TButton", font=("Arial", 14))
+    style.configure("Theme.TButton", font=("Arial", 12))
+    style.configure("Display.TEntry", padding=6)
+    style.configure("Preview.TLabel", foreground="gray")
+    apply_theme()
+
+def apply_theme():
+    colors = THEMES[dark_mode]
+    root.config(bg=colors["window"])
+    style.configure(".", background=colors["window"], foreground=colors["text"], fieldbackground=colors["entry"],
+                    insertcolor=colors["text"])
+    style.configure("TButton", background=colors["button"])
+    style.map("TButton", background=[("pressed", colors["pressed"]), ("active", colors["pressed"])])
+    style.configure("TNotebook.Tab", background=colors["button"])
+    style.map("TNotebook.Tab", background=[("selected", colors["window"])])
+    theme_var.set(colors["toggle"])
+
 def toggle_theme():
     global dark_mode
     dark_mode = not dark_mode
-    if dark_mode:
-        root.config(bg="#2e2e2e")
-        display.config(bg="#3c3c3c", fg="white", insertbackground="white")
-        for b in buttons:
-            b.config(bg="#4a4a4a", fg="white")
-        theme_btn.config(text="☀ Light Mode", bg="#444", fg="white")
-    else:
-        root.config(bg="SystemButtonFace")
-        display.config(bg="white", fg="black", insertbackground="black")
-        for b in buttons:
-            b.config(bg="#f0f0f0", fg="black")
-        theme_btn.config(text="🌙 Dark Mode", bg="#ddd", fg="black")
+    apply_theme()
+
+# -----------------------------
+# Lazy Tabs
+# -----------------------------
+# Each tab's widgets are created the first time it is shown, so startup only pays for the visible one.
+
+tab_builders = {}  # tab frame -> function filling it in, until it has been shown
+
+def show_tab(event=None):
+    frame = root.nametowidget(notebook.select())
+    builder = tab_builders.pop(frame, None)
+    if builder:
+        builder(frame)
+
+def build_all_tabs():
+    for frame, builder in list(tab_builders.items()):
+        del tab_builders[frame]
+        builder(frame)
+
+# -----------------------------
+# Startup Timing
+# -----------------------------
 
-# Theme toggle button
-theme_btn = tk.Button(root, text="🌙 Dark Mode", font=("Arial", 12), command=toggle_theme)
-theme_btn.pack(pady=8)
+def window_mapped(event):
+    if event.widget is root:
+        root.after_idle(first_frame_shown)
 
-root.mainloop()
+def first_frame_shown():
+    # --first-frame: the window is up; flush pending drawing, report and quit
+    root.update_idletasks()
+    print("ready", flush=True)
+    root.destroy()
+
+def measure_startup(runs=5):
+    # Launch the app in fresh processes and time each from launch to its first drawn frame,
+    # building every tab up front (--eager, as before) and lazily
+    print(f"Time to first frame, median of {runs} launches:")
+    for label, extra in (("all tabs up front", ["--eager"]), ("lazy tabs", [])):
+        times = []
+        for _ in range(runs):
+            t = time.perf_counter()
+            child = subprocess.Popen([sys.executable, __file__, "--first-frame"] + extra,
+                                     stdout=subprocess.PIPE, text=True)
+            if child.stdout.readline().strip() != "ready":
+                child.wait()
+                print(f"  {label}: the window didn't start (no display?)")
+                return False
+            times.append(time.perf_counter() - t)
+            child.wait()
+        print(f"  {label:>18}: {statistics.median(times) * 1000:7.1f} ms")
+    return True
+
+# Scientific Calculator with Tabs + Dark Mode
+# (built only when run directly: worker processes import this file too)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Advanced Scientific Calculator")
+    parser.add_argument("--benchmark", action="store_true", help="time the live preview on a long expression")
+    parser.add_argument("--tokens", type=int, default=1000, help="length of the benchmark expression")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="evaluate one expression per line without a window (- for stdin)")
+    parser.add_argument("--output", default="-", metavar="FILE", help="where --batch writes its results")
+    parser.add_argument("--workers", type=int, help="worker processes for --batch (default: one per CPU)")
+    parser.add_argument("--chunk", type=int, default=BATCH_CHUNK, help="lines per --batch task")
+    parser.add_argument("--startup", action="store_true", help="time launch to first frame, eager vs lazy tabs")
+    parser.add_argument("--first-frame", action="store_true", help=argparse.SUPPRESS)  # one --startup launch
+    parser.add_argument("--eager", action="store_true", help="build every tab at startup")
+    args = parser.parse_args()
+    if args.benchmark:
+        sys.exit(0 if benchmark_preview(args.tokens) else 1)
+    if args.startup:
+        sys.exit(0 if measure_startup() else 1)
+    if args.batch:
+        sys.exit(1 if run_batch(args.batch, args.output, args.workers, args.chunk) else 0)
+
+    root = tk.Tk()
+    root.title("Advanced Scientific Calculator")
+    root.geometry("420x580")
+    root.resizable(False, False)
+    theme_var = tk.StringVar()
+    setup_styles()
+
+    # Entry Field
+    display_var = tk.StringVar()
+    display = ttk.Entry(root, textvariable=display_var, font=("Arial", 20), justify="right", style="Display.TEntry")
+    display.pack(fill="x", pady=10, padx=10)
+    display_var.trace_add("write", schedule_preview)
+
+    # Status line: live preview, or progress and the cancel button for a running calculation
+    status_frame = ttk.Frame(root)
+    status_frame.pack(fill="x", padx=10)
+    preview_var = tk.StringVar()
+    ttk.Label(status_frame, textvariable=preview_var, anchor="w", style="Preview.TLabel").pack(side="left")
+    status_var = tk.StringVar()
+    ttk.Label(status_frame, textvariable=status_var, anchor="w").pack(side="left", fill="x", expand=True)
+    cancel_btn = ttk.Button(status_frame, text="Cancel", command=cancel, state="disabled")
+    cancel_btn.pack(side="right")
+
+    # Notebook (Tabs)
+    notebook = ttk.Notebook(root)
+    notebook.pack(expand=True, fill="both")
+
+    basic_tab = ttk.Frame(notebook)
+    scientific_tab = ttk.Frame(notebook)
+    plot_tab = ttk.Frame(notebook)
+
+    notebook.add(basic_tab, text="Basic")
+    notebook.add(scientific_tab, text="Scientific")
+    notebook.add(plot_tab, text="Plot")
+
+    tab_builders.update({basic_tab: build_basic_tab, scientific_tab: build_scientific_tab, plot_tab: build_plot_tab})
+    notebook.bind("<<NotebookTabChanged>>", show_tab)
+    if args.eager:
+        build_all_tabs()
+    show_tab()
+
+    root.bind("<Key>", key_handler)
+
+    # Theme toggle button
+    theme_btn = ttk.Button(root, textvariable=theme_var, style="Theme.TButton", command=toggle_theme)
+    theme_btn.pack(pady=8)
+
+    if args.first_frame:
+        root.bind("<Map>", window_mapped, add="+")
+    else:
+        evaluator.start()  # warm up the worker before the first "="
+    root.mainloop()
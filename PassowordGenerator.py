@@ -1,34 +1,845 @@
 import tkinter as tk
-from tkinter import messagebox
-import random
+from tkinter import filedialog, messagebox, simpledialog
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from functools import lru_cache
+from itertools import combinations
+import argparse
+import bisect
+import hashlib
+import io
+import math
+import mmap
+import os
+import re
+import secrets
 import string
+import struct
+import sys
+import threading
+import time
+
+# -----------------------------
+# Random Characters
+# -----------------------------
+# Characters come from os.urandom (the same source as secrets). Each random byte is mapped to a
+# character with one bytes.translate() call over the whole buffer; bytes at or above the largest
+# multiple of len(charset) are deleted in that same call instead of wrapped round, so every
+# character is equally likely (rejection sampling rather than a biased modulo).
+
+CHARSETS = {"upper": string.ascii_uppercase, "lower": string.ascii_lowercase,
+            "digits": string.digits, "symbols": string.punctuation}
+
+def build_charset(upper=True, lower=True, digits=True, symbols=True):
+    chosen = {"upper": upper, "lower": lower, "digits": digits, "symbols": symbols}
+    return "".join(chars for name, chars in CHARSETS.items() if chosen[name])
+
+@lru_cache(maxsize=32)
+def byte_table(charset):
+    # (translate table, bytes to delete, fraction of bytes kept)
+    limit = 256 - 256 % len(charset)
+    table = bytes(ord(charset[b % len(charset)]) if b < limit else 0 for b in range(256))
+    return table, bytes(range(limit, 256)), limit / 256
+
+def random_chars(charset, n):
+    # n unbiased random characters from charset, as ASCII bytes
+    table, reject, kept = byte_table(charset)
+    chunks, have = [], 0
+    while have < n:
+        chunk = os.urandom(int((n - have) / kept) + 64).translate(table, reject)
+        chunks.append(chunk)
+        have += len(chunk)
+    return b"".join(chunks)[:n]
+
+# -----------------------------
+# Password Policy
+# -----------------------------
+# A policy is met by construction, never by generating and rejecting: the required characters of
+# each class are drawn from that class, the rest from the whole pool, and the lot is shuffled.
+# Drawing without replacement gives no repeats; a run limit is kept by walking the shuffled slots
+# and, where a character would run longer than max_run, drawing it again from the pool without
+# it (which is the same as having drawn from that smaller pool in the first place). Checking
+# every selected class would otherwise fail often at short lengths (about 3 in 10 12-character
+# passwords over all four classes have no digit), and strict policies almost always.
+
+AMBIGUOUS = "Il1|O0o`'\""
+
+def shuffled(items):
+    # A uniform shuffle by sorting on random 64-bit keys: one os.urandom call, not one per item
+    keys = memoryview(os.urandom(8 * len(items))).cast("Q")
+    return [items[i] for i in sorted(range(len(items)), key=keys.__getitem__)]
+
+class Policy:
+    def __init__(self, length, minimum, exclude_ambiguous=False, no_repeats=False, max_run=0):
+        # minimum: {class name: fewest characters from it} for each class to draw from
+        drop = str.maketrans("", "", AMBIGUOUS if exclude_ambiguous else "")
+        self.pools = {name: CHARSETS[name].translate(drop) for name in minimum}
+        self.union = "".join(self.pools.values())
+        self.required = [(name, n) for name, n in minimum.items() if n > 0]
+        self.length, self.no_repeats, self.max_run = length, no_repeats, max_run
+        self.fill = length - sum(n for _, n in self.required)
+        if not self.union:
+            raise ValueError("Please select at least one character set!")
+        if length < 1 or self.fill < 0:
+            raise ValueError(f"The minimums need more than {length} characters")
+        if no_repeats and length > len(self.union):
+            raise ValueError(f"Only {len(self.union)} different characters to choose from")
+        for name, n in self.required:
+            if no_repeats and n > len(self.pools[name]):
+                raise ValueError(f"Only {len(self.pools[name])} different {name} characters")
+        if max_run and len(self.union) == 1 and length > max_run:
+            raise ValueError("A run limit needs at least two characters to choose from")
+        self.strip = {name: str.maketrans("", "", pool) for name, pool in self.pools.items()}
+        self.strip_all = str.maketrans("", "", self.union)
+        self.too_long = re.compile(f"(.)\\1{{{max_run}}}") if max_run else None
+
+    def count(self):
+        # Passwords that meet the minimums (and have no repeats, if asked), counted exactly by
+        # inclusion-exclusion over the classes that come up short. As generating functions each
+        # class is e^(px), or (1+x)^p without repeats, less its terms below the minimum. The run
+        # limit is not counted, so with one this is an upper bound.
+        n, length = len(self.union), self.length
+        total = Fraction(0)
+        for r in range(len(self.required) + 1):
+            for short in combinations(self.required, r):
+                below = [Fraction(1)]  # product of the short classes' terms below their minimums
+                for name, m in short:
+                    p = len(self.pools[name])
+                    terms = [Fraction(math.comb(p, k)) if self.no_repeats else Fraction(p ** k, math.factorial(k))
+                             for k in range(m)]
+                    product = [Fraction(0)] * (len(below) + m - 1)
+                    for i, a in enumerate(below):
+                        for k, b in enumerate(terms):
+                            product[i + k] += a * b
+                    below = product
+                rest = n - sum(len(self.pools[name]) for name, _ in short)
+                total += (-1) ** r * sum(q * (math.comb(rest, length - j) if self.no_repeats
+                                              else Fraction(rest ** (length - j), math.factorial(length - j)))
+                                         for j, q in enumerate(below[:length + 1]))
+        return int(total * math.factorial(length))
+
+    def check(self, pwd):
+        return (len(pwd) == self.length and not pwd.translate(self.strip_all)
+                and all(len(pwd) - len(pwd.translate(self.strip[name])) >= n for name, n in self.required)
+                and not (self.no_repeats and len(set(pwd)) < len(pwd))
+                and not (self.too_long and self.too_long.search(pwd)))
+
+    def generate(self):
+        return self.generate_many(1)[0].decode("ascii")
+
+    def generate_many(self, count):
+        # count passwords as ASCII bytes
+        if self.no_repeats:
+            return [self.distinct() for _ in range(count)]
+        if self.max_run:
+            return [self.walk() for _ in range(count)]
+        # Every password's characters in one draw per class, then shuffled by sorting on random keys
+        widths = [n for _, n in self.required] + [self.fill]
+        parts = [random_chars(self.pools[name], n * count) for name, n in self.required]
+        parts.append(random_chars(self.union, self.fill * count))
+        keys = memoryview(os.urandom(8 * self.length * count)).cast("Q")
+        out, length = [], self.length
+        for k in range(count):
+            chars = b"".join([part[k * w:(k + 1) * w] for part, w in zip(parts, widths)])
+            out.append(bytes([c for _, c in sorted(zip(keys[k * length:(k + 1) * length], chars))]))
+        return out
+
+    def distinct(self):
+        chars = []
+        for name, n in self.required:
+            chars += shuffled(self.pools[name])[:n]
+        chars += shuffled([c for c in self.union if c not in chars])[:self.fill]
+        return "".join(shuffled(chars)).encode("ascii")
+
+    def walk(self):
+        slots = shuffled([name for name, n in self.required for _ in range(n)] + [None] * self.fill)
+        drawn = {name: iter(random_chars(self.pools[name], n).decode("ascii")) for name, n in self.required}
+        drawn[None] = iter(random_chars(self.union, self.fill).decode("ascii"))
+        chars, run = [], 0
+        for slot in slots:
+            c = next(drawn[slot])
+            if run >= self.max_run and c == chars[-1]:
+                pool = self.union if slot is None else self.pools[slot]
+                i, banned = secrets.randbelow(len(pool) - 1), pool.index(c)
+                c = pool[i + (i >= banned)]  # one fewer choice, skipping over the banned character
+            run = run + 1 if chars and c == chars[-1] else 1
+            chars.append(c)
+        return "".join(chars).encode("ascii")
+
+def reject_sample(policy, limit=None):
+    # The usual way, for comparison: whole passwords from the pool until one complies or `limit`
+    # tries have failed; (password or None, tries)
+    tries = 0
+    while limit is None or tries < limit:
+        tries += 1
+        pwd = random_chars(policy.union, policy.length).decode("ascii")
+        if policy.check(pwd):
+            return pwd, tries
+    return None, tries
+
+def benchmark_policies(budget=2.0):
+    # Policy engine against generate-and-reject, strict policies and long lengths included
+    every = dict.fromkeys(CHARSETS, 1)
+    cases = [("1 of each class", Policy(12, every)),
+             ("3 of each, no ambiguous", Policy(12, dict.fromkeys(CHARSETS, 3), exclude_ambiguous=True)),
+             ("2 of each, max run 1", Policy(16, dict.fromkeys(CHARSETS, 2), max_run=1)),
+             ("1 of each, no repeats", Policy(24, every, no_repeats=True)),
+             ("no repeats, no ambiguous", Policy(64, every, exclude_ambiguous=True, no_repeats=True)),
+             ("20 of each, max run 2", Policy(128, dict.fromkeys(CHARSETS, 20), max_run=2)),
+             ("1 of each, max run 1", Policy(1024, every, max_run=1))]
+    print(f"{'policy':<28}{'length':>7}{'engine':>12}{'reject':>16}{'tries':>10}")
+    for name, policy in cases:
+        made, t = 0, time.perf_counter()
+        while time.perf_counter() - t < budget / 4:
+            assert all(policy.check(pwd.decode("ascii")) for pwd in policy.generate_many(100))
+            made += 100
+        engine = (time.perf_counter() - t) / made
+        made = tries = 0
+        t = time.perf_counter()
+        while time.perf_counter() - t < budget and made < 10000:
+            pwd, n = reject_sample(policy, limit=1000)  # bounded, so the time budget is checked
+            tries += n
+            made += pwd is not None
+        elapsed = time.perf_counter() - t
+        reject = f"{elapsed / made * 1e6:,.1f} us" if made else f"> {budget:.0f} s"
+        rate = f"{tries / made:,.1f}" if made else f"> {tries:,}"
+        print(f"{name:<28}{policy.length:>7}{engine * 1e6:>9,.1f} us{reject:>16}{rate:>10}")
+
+# -----------------------------
+# Bulk Generation
+# -----------------------------
+# Passwords are made in blocks of BULK_BATCH, one per line, and written as each block is ready, so
+# memory stays flat for any count. With several workers the blocks come from a process pool,
+# with at most two per worker in flight. Given a SeenSet, each block is recorded there before it
+# is written, and passwords issued before are dropped and made up for by later blocks.
+
+BULK_BATCH = 100000  # passwords per block
+
+def generate_block(charset, length, count):
+    chars = random_chars(charset, length * count)
+    return b"\n".join([chars[i:i + length] for i in range(0, len(chars), length)]) + b"\n"
+
+def policy_block(policy, count):
+    return b"\n".join(policy.generate_many(count)) + b"\n"
+
+def bulk_generate(out, count, length, charset, workers=1, batch=BULK_BATCH, progress=None, seen=None,
+                  policy=None):
+    # Write count passwords to the binary file out; returns passwords per second. With a policy,
+    # its length and pool replace length and charset.
+    block = (generate_block, charset, length) if policy is None else (policy_block, policy)
+    space = len(charset) ** length if policy is None else policy.count()
+    # The store holds passwords from every policy, so only this policy's own size is a sure bound;
+    # the stall check in write() notices when the ones it allows have run out
+    if seen is not None and count > space:
+        raise ValueError(f"only {space:,} passwords meet this policy, fewer than the {count:,} asked for")
+    t, done, planned = time.perf_counter(), 0, 0
+    stalled = 0  # passwords drawn since the last one not issued before
+
+    def sizes():
+        nonlocal planned
+        while planned < count:
+            size = min(batch, count - planned)
+            planned += size
+            yield size
+
+    def write(block, size):
+        nonlocal done, planned, stalled
+        if seen is not None:
+            fresh = seen.add_batch(block.split(b"\n")[:-1])
+            # With a run limit the space is only a bound; give up once new passwords are clearly gone
+            stalled = 0 if fresh else stalled + size
+            if stalled > 50 * space:
+                raise ValueError(f"no unissued password in the last {stalled:,} drawn; "
+                                 f"fewer than {count:,} remain under this policy")
+            planned -= size - len(fresh)
+            size, block = len(fresh), b"".join(pwd + b"\n" for pwd in fresh)
+        out.write(block)
+        done += size
+        if progress:
+            progress(done, count)
+
+    while done < count:  # more than once only to make up for dropped repeats
+        if workers > 1:
+            pending = deque()
+            with ProcessPoolExecutor(workers) as pool:
+                for size in sizes():
+                    if len(pending) >= workers * 2:
+                        future, size_done = pending.popleft()
+                        write(future.result(), size_done)
+                    pending.append((pool.submit(*block, size), size))
+                while pending:
+                    future, size = pending.popleft()
+                    write(future.result(), size)
+        else:
+            for size in sizes():
+                write(block[0](*block[1:], size), size)
+    return count / (time.perf_counter() - t)
+
+# -----------------------------
+# Issued Passwords
+# -----------------------------
+# A persistent record of every password handed out by unique bulk runs, so none is issued twice
+# across sessions. Only a keyed 128-bit BLAKE2b digest of each password is kept (a collision needs
+# ~2^64 entries). The digests live in sorted run files, one per batch, binary-searched on disk. A
+# memory-mapped Bloom filter in front answers "never seen" for almost every fresh password, so the
+# runs are only searched for its rare "maybe". Runs are merged SEEN_FANOUT at a time, one key range
+# at a time, so memory is bounded by the batch and merge sizes (plus the filter, 1.5 bytes per
+# password, file-backed) whatever the set grows to.
+# The runs are the truth and are fsynced; the filter is only flushed on close and is rebuilt
+# from the runs if it wasn't (a crash), or when it outgrows its capacity.
+# One writer at a time per store.
+
+SEEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "issued")
+SEEN_MAGIC = b"PWSEEN1\0"
+SEEN_HEADER = struct.Struct("<8s16sQ?")  # magic, hash key, capacity, closed cleanly
+DIGEST = 16
+BLOOM_BITS = 12  # per password: about 0.3% false positives at capacity
+BLOOM_HASHES = 8
+SEEN_CAPACITY = 10000000  # to start with; doubled whenever it is outgrown
+SEEN_FANOUT = 8
+MERGE_CHUNK = 250000  # digests in memory at once while merging
+
+class Run:
+    # One sorted run of digests; a sequence, so bisect searches it without loading it. Each probe
+    # is a 16-byte unbuffered read: mapping the file instead would leave every page a search
+    # faulted in (and its neighbours) resident in this process.
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb", buffering=0)
+        self.size = os.path.getsize(path) // DIGEST
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        self.file.seek(i * DIGEST)
+        return self.file.read(DIGEST)
+
+    def __contains__(self, digest):
+        i = bisect.bisect_left(self, digest)
+        return i < self.size and self[i] == digest
+
+    def read(self, start, end):
+        self.file.seek(start * DIGEST)
+        data = self.file.read((end - start) * DIGEST)
+        return [data[i:i + DIGEST] for i in range(0, len(data), DIGEST)]
+
+    def digests(self):
+        for start in range(0, self.size, MERGE_CHUNK):
+            yield from self.read(start, min(start + MERGE_CHUNK, self.size))
+
+class SeenSet:
+    def __init__(self, path=SEEN_PATH, capacity=SEEN_CAPACITY):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        # One writer per store: a second one would not see this run's passwords and could reissue them
+        self.lock_path = os.path.join(path, "lock")
+        try:
+            self.lock = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            raise ValueError(f"{path} is in use by another run; if none is running, delete {self.lock_path}") from None
+        try:
+            os.write(self.lock, str(os.getpid()).encode())
+            self.open_store(capacity)
+        except BaseException:
+            self.unlock()
+            raise
+
+    def open_store(self, capacity):
+        path = self.path
+        names = sorted(name for name in os.listdir(path) if name.startswith("run-") and not name.endswith(".tmp"))
+        self.runs = [Run(os.path.join(path, name)) for name in names]
+        self.next_run = int(names[-1][4:]) + 1 if names else 0
+        self.count = sum(len(run) for run in self.runs)
+        self.bloom_path = os.path.join(path, "bloom")
+        self.bloom = None
+        if not os.path.exists(self.bloom_path):
+            self.key, self.capacity = secrets.token_bytes(16), 0
+        else:
+            with open(self.bloom_path, "rb") as f:
+                magic, self.key, self.capacity, clean = SEEN_HEADER.unpack(f.read(SEEN_HEADER.size))
+            if magic != SEEN_MAGIC:
+                raise ValueError(f"{path} is not a password store")
+            if clean:
+                self.open_bloom()
+        if self.bloom is None or self.capacity < max(capacity, self.count):
+            self.rebuild_bloom(max(capacity, self.capacity, 2 * self.count))
+        self.bloom[SEEN_HEADER.size - 1] = 0  # dirty until closed
+        self.bloom.flush(0, SEEN_HEADER.size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.bloom[SEEN_HEADER.size - 1] = 1
+        self.bloom.flush()
+        self.bloom.close()
+        for run in self.runs:
+            run.file.close()
+        self.unlock()
+
+    def unlock(self):
+        os.close(self.lock)
+        os.remove(self.lock_path)
+
+    def open_bloom(self):
+        with open(self.bloom_path, "r+b") as f:
+            self.bloom = mmap.mmap(f.fileno(), 0)
+        self.bits = (len(self.bloom) - SEEN_HEADER.size) * 8
+
+    def rebuild_bloom(self, capacity):
+        if self.bloom is not None:
+            self.bloom.close()
+        with open(self.bloom_path + ".tmp", "wb") as f:
+            f.write(SEEN_HEADER.pack(SEEN_MAGIC, self.key, capacity, False))
+            f.truncate(SEEN_HEADER.size + -(-capacity * BLOOM_BITS // 8))
+        os.replace(self.bloom_path + ".tmp", self.bloom_path)
+        self.capacity = capacity
+        self.open_bloom()
+        for run in self.runs:
+            for digest in run.digests():
+                self.set_bits(digest)
+
+    def set_bits(self, digest):
+        bloom, bits = self.bloom, self.bits
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        for i in range(BLOOM_HASHES):
+            bit = (h1 + i * h2) % bits
+            bloom[SEEN_HEADER.size + (bit >> 3)] |= 1 << (bit & 7)
+
+    def maybe_seen(self, digest):
+        bloom, bits = self.bloom, self.bits
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        for i in range(BLOOM_HASHES):
+            bit = (h1 + i * h2) % bits
+            if not bloom[SEEN_HEADER.size + (bit >> 3)] >> (bit & 7) & 1:
+                return False
+        return True
+
+    def add_batch(self, passwords):
+        # Record the passwords (bytes) not seen before, in this batch or ever; returns them in order
+        key, batch = self.key, {}
+        for pwd in passwords:
+            batch.setdefault(hashlib.blake2b(pwd, digest_size=DIGEST, key=key).digest(), pwd)
+        for digest in [digest for digest in batch if self.maybe_seen(digest)]:
+            if any(digest in run for run in self.runs):
+                del batch[digest]
+        if batch:
+            for digest in batch:
+                self.set_bits(digest)
+            path = os.path.join(self.path, f"run-{self.next_run:010d}")
+            self.next_run += 1
+            os.replace(self.write_run([b"".join(sorted(batch))], path), path)
+            self.runs.append(Run(path))
+            self.merge()
+            self.count = sum(len(run) for run in self.runs)
+            if self.count > self.capacity:
+                self.rebuild_bloom(2 * self.capacity)
+        return list(batch.values())
+
+    def write_run(self, chunks, path):
+        # Written and fsynced beside path; the caller swaps it in
+        with open(path + ".tmp", "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        return path + ".tmp"
+
+    def merge(self):
+        # Once the newest SEEN_FANOUT runs are of a size, replace them with one run. Digests are
+        # uniform, so splitting the key space into equal ranges gives chunks of about MERGE_CHUNK.
+        while len(self.runs) >= SEEN_FANOUT and len(self.runs[-SEEN_FANOUT]) < SEEN_FANOUT * len(self.runs[-1]):
+            group = self.runs[-SEEN_FANOUT:]
+            slices = -(-sum(len(run) for run in group) // MERGE_CHUNK)
+            bounds = [(i << 8 * DIGEST) // slices for i in range(1, slices)]
+            bounds = [bound.to_bytes(DIGEST, "big") for bound in bounds]
+            cuts = [[0] + [bisect.bisect_left(run, bound) for bound in bounds] + [len(run)] for run in group]
+
+            def chunks():
+                for i in range(slices):
+                    chunk = set()
+                    for run, cut in zip(group, cuts):
+                        chunk.update(run.read(cut[i], cut[i + 1]))
+                    yield b"".join(sorted(chunk))
+
+            merged = self.write_run(chunks(), group[0].path)
+            for run in group:  # closed first: Windows can't replace or delete an open file
+                run.file.close()
+            os.replace(merged, group[0].path)
+            for run in group[1:]:
+                os.remove(run.path)
+            self.runs[-SEEN_FANOUT:] = [Run(group[0].path)]
+
+# -----------------------------
+# Word Index
+# -----------------------------
+# Leaked passwords and dictionary words, compiled once (--build-index) into a byte trie laid out in a
+# single file that is memory-mapped, never parsed. A node is NODE, then its children's key bytes in
+# order, then their offsets; children are written before their parents, so building from sorted
+# words streams straight to disk. Looking up every word inside a password walks the trie once per
+# starting position, touching only the nodes on the way.
+
+INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "passwords.idx")
+INDEX_MAGIC = b"PWTRIE1\0"
+HEADER = struct.Struct("<8sII")  # magic, root offset, word count
+NODE = struct.Struct("<IH")  # rank of the word ending here (0: none; 1 is the most common), children
+OFFSET = struct.Struct("<I")
+MIN_WORD = 3
+MAX_WORD = 64  # bytes
+KEY_BYTES = [bytes([b]) for b in range(256)]
+
+# Used when no index has been built: the most common leaked passwords, most common first
+COMMON_PASSWORDS = ["123456", "password", "123456789", "12345678", "12345", "qwerty", "1234567", "111111",
+                    "123123", "abc123", "password1", "1234", "iloveyou", "1q2w3e4r", "000000", "qwerty123",
+                    "zaq12wsx", "dragon", "sunshine", "princess", "letmein", "654321", "monkey", "1qaz2wsx",
+                    "123321", "qwertyuiop", "superman", "asdfghjkl", "football", "welcome", "admin", "login",
+                    "master", "shadow", "baseball", "michael", "trustno1", "hello", "freedom", "whatever"]
+
+def write_index(ranked, out):
+    # ranked: {word bytes: rank}; out: a seekable binary file
+    out.write(HEADER.pack(INDEX_MAGIC, 0, len(ranked)))
+    stack = [[0, []]]  # open nodes along the current word: [rank, [(key byte, offset), ...]]
+    path = b""
+
+    def close(depth):
+        # Write out the open nodes deeper than depth
+        while len(stack) > depth + 1:
+            rank, children = stack.pop()
+            offset = out.tell()
+            out.write(NODE.pack(rank, len(children)) + bytes(key for key, _ in children)
+                      + struct.pack(f"<{len(children)}I", *(child for _, child in children)))
+            stack[-1][1].append((path[len(stack) - 1], offset))
+
+    for word in sorted(ranked):
+        common = 0
+        while common < min(len(path), len(word)) and path[common] == word[common]:
+            common += 1
+        close(common)
+        stack.extend([0, []] for _ in word[common:])
+        stack[-1][0] = ranked[word]
+        path = word
+    close(0)
+    rank, children = stack[0]
+    root = out.tell()
+    out.write(NODE.pack(rank, len(children)) + bytes(key for key, _ in children)
+              + struct.pack(f"<{len(children)}I", *(child for _, child in children)))
+    out.seek(0)
+    out.write(HEADER.pack(INDEX_MAGIC, root, len(ranked)))
+
+def build_index(corpus, path=INDEX_PATH):
+    # One word or password per line, most common first (the order of a leaked-password list)
+    ranked = {}
+    with open(corpus, encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            word = line.strip().lower().encode("utf-8")
+            if MIN_WORD <= len(word) <= MAX_WORD and word not in ranked:
+                ranked[word] = len(ranked) + 1
+    with open(path + ".tmp", "wb") as out:
+        write_index(ranked, out)
+    os.replace(path + ".tmp", path)
+    return len(ranked)
+
+class WordIndex:
+    def __init__(self, buffer):
+        self.buffer = buffer  # an mmap, or bytes for the built-in list
+        magic, self.root, self.count = HEADER.unpack_from(buffer, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError("not a password index")
+
+    @classmethod
+    def open(cls, path):
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @classmethod
+    def from_words(cls, words):
+        out = io.BytesIO()
+        write_index({word.encode("utf-8"): rank for rank, word in enumerate(words, 1)}, out)
+        return cls(out.getvalue())
+
+    def matches(self, data):
+        # (start, end, rank) for every indexed word inside data (lowercase bytes)
+        buf, found = self.buffer, []
+        for start in range(len(data) - MIN_WORD + 1):
+            node, end = self.root, start
+            while True:
+                rank, children = NODE.unpack_from(buf, node)
+                if rank and end - start >= MIN_WORD:
+                    found.append((start, end, rank))
+                if end == len(data):
+                    break
+                keys = node + NODE.size
+                i = buf.find(KEY_BYTES[data[end]], keys, keys + children)
+                if i < 0:
+                    break
+                (node,) = OFFSET.unpack_from(buf, keys + children + 4 * (i - keys))
+                end += 1
+        return found
+
+word_index = None
+
+def get_word_index():
+    global word_index
+    if word_index is None:
+        try:
+            word_index = WordIndex.open(INDEX_PATH)
+        except (OSError, ValueError):
+            word_index = WordIndex.from_words(COMMON_PASSWORDS)
+    return word_index
+
+# -----------------------------
+# Strength Estimation
+# -----------------------------
+# Entropy in bits: the cheapest way to produce the password from brute-forced characters and the
+# patterns found in it (indexed words, keyboard walks, sequences, repeats), like an attacker who
+# tries the patterns first. Character classes, runs, sequences and walks come from a single pass
+# using lookup tables.
+
+LOWER, UPPER, DIGIT, SYMBOL, OTHER = 1, 2, 4, 8, 16
+CLASS_SIZE = {LOWER: 26, UPPER: 26, DIGIT: 10, SYMBOL: 33, OTHER: 100}  # symbols include space
+CLASS_OF = bytes(LOWER if chr(b).islower() and b < 128 else UPPER if chr(b).isupper() and b < 128
+                 else DIGIT if chr(b).isdigit() and b < 128 else SYMBOL if b < 128 else OTHER for b in range(256))
+LEET = bytes.maketrans(b"@4013$5!7|", b"aaoiessitl")
+REPEAT = re.compile(rb"(.{2,}?)\1+")
+STRONG_BITS, MEDIUM_BITS = 70, 45
+
+def keyboard_neighbours():
+    # Pairs of keys next to each other on a US QWERTY keyboard, shifted or not (rows are staggered)
+    rows = [("`1234567890-=", "~!@#$%^&*()_+", 0), ("qwertyuiop[]\\", "QWERTYUIOP{}|", 1.5),
+            ("asdfghjkl;'", 'ASDFGHJKL:"', 1.75), ("zxcvbnm,./", "ZXCVBNM<>?", 2.25)]
+    position = {}
+    for row, (plain, shifted, indent) in enumerate(rows):
+        for x, (a, b) in enumerate(zip(plain, shifted)):
+            position[ord(a)] = position[ord(b)] = (row, x + indent)
+    return frozenset(a << 8 | b for a, (ra, xa) in position.items() for b, (rb, xb) in position.items()
+                     if abs(ra - rb) <= 1 and abs(xa - xb) <= 1 and (ra, xa) != (rb, xb))
+
+NEIGHBOURS = keyboard_neighbours()
+WALK_START_BITS = math.log2(47)  # any key
+WALK_STEP_BITS = math.log2(4.6)  # average number of neighbours
+
+def estimate_strength(pwd):
+    # (bits, "Strong" | "Medium" | "Weak")
+    data = pwd.encode("utf-8")
+    n = len(data)
+    if not n:
+        return 0.0, "Weak"
+    found = []  # (start, end, bits)
+    mask = CLASS_OF[data[0]]
+    run = seq = walk = 0  # where the current run, sequence and walk started
+    step = 0
+    for i in range(1, n + 1):
+        b = data[i] if i < n else -1
+        p = data[i - 1]
+        if i < n:
+            mask |= CLASS_OF[b]
+        if b != p:
+            if i - run >= 3:
+                found.append((run, i, math.log2(CLASS_SIZE[CLASS_OF[p]]) + math.log2(i - run)))
+            run = i
+        if b - p != step or step == 0 or CLASS_OF[b & 255] != CLASS_OF[p]:
+            if i - seq >= 3 and step:
+                found.append((seq, i, math.log2(CLASS_SIZE[CLASS_OF[p]]) + math.log2(i - seq) + (step < 0)))
+            step = b - p if b - p in (1, -1) and CLASS_OF[b & 255] == CLASS_OF[p] else 0
+            seq = i - 1 if step else i
+        if p << 8 | b not in NEIGHBOURS:
+            if i - walk >= 3:
+                found.append((walk, i, WALK_START_BITS + (i - walk - 1) * WALK_STEP_BITS))
+            walk = i
+    char_bits = math.log2(sum(size for cls, size in CLASS_SIZE.items() if mask & cls))
+    for match in REPEAT.finditer(data):
+        base, times = match.group(1), (match.end() - match.start()) // len(match.group(1))
+        found.append((match.start(), match.start() + times * len(base), len(base) * char_bits + math.log2(times)))
+    # Words: looked up lowercased, and again with l33t substitutions undone
+    lower = pwd.lower().encode("utf-8")
+    plain = lower.translate(LEET)
+    for variant in (lower, plain) if plain != lower else (lower,):
+        for start, end, rank in get_word_index().matches(variant):
+            bits = math.log2(rank) + 1
+            word = data[start:end]
+            upper = sum(CLASS_OF[c] == UPPER for c in word)
+            if upper and not (upper == 1 and CLASS_OF[word[0]] == UPPER) and upper != len(word):
+                bits += math.log2(math.comb(len(word), upper))
+            elif upper:
+                bits += 1
+            bits += sum(a != c for a, c in zip(lower[start:end], variant[start:end]))  # one bit per substitution
+            found.append((start, end, bits))
+    # Cheapest cover of the password, left to right
+    best = [0.0] + [math.inf] * n
+    found.sort(key=lambda m: m[1])
+    k = 0
+    for i in range(1, n + 1):
+        best[i] = best[i - 1] + char_bits
+        while k < len(found) and found[k][1] == i:
+            start, _, bits = found[k]
+            best[i] = min(best[i], best[start] + bits)
+            k += 1
+    bits = best[n]
+    return bits, "Strong" if bits >= STRONG_BITS else "Medium" if bits >= MEDIUM_BITS else "Weak"
+
+def audit(source, target=None):
+    # Rate one password per line; prints how many fall in each band and passwords per second
+    counts = {"Strong": 0, "Medium": 0, "Weak": 0}
+    src = sys.stdin if source == "-" else open(source, encoding="utf-8", errors="replace")
+    out = open(target, "w", encoding="utf-8") if target else None
+    t = time.perf_counter()
+    try:
+        for line in src:
+            bits, verdict = estimate_strength(line.rstrip("\r\n"))
+            counts[verdict] += 1
+            if out:
+                out.write(f"{bits:.1f}\t{verdict}\n")
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if out:
+            out.close()
+    total, elapsed = sum(counts.values()), time.perf_counter() - t
+    print(", ".join(f"{name}: {count:,}" for name, count in counts.items())
+          + f" — {total:,} passwords in {elapsed:.2f} s ({total / elapsed:,.0f} passwords/sec)", file=sys.stderr)
+
+# -----------------------------
+# Passphrases
+# -----------------------------
+# Diceware-style passphrases from a wordlist compiled once (--build-wordlist) into an offset-indexed
+# file: a header, count + 1 offsets, then the words back to back. The file is memory-mapped, so
+# startup reads nothing, and drawing a word decodes just that word: two offsets and one slice.
+
+WORDLIST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wordlist.idx")
+WORDLIST_MAGIC = b"PWWORDS1"
+WORDLIST_HEADER = struct.Struct("<8sI")  # magic, word count
+CAPITALIZE = ("none", "first", "random")
+
+def build_wordlist(source, path=WORDLIST_PATH):
+    # One word per line; diceware lists ("11111 word") work too, the last field is the word
+    words, seen = [], set()
+    with open(source, encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            fields = line.split()
+            word = fields[-1].lower().encode("utf-8") if fields else b""
+            if word and word not in seen:  # a repeated word would make the entropy a lie
+                seen.add(word)
+                words.append(word)
+    offsets, total = [0], 0
+    for word in words:
+        total += len(word)
+        offsets.append(total)
+    with open(path + ".tmp", "wb") as out:
+        out.write(WORDLIST_HEADER.pack(WORDLIST_MAGIC, len(words)))
+        out.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        out.write(b"".join(words))
+    os.replace(path + ".tmp", path)
+    return len(words)
+
+class Wordlist:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = WORDLIST_HEADER.unpack_from(self.buffer, 0)
+        if magic != WORDLIST_MAGIC or not self.count:
+            raise ValueError("not a wordlist")
+        self.words = WORDLIST_HEADER.size + 4 * (self.count + 1)
+        self.changeable = None  # words capitalize() changes, counted on first use
+
+    def word(self, i):
+        start, end = struct.unpack_from("<II", self.buffer, WORDLIST_HEADER.size + 4 * i)
+        return self.buffer[self.words + start:self.words + end].decode("utf-8")
+
+    def sample(self):
+        return self.word(secrets.randbelow(self.count))
+
+    def capitalizable(self):
+        # "4th" or "123" look the same capitalized, so a coin flip on them adds nothing
+        if self.changeable is None:
+            self.changeable = sum(word.capitalize() != word for word in map(self.word, range(self.count)))
+        return self.changeable
+
+wordlist = None
+
+def get_wordlist():
+    # The compiled wordlist, or None if there isn't one yet
+    global wordlist
+    if wordlist is None:
+        try:
+            wordlist = Wordlist(WORDLIST_PATH)
+        except (OSError, ValueError):
+            return None
+    return wordlist
+
+def check_separators(count, separators):
+    # Without a separator, different word sequences can spell the same passphrase ("the" + "rapist")
+    if count > 1 and not separators:
+        raise ValueError("Pick at least one separator: words run together can be read more than one way")
+
+def make_passphrase(words, count, separators="-", capitalize="none"):
+    check_separators(count, separators)
+    picked = [words.sample() for _ in range(count)]
+    if capitalize == "first":
+        picked = [word.capitalize() for word in picked]
+    elif capitalize == "random":
+        picked = [word.capitalize() if secrets.randbits(1) else word for word in picked]
+    separators = "".join(dict.fromkeys(separators))
+    gaps = [secrets.choice(separators) for _ in range(count - 1)]
+    return picked[0] + "".join(gap + word for gap, word in zip(gaps, picked[1:]))
+
+def passphrase_bits(words, count, separators="-", capitalize="none"):
+    # Entropy of make_passphrase's output for these settings and this wordlist
+    check_separators(count, separators)
+    bits = count * math.log2(words.count)
+    if capitalize == "random":
+        bits += count * words.capitalizable() / words.count  # a coin flip only shows on those words
+    choices = len(set(separators))
+    if choices > 1:
+        bits += (count - 1) * math.log2(choices)
+    return bits
 
 # -----------------------------
 # Advanced Password Generator
 # -----------------------------
 
 def generate_password():
-    length = length_var.get()
-    use_upper = upper_var.get()
-    use_lower = lower_var.get()
-    use_digits = digit_var.get()
-    use_symbols = symbol_var.get()
-
-    if not (use_upper or use_lower or use_digits or use_symbols):
-        messagebox.showwarning("No Options", "Please select at least one character set!")
+    if mode_var.get() == "passphrase":
+        generate_passphrase()
+        return
+    policy = current_policy()
+    if policy is None:
         return
+    entropy_var.set(f"Entropy: up to {math.log2(policy.count()):.0f} bits")
+    show_password(policy.generate())
 
-    charset = ""
-    if use_upper:
-        charset += string.ascii_uppercase
-    if use_lower:
-        charset += string.ascii_lowercase
-    if use_digits:
-        charset += string.digits
-    if use_symbols:
-        charset += string.punctuation
-
-    password = "".join(random.choice(charset) for _ in range(length))
+
+def current_policy():
+    # The policy the options describe, or None (after saying why) if nothing can meet it
+    chosen = {"upper": upper_var, "lower": lower_var, "digits": digit_var, "symbols": symbol_var}
+    minimum = {name: min_var.get() for name, var in chosen.items() if var.get()}
+    try:
+        return Policy(length_var.get(), minimum, ambiguous_var.get(), no_repeats_var.get(), max_run_var.get())
+    except ValueError as e:
+        messagebox.showwarning("No Options" if not minimum else "Policy", str(e))
+        return None
+
+
+def generate_passphrase():
+    words = get_wordlist()
+    if words is None:
+        messagebox.showerror("No Wordlist", "Build one first:\npython PassowordGenerator.py --build-wordlist FILE")
+        return
+    count, separators, capitalize = words_var.get(), separator_var.get(), capitalize_var.get()
+    try:
+        bits = passphrase_bits(words, count, separators, capitalize)
+    except ValueError as e:
+        messagebox.showwarning("Passphrase", str(e))
+        return
+    entropy_var.set(f"Entropy: {bits:.0f} bits ({count} of {words.count:,} words)")
+    show_password(make_passphrase(words, count, separators, capitalize))
+
+
+def show_password(password):
     password_var.set(password)
 
     # Update history
@@ -36,7 +847,70 @@ def generate_password():
     if history_list.size() > 5:
         history_list.delete(5, tk.END)
 
-    check_strength(password)
+
+bulk_job = None  # [done, total, passwords per second or error] while a bulk run is going
+
+def bulk_dialog():
+    if bulk_job:
+        return
+    policy = current_policy()
+    if policy is None:
+        return
+    count = simpledialog.askinteger("Bulk", "How many passwords?", initialvalue=1000000, minvalue=1)
+    if not count:
+        return
+    path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text files", "*.txt")])
+    if not path:
+        return
+    start_bulk(path, count, policy, unique_var.get())
+
+def start_bulk(path, count, policy, unique=False):
+    # The run happens on a thread (the pool does the work); Tk only polls the shared progress
+    global bulk_job
+    job = bulk_job = [0, count, None]
+
+    def progress(done, total):
+        job[0] = done
+
+    def work():
+        seen = result = None
+        try:
+            seen = SeenSet(SEEN_PATH) if unique else None
+            with open(path, "wb") as f:
+                result = bulk_generate(f, count, policy.length, policy.union, os.cpu_count() or 1, progress=progress,
+                                       seen=seen, policy=policy)
+        except Exception as e:
+            # Any failure must still reach poll_bulk, or the button stays disabled and the progress never ends
+            result = e
+        try:
+            if seen is not None:
+                seen.close()
+        except Exception as e:
+            result = result if isinstance(result, Exception) else e
+        job[2] = result
+
+    bulk_btn.config(state="disabled")
+    threading.Thread(target=work, daemon=True).start()
+    root.after(200, poll_bulk)
+
+def poll_bulk():
+    global bulk_job
+    done, total, result = bulk_job
+    if result is None:
+        bulk_var.set(f"Bulk: {done:,} of {total:,}")
+        root.after(200, poll_bulk)
+        return
+    bulk_job = None
+    bulk_btn.config(state="normal")
+    bulk_var.set("")
+    if isinstance(result, ValueError):
+        messagebox.showerror("Bulk", str(result))
+    elif isinstance(result, OSError):
+        messagebox.showerror("Bulk", f"Could not write the passwords: {result}")
+    elif isinstance(result, Exception):
+        messagebox.showerror("Bulk", f"Bulk generation failed: {type(result).__name__}: {result}")
+    else:
+        messagebox.showinfo("Bulk", f"{total:,} passwords written ({result:,.0f} passwords/sec)")
 
 
 def copy_to_clipboard():
@@ -50,78 +924,207 @@ def copy_to_clipboard():
 
 
 def check_strength(pwd):
-    length = len(pwd)
-    categories = sum([any(c.islower() for c in pwd),
-                      any(c.isupper() for c in pwd),
-                      any(c.isdigit() for c in pwd),
-                      any(c in string.punctuation for c in pwd)])
-
-    if length >= 12 and categories == 4:
-        strength_var.set("Strength: Strong ✅")
-        strength_label.config(fg="green")
-    elif length >= 8 and categories >= 3:
-        strength_var.set("Strength: Medium ⚠️")
-        strength_label.config(fg="orange")
-    else:
-        strength_var.set("Strength: Weak ❌")
-        strength_label.config(fg="red")
+    # Runs on every change to the password field, so it has to stay in the microseconds
+    if not pwd:
+        strength_var.set("Strength: —")
+        strength_label.config(fg="black")
+        return
+    bits, verdict = estimate_strength(pwd)
+    mark, color = {"Strong": ("✅", "green"), "Medium": ("⚠️", "orange"), "Weak": ("❌", "red")}[verdict]
+    strength_var.set(f"Strength: {verdict} {mark} ({bits:.0f} bits)")
+    strength_label.config(fg=color)
 
 
 # --- UI ---
-root = tk.Tk()
-root.title("Advanced Password Generator")
-root.geometry("500x400")
-root.resizable(False, False)
-
-# Title
-title = tk.Label(root, text="🔐 Advanced Password Generator", font=("Arial", 16, "bold"))
-title.pack(pady=10)
-
-# Options Frame
-options_frame = tk.Frame(root)
-options_frame.pack(pady=10)
-
-tk.Label(options_frame, text="Password Length:", font=("Arial", 12)).grid(row=0, column=0, sticky="w")
-length_var = tk.IntVar(value=12)
-length_entry = tk.Spinbox(options_frame, from_=4, to=50, textvariable=length_var, width=5, font=("Arial", 12))
-length_entry.grid(row=0, column=1, padx=10)
-
-upper_var = tk.BooleanVar(value=True)
-lower_var = tk.BooleanVar(value=True)
-digit_var = tk.BooleanVar(value=True)
-symbol_var = tk.BooleanVar(value=True)
-
-tk.Checkbutton(options_frame, text="Include Uppercase", variable=upper_var, font=("Arial", 11)).grid(row=1, column=0, sticky="w")
-tk.Checkbutton(options_frame, text="Include Lowercase", variable=lower_var, font=("Arial", 11)).grid(row=2, column=0, sticky="w")
-tk.Checkbutton(options_frame, text="Include Numbers", variable=digit_var, font=("Arial", 11)).grid(row=1, column=1, sticky="w")
-tk.Checkbutton(options_frame, text="Include Symbols", variable=symbol_var, font=("Arial", 11)).grid(row=2, column=1, sticky="w")
-
-# Password Display
-password_var = tk.StringVar(value="")
-password_entry = tk.Entry(root, textvariable=password_var, font=("Arial", 16), justify="center", width=25)
-password_entry.pack(pady=10)
-
-# Buttons
-btn_frame = tk.Frame(root)
-btn_frame.pack(pady=5)
-
-gen_btn = tk.Button(btn_frame, text="Generate", font=("Arial", 12), command=generate_password)
-gen_btn.pack(side=tk.LEFT, padx=10)
-
-copy_btn = tk.Button(btn_frame, text="Copy", font=("Arial", 12), command=copy_to_clipboard)
-copy_btn.pack(side=tk.LEFT, padx=10)
-
-# Strength Indicator
-strength_var = tk.StringVar(value="Strength: —")
-strength_label = tk.Label(root, textvariable=strength_var, font=("Arial", 12, "bold"))
-strength_label.pack(pady=5)
-
-# History
-history_frame = tk.Frame(root)
-history_frame.pack(pady=10)
-tk.Label(history_frame, text="History (last 5):", font=("Arial", 12, "bold")).pack(anchor="w")
-
-history_list = tk.Listbox(history_frame, height=5, width=40, font=("Arial", 11))
-history_list.pack()
-
-root.mainloop()
+# (built only when run directly: bulk worker processes import this file too)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Advanced Password Generator")
+    parser.add_argument("--bulk", type=int, metavar="N", help="write N passwords, one per line, without a window")
+    parser.add_argument("--output", default="-", metavar="FILE", help="where --bulk writes (default: stdout)")
+    parser.add_argument("--length", type=int, default=12)
+    parser.add_argument("--charsets", default="upper,lower,digits,symbols",
+                        help="comma-separated: " + ",".join(CHARSETS))
+    parser.add_argument("--workers", type=int, default=1, help="processes generating blocks in parallel")
+    parser.add_argument("--batch", type=int, default=BULK_BATCH, help="passwords per block")
+    parser.add_argument("--min-each", type=int, default=0, metavar="N",
+                        help="at least N characters from each of --charsets")
+    parser.add_argument("--no-ambiguous", action="store_true", help="leave out " + AMBIGUOUS)
+    parser.add_argument("--no-repeats", action="store_true", help="no character twice in a password")
+    parser.add_argument("--max-run", type=int, default=0, metavar="N", help="at most N identical characters in a row")
+    parser.add_argument("--benchmark", action="store_true", help="time the policy engine against generate-and-reject")
+    parser.add_argument("--unique", action="store_true",
+                        help="never issue a password --bulk has issued before (recorded in --seen)")
+    parser.add_argument("--seen", default=SEEN_PATH, metavar="DIR", help="store of issued passwords")
+    parser.add_argument("--seen-capacity", type=int, default=SEEN_CAPACITY,
+                        help="passwords the store's filter is sized for (it grows when outgrown)")
+    parser.add_argument("--build-index", metavar="CORPUS",
+                        help="compile a wordlist or leaked-password list (most common first) into the index")
+    parser.add_argument("--index", default=INDEX_PATH, help="password index file")
+    parser.add_argument("--audit", metavar="FILE", help="rate one password per line (- for stdin)")
+    parser.add_argument("--build-wordlist", metavar="FILE", help="compile a passphrase wordlist (one word per line)")
+    parser.add_argument("--wordlist", default=WORDLIST_PATH, help="compiled passphrase wordlist")
+    parser.add_argument("--passphrase", type=int, metavar="WORDS", help="print a passphrase of this many words")
+    parser.add_argument("--separators", default="-", help="passphrase separators, one picked per gap")
+    parser.add_argument("--capitalize", default="none", choices=CAPITALIZE)
+    args = parser.parse_args()
+    INDEX_PATH = args.index
+    WORDLIST_PATH = args.wordlist
+    if args.benchmark:
+        benchmark_policies()
+        sys.exit(0)
+    if args.build_wordlist:
+        print(f"Compiled {build_wordlist(args.build_wordlist, args.wordlist):,} words into {args.wordlist}")
+        sys.exit(0)
+    if args.passphrase:
+        words = get_wordlist()
+        if words is None:
+            parser.error(f"no wordlist at {args.wordlist}; build one with --build-wordlist FILE")
+        try:
+            bits = passphrase_bits(words, args.passphrase, args.separators, args.capitalize)
+        except ValueError as e:
+            parser.error(str(e))
+        print(make_passphrase(words, args.passphrase, args.separators, args.capitalize))
+        print(f"{bits:.1f} bits", file=sys.stderr)
+        sys.exit(0)
+    if args.build_index:
+        t = time.perf_counter()
+        count = build_index(args.build_index, args.index)
+        print(f"Indexed {count:,} words into {args.index} ({os.path.getsize(args.index) / 1e6:.1f} MB) "
+              f"in {time.perf_counter() - t:.1f} s")
+        sys.exit(0)
+    if args.audit:
+        audit(args.audit, None if args.output == "-" else args.output)
+        sys.exit(0)
+    if args.bulk:
+        names = args.charsets.split(",")
+        unknown = set(names) - set(CHARSETS)
+        if unknown or args.length < 1:
+            parser.error(f"unknown charset {', '.join(sorted(unknown))}" if unknown else "length must be positive")
+        charset = build_charset(*(name in names for name in CHARSETS))
+        policy = None
+        if args.min_each or args.no_ambiguous or args.no_repeats or args.max_run:
+            try:
+                policy = Policy(args.length, dict.fromkeys(names, args.min_each), args.no_ambiguous,
+                                args.no_repeats, args.max_run)
+            except ValueError as e:
+                parser.error(str(e))
+        try:
+            seen = SeenSet(args.seen, args.seen_capacity) if args.unique else None
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+        try:
+            with out:
+                rate = bulk_generate(out, args.bulk, args.length, charset, args.workers, args.batch, seen=seen,
+                                     policy=policy)
+        except ValueError as e:
+            parser.error(str(e))
+        finally:
+            if seen is not None:
+                seen.close()
+        print(f"Generated {args.bulk:,} passwords of {args.length} characters: {rate:,.0f} passwords/sec",
+              file=sys.stderr)
+        sys.exit(0)
+
+    root = tk.Tk()
+    root.title("Advanced Password Generator")
+    root.geometry("500x640")
+    root.resizable(False, False)
+
+    # Title
+    title = tk.Label(root, text="🔐 Advanced Password Generator", font=("Arial", 16, "bold"))
+    title.pack(pady=10)
+
+    # Options Frame
+    options_frame = tk.Frame(root)
+    options_frame.pack(pady=10)
+
+    tk.Label(options_frame, text="Password Length:", font=("Arial", 12)).grid(row=0, column=0, sticky="w")
+    length_var = tk.IntVar(value=12)
+    length_entry = tk.Spinbox(options_frame, from_=4, to=50, textvariable=length_var, width=5, font=("Arial", 12))
+    length_entry.grid(row=0, column=1, padx=10)
+
+    upper_var = tk.BooleanVar(value=True)
+    lower_var = tk.BooleanVar(value=True)
+    digit_var = tk.BooleanVar(value=True)
+    symbol_var = tk.BooleanVar(value=True)
+
+    tk.Checkbutton(options_frame, text="Include Uppercase", variable=upper_var, font=("Arial", 11)).grid(row=1, column=0, sticky="w")
+    tk.Checkbutton(options_frame, text="Include Lowercase", variable=lower_var, font=("Arial", 11)).grid(row=2, column=0, sticky="w")
+    tk.Checkbutton(options_frame, text="Include Numbers", variable=digit_var, font=("Arial", 11)).grid(row=1, column=1, sticky="w")
+    tk.Checkbutton(options_frame, text="Include Symbols", variable=symbol_var, font=("Arial", 11)).grid(row=2, column=1, sticky="w")
+
+    # Passphrase mode: words from the compiled wordlist instead of characters
+    mode_var = tk.StringVar(value="characters")
+    tk.Radiobutton(options_frame, text="Characters", variable=mode_var, value="characters",
+                   font=("Arial", 11)).grid(row=3, column=0, sticky="w")
+    tk.Radiobutton(options_frame, text="Passphrase", variable=mode_var, value="passphrase",
+                   font=("Arial", 11)).grid(row=3, column=1, sticky="w")
+    passphrase_frame = tk.Frame(options_frame)
+    passphrase_frame.grid(row=4, column=0, columnspan=2, sticky="w")
+    tk.Label(passphrase_frame, text="Words:", font=("Arial", 11)).pack(side=tk.LEFT)
+    words_var = tk.IntVar(value=6)
+    tk.Spinbox(passphrase_frame, from_=2, to=20, textvariable=words_var, width=3, font=("Arial", 11)).pack(side=tk.LEFT)
+    tk.Label(passphrase_frame, text=" Separators:", font=("Arial", 11)).pack(side=tk.LEFT)
+    separator_var = tk.StringVar(value="-")
+    tk.Entry(passphrase_frame, textvariable=separator_var, width=5, font=("Arial", 11)).pack(side=tk.LEFT)
+    capitalize_var = tk.StringVar(value="none")
+    tk.OptionMenu(passphrase_frame, capitalize_var, *CAPITALIZE).pack(side=tk.LEFT, padx=5)
+
+    unique_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(options_frame, text="Bulk: never reissue a password", variable=unique_var,
+                   font=("Arial", 11)).grid(row=5, column=0, columnspan=2, sticky="w")
+
+    # Policy: met by construction, so every checked class really appears
+    policy_frame = tk.Frame(options_frame)
+    policy_frame.grid(row=6, column=0, columnspan=2, sticky="w")
+    tk.Label(policy_frame, text="Min per class:", font=("Arial", 11)).pack(side=tk.LEFT)
+    min_var = tk.IntVar(value=1)
+    tk.Spinbox(policy_frame, from_=0, to=10, textvariable=min_var, width=3, font=("Arial", 11)).pack(side=tk.LEFT)
+    tk.Label(policy_frame, text=" Max same in a row (0: any):", font=("Arial", 11)).pack(side=tk.LEFT)
+    max_run_var = tk.IntVar(value=0)
+    tk.Spinbox(policy_frame, from_=0, to=10, textvariable=max_run_var, width=3, font=("Arial", 11)).pack(side=tk.LEFT)
+    ambiguous_var = tk.BooleanVar(value=False)
+    no_repeats_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(options_frame, text="Exclude ambiguous (Il1O0o…)", variable=ambiguous_var,
+                   font=("Arial", 11)).grid(row=7, column=0, sticky="w")
+    tk.Checkbutton(options_frame, text="No repeated characters", variable=no_repeats_var,
+                   font=("Arial", 11)).grid(row=7, column=1, sticky="w")
+
+    # Password Display
+    password_var = tk.StringVar(value="")
+    password_var.trace_add("write", lambda *args: check_strength(password_var.get()))
+    password_entry = tk.Entry(root, textvariable=password_var, font=("Arial", 16), justify="center", width=25)
+    password_entry.pack(pady=10)
+
+    # Buttons
+    btn_frame = tk.Frame(root)
+    btn_frame.pack(pady=5)
+
+    gen_btn = tk.Button(btn_frame, text="Generate", font=("Arial", 12), command=generate_password)
+    gen_btn.pack(side=tk.LEFT, padx=10)
+
+    copy_btn = tk.Button(btn_frame, text="Copy", font=("Arial", 12), command=copy_to_clipboard)
+    copy_btn.pack(side=tk.LEFT, padx=10)
+
+    bulk_btn = tk.Button(btn_frame, text="Bulk…", font=("Arial", 12), command=bulk_dialog)
+    bulk_btn.pack(side=tk.LEFT, padx=10)
+
+    # Strength Indicator
+    strength_var = tk.StringVar(value="Strength: —")
+    strength_label = tk.Label(root, textvariable=strength_var, font=("Arial", 12, "bold"))
+    strength_label.pack(pady=5)
+    entropy_var = tk.StringVar(value="")
+    tk.Label(root, textvariable=entropy_var, font=("Arial", 10)).pack()
+    bulk_var = tk.StringVar(value="")
+    tk.Label(root, textvariable=bulk_var, font=("Arial", 10)).pack()
+
+    # History
+    history_frame = tk.Frame(root)
+    history_frame.pack(pady=10)
+    tk.Label(history_frame, text="History (last 5):", font=("Arial", 12, "bold")).pack(anchor="w")
+
+    history_list = tk.Listbox(history_frame, height=5, width=40, font=("Arial", 11))
+    history_list.pack()
+
+    root.mainloop()
@@ -0,0 +1,32 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_script(filename, name):
+    # The apps are standalone scripts, some with spaces in their names, so they are imported by path
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+
+@pytest.fixture(scope="session")
+def paint():
+    return load_script("Basic Paint App.py", "paint_app")
+
+
+@pytest.fixture(scope="session")
+def calculator():
+    return load_script("GUICalculator.py", "calculator")
+
+
+@pytest.fixture(scope="session")
+def passwords():
+    return load_script("PassowordGenerator.py", "password_generator")
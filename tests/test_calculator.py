@@ -0,0 +1,44 @@
+import dis
+
+import pytest
+
+POWER_CHAINS = ["9^9^9^9", "2^2^2^2^2^2", "(9^9)^(9^9)", "9^(9^9)", "-(9^9^9)", "sqrt(9^9^9) + 1", "(2^3)^9^9^9",
+                "*".join(["10^4000"] * 400), "(10^4000)*(10^4000)", "-(10^4000 * 2^2000) + 1",
+                "lcm(" + ",".join(f"9^4400+{i}" for i in range(1, 600)) + ")"]
+
+
+@pytest.mark.parametrize("expression", POWER_CHAINS)
+def test_every_power_is_checked(calculator, expression):
+    # An unchecked ** or * left anywhere in the tree would run for seconds or hours instead of raising
+    code = calculator.compile_expression(calculator.normalize(expression))
+    assert not [op for op in dis.get_instructions(code) if op.argrepr in ("**", "*")]
+    with pytest.raises(OverflowError):
+        calculator.evaluate(expression)
+
+
+def test_small_powers_still_evaluate(calculator):
+    assert calculator.evaluate("2^3^2") == 512
+    assert calculator.evaluate("(2^3)^2") == 64
+    assert calculator.evaluate("-2^2") == -4
+    assert calculator.evaluate("3*4*5") == 60
+    assert calculator.evaluate("2.5*4") == 10.0
+
+
+PREVIEWS = ["sqrt(2,)", "hypot(3,4,)", "hypot(3,4)", "sqrt(2,,)", "sqrt(,)", "sqrt()", "(2,)", "sqrt(2+,)",
+            "2*3+sqrt(16)", "*".join(["10^4000"] * 400), "+".join(["1"] * 6000)]
+
+
+@pytest.mark.parametrize("expression", PREVIEWS)
+def test_preview_agrees_with_evaluate(calculator, expression):
+    try:
+        full = "= " + calculator.format_result(calculator.evaluate(expression))
+    except (SyntaxError, ArithmeticError, ValueError, TypeError):
+        full = ""
+    assert calculator.LivePreview().update(expression) == full
+
+
+def test_preview_skips_text_too_long_to_evaluate(calculator):
+    preview = calculator.LivePreview()
+    assert preview.update("+".join(["1"] * 6000)) == ""
+    assert preview.ends == []  # refused before tokenizing
+    assert preview.update("sqrt(2,)") == "= " + str(2 ** 0.5)
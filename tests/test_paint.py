@@ -0,0 +1,232 @@
+import os
+import random
+import struct
+
+import pytest
+
+from PIL import Image, ImageChops
+
+
+def new_app(paint):
+    random.seed(0)
+    return paint.PaintApp(paint.HeadlessRoot(), paint.HeadlessCanvas())
+
+
+def drag(paint, app, points, per_frame=4):
+    # Press, move and release like the pointer does, with a display frame every `per_frame` events
+    app.on_click(paint.ReplayEvent(*points[0]))
+    for i, point in enumerate(points[1:], 1):
+        app.paint(paint.ReplayEvent(*point))
+        if i % per_frame == 0:
+            app.flush_motion()
+    app.on_release(paint.ReplayEvent(*points[-1]))
+
+
+def wave(x, y, count=60, step=6):
+    rng = random.Random(x * 1000 + y)
+    return [(x + i * step, y + 40 * ((i // 7) % 2) + rng.uniform(-3, 3)) for i in range(count)]
+
+
+def fresh_tile(paint, app, layer, key):
+    # The tile drawn from scratch: every record under it, in stacking order, at the tile's origin
+    left, top = key[0] * paint.TILE_SIZE, key[1] * paint.TILE_SIZE
+    tile = Image.new("RGBA", (paint.TILE_SIZE, paint.TILE_SIZE), (0, 0, 0, 0))
+    for record in sorted((r for r in app.index.boxes if r.layer == layer.id), key=lambda r: r.depth):
+        paint.raster_record(tile, record, -left, -top)
+    return tile
+
+
+def assert_same_picture(paint, app):
+    app.flush_dirty()
+    for layer in app.layers:
+        for key in layer.tiles.keys(app.document_bounds()):
+            shown = layer.tiles.get(key) or Image.new("RGBA", (paint.TILE_SIZE,) * 2, (0, 0, 0, 0))
+            diff = ImageChops.difference(shown, fresh_tile(paint, app, layer, key)).getbbox()
+            assert diff is None, f"tile {key} differs from a fresh render in {diff}"
+
+
+def test_incremental_raster_matches_fresh_render(paint):
+    app = new_app(paint)
+    for brush, y in [("pen", 60), ("pencil", 140), ("ink", 220), ("oil", 300), ("paint", 380), ("airbrush", 460)]:
+        app.set_brush(brush)
+        drag(paint, app, wave(40, y))
+    assert_same_picture(paint, app)
+    app.set_color("red")
+    for tool, (x, y) in [("rectangle", (500, 120)), ("oval", (700, 300)), ("line", (450, 500)),
+                         ("triangle", (600, 560))]:
+        app.set_tool(tool)
+        drag(paint, app, [(x, y), (x - 20, y - 15), (x - 90, y - 70)])  # dragged up and to the left
+    assert_same_picture(paint, app)
+    app.set_emoji("⭐")
+    app.on_click(paint.ReplayEvent(720, 60))
+    app.on_release(paint.ReplayEvent(720, 60))
+    app.set_tool("eraser")
+    drag(paint, app, [(200, 20 + 8 * i) for i in range(60)])
+    app.set_tool("bucket")
+    app.on_click(paint.ReplayEvent(760, 580))
+    app.on_release(paint.ReplayEvent(760, 580))
+    app.undo()
+    app.undo()
+    app.redo()
+    app.set_tool("move")
+    drag(paint, app, [(520, 90), (560, 110), (600, 130)])
+    assert_same_picture(paint, app)
+
+
+@pytest.mark.parametrize("seed", range(24))
+def test_crossing_strokes_erased_and_moved(paint, seed):
+    # Random strokes across each other and across tile edges, then erasing, moving and undoing over them
+    app = new_app(paint)
+    rng = random.Random(seed)
+
+    def scribble():
+        x, y = rng.uniform(0, 700), rng.uniform(0, 550)
+        points = [(x, y)]
+        for _ in range(rng.randint(5, 40)):
+            x, y = x + rng.uniform(-30, 30), y + rng.uniform(-30, 30)
+            points.append((x, y))
+        return points
+
+    for _ in range(6):
+        app.set_tool("brush")
+        app.set_brush(rng.choice(["pen", "pencil", "ink", "oil", "paint", "airbrush", "marker"]))
+        app.set_brush_size(rng.randint(1, 12))
+        drag(paint, app, scribble())
+    for _ in range(6):
+        action = rng.choice(["eraser", "move", "undo"])
+        if action == "undo":
+            app.undo()
+        else:
+            app.set_tool(action)
+            app.set_brush_size(rng.randint(2, 20))
+            drag(paint, app, scribble())
+        assert_same_picture(paint, app)
+
+
+def test_bucket_fill_grows_from_the_viewport(paint):
+    app = new_app(paint)
+    app.set_tool("rectangle")
+    drag(paint, app, [(100, 100), (300, 300)])
+    app.set_tool("line")
+    drag(paint, app, [(700, 500), (1800, 1400)])  # the document now runs far past the viewport
+    crops = []
+    crop = app.tiles.crop
+    app.tiles.crop = lambda bbox: crops.append(bbox) or crop(bbox)
+    app.set_tool("bucket")
+
+    # Inside the rectangle the flood never reaches the viewport's edge
+    app.on_click(paint.ReplayEvent(200, 200))
+    assert crops == [(0, 0, 800, 600)]
+    assert max(app.index.boxes, key=lambda r: r.depth).bbox() == (102, 102, 299, 299)
+
+    # Outside it, the window grows until the fill matches a flood of the whole document
+    x1, y1, x2, y2 = app.document_bounds()
+    expected = paint.fill_mask(crop((x1, y1, x2, y2)), 50 - x1, 50 - y1, app.fill_tolerance)
+    crops.clear()
+    app.on_click(paint.ReplayEvent(50, 50))
+    assert len(crops) > 1 and crops[-1] == (x1, y1, x2, y2)
+    fill = max(app.index.boxes, key=lambda r: r.depth)
+    shown = Image.new("L", (x2 - x1, y2 - y1))
+    shown.paste(fill.mask, (int(fill.points[0]) - x1, int(fill.points[1]) - y1))
+    assert (paint.np.asarray(shown) > 0).tolist() == expected.tolist()
+
+
+def test_style_clicks_undo_one_at_a_time(paint):
+    app = new_app(paint)
+    app.set_emoji("⭐")
+    app.on_click(paint.ReplayEvent(100, 100))
+    app.on_release(paint.ReplayEvent(100, 100))
+    (text,) = app.index.boxes
+    app.selection.append(text)
+    size = text.options["font"][1]
+    for color in ("red", "blue", "green"):
+        app.apply_style("color", color)
+    app.undo()
+    assert text.options["fill"] == "blue"
+    app.undo()
+    assert text.options["fill"] == "red"
+    app.selection.append(text)  # undo drops the selection
+    for step in range(size + 1, size + 16):  # one slider drag
+        app.apply_style("size", step)
+    app.undo()
+    assert text.options["font"][1] == size and text.options["fill"] == "red"
+
+
+def test_spatial_grid_matches_brute_force(paint):
+    rng = random.Random(1)
+    grid, boxes = paint.SpatialGrid(), {}
+    for i in range(1000):
+        if i % 5 == 4:
+            del boxes[i - 2]
+            grid.remove(i - 2)
+        size = rng.choice([5, 300, 30000])  # the largest boxes go to the coarse grid
+        x, y = rng.uniform(-5000, 20000), rng.uniform(-5000, 20000)
+        boxes[i] = (x, y, x + rng.uniform(0, size), y + rng.uniform(0, size))
+        grid.insert(i, boxes[i])
+        size = rng.choice([10, 1000, 40000])
+        x, y = rng.uniform(-5000, 20000), rng.uniform(-5000, 20000)
+        hits = {k for k, (a, b, c, d) in boxes.items() if a <= x + size and c >= x and b <= y + size and d >= y}
+        assert grid.query(x, y, x + size, y + size) == hits
+
+
+def test_shapes_dragged_up_and_left(paint):
+    app = new_app(paint)
+    for tool in ("rectangle", "oval"):
+        app.set_tool(tool)
+        drag(paint, app, [(300, 250), (250, 200), (200, 150)])
+    assert len(app.index.boxes) == 2
+    assert_same_picture(paint, app)
+    picture = app.tiles.crop(app.document_bounds())
+    assert picture.getpixel((200, 200)) != (255, 255, 255)  # the rectangle's left edge
+
+
+def test_repeated_erasing_saves(paint, tmp_path):
+    # Cutting the pieces of pieces again and again keeps depths short enough to save
+    app = new_app(paint)
+    drag(paint, app, [(10 + i, 300) for i in range(1200)])
+    app.set_tool("eraser")
+    app.set_brush_size(2)
+    drag(paint, app, [(20 + 30 * i, 280 + 40 * (i % 2)) for i in range(40)])  # zigzag across the stroke
+    assert len(app.index.boxes) > 30
+    assert max(len(r.depth) for r in app.index.boxes) == 1
+    path = str(tmp_path / "doc.paint")
+    records = sorted(app.index.boxes, key=lambda r: r.depth)
+    for record in records:
+        app.assign_uid(record)
+    paint.save_document(path, records, app.layers)
+    loaded, mm, _ = paint.load_document(path)
+    assert sorted(len(r.points) for r in loaded) == sorted(len(r.points) for r in records)
+    mm.close()
+
+
+def test_version_1_documents_still_open_and_append(paint, tmp_path):
+    stroke = paint.Stroke("pen", "black", 2)
+    for i in range(5):
+        stroke.add_point(10 * i, 20)
+    stroke.uid, stroke.depth = 1, (3, 0, 1)
+    path = str(tmp_path / "old.paint")
+    with open(path, "wb") as f:
+        f.write(paint.DOC_MAGIC + struct.pack("<H", 1) + paint.record_chunk(stroke, version=1))
+    size = os.path.getsize(path)
+    stroke.uid = 2
+    paint.append_document(path, [stroke], [], [])
+    assert os.path.getsize(path) - size == size - len(paint.DOC_MAGIC) - 2  # appended in the old format
+    loaded, mm, _ = paint.load_document(path)
+    assert sorted(r.depth for r in loaded) == [(3, 0, 1)] * 2
+    mm.close()
+
+
+def test_photo_patch_matches_full_photo(paint):
+    # A repainted rectangle must look like the same part of the photo drawn whole
+    mask = Image.effect_noise((301, 203), 80).point(lambda v: max(0, min(255, v)))
+    rng = random.Random(2)
+    for zoom in (1, 0.37, 1.7, 3):
+        size = (round(mask.width * zoom), round(mask.height * zoom))
+        _, _, full = paint.photo_patch(mask, "red", 0.6, size, (0, 0) + mask.size)
+        for _ in range(20):
+            x, y = rng.randint(-20, 300), rng.randint(-20, 200)
+            patch = paint.photo_patch(mask, "red", 0.6, size, (x, y, x + rng.randint(1, 80), y + rng.randint(1, 80)))
+            if patch:
+                px, py, image = patch
+                diff = ImageChops.difference(full.crop((px, py, px + image.width, py + image.height)), image)
+                assert max(high for _, high in diff.getextrema()) <= (0 if zoom == 1 else 1)
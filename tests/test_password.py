@@ -0,0 +1,74 @@
+import io
+import itertools
+import math
+from collections import Counter
+
+import pytest
+
+
+def test_one_writer_per_store(passwords, tmp_path):
+    store = str(tmp_path / "seen")
+    with passwords.SeenSet(store, 1000) as seen:
+        with pytest.raises(ValueError, match="in use"):
+            passwords.SeenSet(store, 1000)
+        assert seen.add_batch([b"a", b"b"]) == [b"a", b"b"]
+    with passwords.SeenSet(store, 1000) as seen:  # free again once closed
+        assert seen.add_batch([b"b", b"c"]) == [b"c"]
+
+
+@pytest.mark.parametrize("length, minimum, no_repeats", [
+    (2, {"digits": 1, "upper": 1}, False),
+    (3, {"digits": 2, "symbols": 0}, False),
+    (3, {"digits": 1, "upper": 1, "symbols": 1}, True),
+    (3, {"digits": 2, "upper": 1}, True),
+    (1, {"digits": 0, "upper": 0}, False),
+])
+def test_policy_count_is_exact(passwords, length, minimum, no_repeats):
+    policy = passwords.Policy(length, minimum, no_repeats=no_repeats)
+    compliant = sum(policy.check("".join(chars)) for chars in itertools.product(policy.union, repeat=length))
+    assert policy.count() == compliant
+
+
+def test_unique_run_larger_than_the_policy_allows(passwords, tmp_path):
+    policy = passwords.Policy(2, {"digits": 1, "upper": 1})  # 520 compliant passwords, not 36 ** 2
+    with passwords.SeenSet(str(tmp_path / "seen"), 2000) as seen:
+        seen.add_batch([b"%04d" % i for i in range(600)])  # issued under another policy: no bearing on this one
+        with pytest.raises(ValueError, match="fewer than the 600"):
+            passwords.bulk_generate(io.BytesIO(), 600, 2, policy.union, seen=seen, policy=policy)
+        out = io.BytesIO()
+        passwords.bulk_generate(out, 520, 2, policy.union, seen=seen, policy=policy)
+        assert len(set(out.getvalue().split())) == 520
+
+
+def test_unique_run_stops_when_a_run_limit_leaves_too_few(passwords, tmp_path):
+    policy = passwords.Policy(2, {"digits": 0}, max_run=1)  # 90 passwords; count() can only say 100
+    with passwords.SeenSet(str(tmp_path / "seen"), 1000) as seen:
+        with pytest.raises(ValueError, match="no unissued password"):
+            passwords.bulk_generate(io.BytesIO(), 95, 2, policy.union, batch=50, seen=seen, policy=policy)
+
+
+def test_reject_sample_gives_up_after_limit(passwords):
+    pwd, tries = passwords.reject_sample(passwords.Policy(8, {"digits": 1, "upper": 1}))
+    assert passwords.Policy(8, {"digits": 1, "upper": 1}).check(pwd) and tries >= 1
+    strict = passwords.Policy(64, dict.fromkeys(passwords.CHARSETS, 1), no_repeats=True)
+    assert passwords.reject_sample(strict, limit=5) == (None, 5)
+
+
+@pytest.mark.parametrize("separators, capitalize", [("-", "random"), ("-_", "random"), ("-", "none"), ("--", "first")])
+def test_passphrase_bits_match_the_outputs(passwords, tmp_path, separators, capitalize):
+    # Shannon entropy of every equally likely draw, worked out by enumeration
+    source = tmp_path / "words.txt"
+    source.write_text("apple\n4th\nbanana\n123\nzebra\n")
+    passwords.build_wordlist(str(source), str(tmp_path / "words.idx"))
+    words = passwords.Wordlist(str(tmp_path / "words.idx"))
+    flips = [str.capitalize, str] if capitalize == "random" else [str.capitalize if capitalize == "first" else str]
+    draws = Counter(first(a) + gap + second(b)
+                    for a, b in itertools.product(map(words.word, range(words.count)), repeat=2)
+                    for first, second in itertools.product(flips, repeat=2) for gap in separators)
+    total = sum(draws.values())
+    entropy = -sum(n / total * math.log2(n / total) for n in draws.values())
+    assert passwords.passphrase_bits(words, 2, separators, capitalize) == pytest.approx(entropy)
+    with pytest.raises(ValueError, match="separator"):
+        passwords.passphrase_bits(words, 2, "", capitalize)
+    with pytest.raises(ValueError, match="separator"):
+        passwords.make_passphrase(words, 2, "", capitalize)